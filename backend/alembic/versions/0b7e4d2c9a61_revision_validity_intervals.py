@@ -0,0 +1,73 @@
+"""Revision validity intervals
+
+Revision ID: 0b7e4d2c9a61
+Revises: f6d13b92e5a0
+Create Date: 2026-10-19 17:05:12.408215
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0b7e4d2c9a61"
+down_revision = "f6d13b92e5a0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "prompts_revisions",
+        sa.Column(
+            "valid_from",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+    )
+    op.add_column(
+        "prompts_revisions",
+        sa.Column("valid_to", sa.DateTime(timezone=True), nullable=True),
+    )
+
+    # A revision was current from its creation until the next revision of its prompt was created
+    op.execute(
+        """
+        UPDATE prompts_revisions pr SET valid_from = v.created_at, valid_to = v.next_created_at
+        FROM (
+            SELECT id, created_at,
+                LEAD(created_at) OVER (PARTITION BY prompt_id ORDER BY id) AS next_created_at
+            FROM prompts_revisions
+        ) v
+        WHERE pr.id = v.id
+        """
+    )
+    # The current revision of a deleted prompt stopped being current when the prompt was deleted
+    op.execute(
+        """
+        UPDATE prompts_revisions pr SET valid_to = p.updated_at
+        FROM prompts p
+        WHERE p.id = pr.prompt_id AND p.is_active = False AND pr.valid_to IS NULL
+        """
+    )
+
+    op.create_index(
+        "ix_prompts_revisions_prompt_id_valid_from",
+        "prompts_revisions",
+        ["prompt_id", sa.text("valid_from DESC")],
+        unique=False,
+    )
+    op.create_index(
+        "ix_prompts_revisions_validity",
+        "prompts_revisions",
+        [sa.text("tstzrange(valid_from, valid_to, '[)')")],
+        unique=False,
+        postgresql_using="gist",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_prompts_revisions_validity", table_name="prompts_revisions")
+    op.drop_index("ix_prompts_revisions_prompt_id_valid_from", table_name="prompts_revisions")
+    op.drop_column("prompts_revisions", "valid_to")
+    op.drop_column("prompts_revisions", "valid_from")
@@ -0,0 +1,43 @@
+"""Trigram and pattern indexes for slug filtering
+
+Revision ID: 3f1c2a9b7e41
+Revises: d972eee83c94
+Create Date: 2026-10-19 09:12:04.118230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2a9b7e41"
+down_revision = "d972eee83c94"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Exact (lower(slug) = ...) and prefix (lower(slug) LIKE 'abc%') filters
+    op.create_index(
+        "ix_prompts_slug_lower_pattern",
+        "prompts",
+        [sa.text("lower(slug) text_pattern_ops")],
+        unique=False,
+    )
+
+    # Contains (slug ILIKE '%abc%') filters
+    op.create_index(
+        "ix_prompts_slug_trgm",
+        "prompts",
+        ["slug"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"slug": "gin_trgm_ops"},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_prompts_slug_trgm", table_name="prompts")
+    op.drop_index("ix_prompts_slug_lower_pattern", table_name="prompts")
+    # The pg_trgm extension is left installed as other objects may depend on it
@@ -0,0 +1,57 @@
+"""Prompt current revision id
+
+Revision ID: 4d81c6e3b2f9
+Revises: 9c3a6f1d2e84
+Create Date: 2026-10-19 18:31:05.562190
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4d81c6e3b2f9"
+down_revision = "9c3a6f1d2e84"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nothing enforced a single current revision so far, keep the newest one
+    op.execute(
+        """
+        UPDATE prompts_revisions pr SET is_current = False
+        WHERE pr.is_current = True AND EXISTS (
+            SELECT 1 FROM prompts_revisions newer
+            WHERE newer.prompt_id = pr.prompt_id AND newer.is_current = True AND newer.id > pr.id
+        )
+        """
+    )
+    op.create_index(
+        "ux_prompts_revisions_current",
+        "prompts_revisions",
+        ["prompt_id"],
+        unique=True,
+        postgresql_where=sa.text("is_current"),
+    )
+
+    op.add_column("prompts", sa.Column("current_revision_id", sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        "fk_prompts_current_revision_id",
+        "prompts",
+        "prompts_revisions",
+        ["current_revision_id"],
+        ["id"],
+    )
+    op.execute(
+        """
+        UPDATE prompts p SET current_revision_id = pr.id
+        FROM prompts_revisions pr
+        WHERE pr.prompt_id = p.id AND pr.is_current = True
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("fk_prompts_current_revision_id", "prompts", type_="foreignkey")
+    op.drop_column("prompts", "current_revision_id")
+    op.drop_index("ux_prompts_revisions_current", table_name="prompts_revisions")
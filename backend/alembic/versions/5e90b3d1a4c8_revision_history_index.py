@@ -0,0 +1,36 @@
+"""Composite index for paged revision history
+
+Revision ID: 5e90b3d1a4c8
+Revises: c41e7a0d95b3
+Create Date: 2026-10-19 12:40:18.359902
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e90b3d1a4c8"
+down_revision = "c41e7a0d95b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_prompts_revisions_prompt_id_id",
+        "prompts_revisions",
+        ["prompt_id", sa.text("id DESC")],
+        unique=False,
+    )
+    # The composite index also serves every lookup by prompt_id alone
+    op.drop_index(op.f("ix_prompts_revisions_prompt_id"), table_name="prompts_revisions")
+
+
+def downgrade() -> None:
+    op.create_index(
+        op.f("ix_prompts_revisions_prompt_id"),
+        "prompts_revisions",
+        ["prompt_id"],
+        unique=False,
+    )
+    op.drop_index("ix_prompts_revisions_prompt_id_id", table_name="prompts_revisions")
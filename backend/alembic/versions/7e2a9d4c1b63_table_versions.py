@@ -0,0 +1,28 @@
+"""Table versions
+
+Revision ID: 7e2a9d4c1b63
+Revises: b58e0f4a7c32
+Create Date: 2026-10-19 19:41:12.306518
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7e2a9d4c1b63"
+down_revision = "b58e0f4a7c32"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "table_versions",
+        sa.Column("table_name", sa.String(length=64), nullable=False),
+        sa.Column("version", sa.BigInteger(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("table_name"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("table_versions")
@@ -0,0 +1,25 @@
+"""MinHash signatures on prompt revisions
+
+Revision ID: 8b5d0e6c2f17
+Revises: 3f1c2a9b7e41
+Create Date: 2026-10-19 10:02:51.604117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b5d0e6c2f17"
+down_revision = "3f1c2a9b7e41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing revisions are left without a signature, one is computed for them when the
+    # duplicate index loads them
+    op.add_column("prompts_revisions", sa.Column("minhash", sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("prompts_revisions", "minhash")
@@ -0,0 +1,24 @@
+"""Compiled templates on revision bodies
+
+Revision ID: a7f24c8e0d16
+Revises: 5e90b3d1a4c8
+Create Date: 2026-10-19 13:55:02.417683
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a7f24c8e0d16"
+down_revision = "5e90b3d1a4c8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing bodies are left without a compiled template, they are parsed when first rendered
+    op.add_column("prompts_blobs", sa.Column("template", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("prompts_blobs", "template")
@@ -0,0 +1,36 @@
+"""Current catalogue view
+
+Revision ID: b58e0f4a7c32
+Revises: 4d81c6e3b2f9
+Create Date: 2026-10-19 19:02:44.871036
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b58e0f4a7c32"
+down_revision = "4d81c6e3b2f9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW prompts_current AS
+        SELECT
+            p.id, pr.id AS revision_id, p.slug, p.is_active,
+            pr.flattened_hash, pr.created_at, pr.updated_at
+        FROM prompts p
+            INNER JOIN prompts_revisions pr ON pr.id = p.current_revision_id
+        WHERE
+            p.is_active = True
+        WITH DATA
+        """
+    )
+    # Serves the ordered reads, and is required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+    op.execute("CREATE UNIQUE INDEX ux_prompts_current_slug ON prompts_current (slug)")
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW prompts_current")
@@ -0,0 +1,141 @@
+"""Content-addressed, compressed revision bodies
+
+Revision ID: c41e7a0d95b3
+Revises: 8b5d0e6c2f17
+Create Date: 2026-10-19 11:27:40.873512
+
+"""
+import hashlib
+import json
+import zlib
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c41e7a0d95b3"
+down_revision = "8b5d0e6c2f17"
+branch_labels = None
+depends_on = None
+
+# The encoding below must match app.modules.prompts.content, it is repeated here so that this
+# migration keeps working when the application code changes
+
+
+def encode_body(description: str, prompt_text: str) -> bytes:
+    return json.dumps(
+        [description, prompt_text], ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def decode_blob(blobs, content_hash: str) -> bytes:
+    base_hash, payload = blobs[content_hash]
+    if base_hash is None:
+        return zlib.decompress(payload)
+
+    decompressor = zlib.decompressobj(zdict=decode_blob(blobs, base_hash)[-32768:])
+    return decompressor.decompress(payload) + decompressor.flush()
+
+
+def upgrade() -> None:
+    op.create_table(
+        "prompts_blobs",
+        sa.Column("content_hash", sa.String(length=64), nullable=False),
+        sa.Column("base_hash", sa.String(length=64), nullable=True),
+        sa.Column("delta_depth", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["base_hash"],
+            ["prompts_blobs.content_hash"],
+        ),
+        sa.PrimaryKeyConstraint("content_hash"),
+    )
+    op.add_column(
+        "prompts_revisions", sa.Column("content_hash", sa.String(length=64), nullable=True)
+    )
+
+    # Move the existing bodies into the blob table, existing bodies are stored in full
+    connection = op.get_bind()
+    stored_hashes = set()
+    revisions = connection.execute(
+        sa.text("SELECT id, description, prompt_text FROM prompts_revisions")
+    ).all()
+    for revision_id, description, prompt_text in revisions:
+        data = encode_body(description, prompt_text)
+        content_hash = hashlib.sha256(data).hexdigest()
+
+        if content_hash not in stored_hashes:
+            connection.execute(
+                sa.text(
+                    "INSERT INTO prompts_blobs (content_hash, delta_depth, payload) "
+                    "VALUES (:content_hash, 0, :payload)"
+                ),
+                {"content_hash": content_hash, "payload": zlib.compress(data, 9)},
+            )
+            stored_hashes.add(content_hash)
+
+        connection.execute(
+            sa.text("UPDATE prompts_revisions SET content_hash=:content_hash WHERE id=:id"),
+            {"content_hash": content_hash, "id": revision_id},
+        )
+
+    op.alter_column("prompts_revisions", "content_hash", nullable=False)
+    op.create_foreign_key(
+        "fk_prompts_revisions_content_hash",
+        "prompts_revisions",
+        "prompts_blobs",
+        ["content_hash"],
+        ["content_hash"],
+    )
+    op.create_index(
+        op.f("ix_prompts_revisions_content_hash"),
+        "prompts_revisions",
+        ["content_hash"],
+        unique=False,
+    )
+    op.drop_column("prompts_revisions", "description")
+    op.drop_column("prompts_revisions", "prompt_text")
+
+
+def downgrade() -> None:
+    op.add_column(
+        "prompts_revisions", sa.Column("prompt_text", sa.String(length=4096), nullable=True)
+    )
+    op.add_column(
+        "prompts_revisions", sa.Column("description", sa.String(length=4096), nullable=True)
+    )
+
+    connection = op.get_bind()
+    blobs = {
+        r[0]: (r[1], r[2])
+        for r in connection.execute(
+            sa.text("SELECT content_hash, base_hash, payload FROM prompts_blobs")
+        ).all()
+    }
+    revisions = connection.execute(
+        sa.text("SELECT id, content_hash FROM prompts_revisions")
+    ).all()
+    for revision_id, content_hash in revisions:
+        description, prompt_text = json.loads(decode_blob(blobs, content_hash).decode("utf-8"))
+        connection.execute(
+            sa.text(
+                "UPDATE prompts_revisions SET description=:description, prompt_text=:prompt_text "
+                "WHERE id=:id"
+            ),
+            {"description": description, "prompt_text": prompt_text, "id": revision_id},
+        )
+
+    op.alter_column("prompts_revisions", "description", nullable=False)
+    op.alter_column("prompts_revisions", "prompt_text", nullable=False)
+    op.drop_index(op.f("ix_prompts_revisions_content_hash"), table_name="prompts_revisions")
+    op.drop_constraint(
+        "fk_prompts_revisions_content_hash", "prompts_revisions", type_="foreignkey"
+    )
+    op.drop_column("prompts_revisions", "content_hash")
+    op.drop_table("prompts_blobs")
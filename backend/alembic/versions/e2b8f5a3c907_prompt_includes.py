@@ -0,0 +1,61 @@
+"""Prompt includes and flattened revision bodies
+
+Revision ID: e2b8f5a3c907
+Revises: a7f24c8e0d16
+Create Date: 2026-10-19 15:08:33.902714
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e2b8f5a3c907"
+down_revision = "a7f24c8e0d16"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "prompts_includes",
+        sa.Column("prompt_id", sa.Integer(), nullable=False),
+        sa.Column("included_prompt_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["prompt_id"],
+            ["prompts.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["included_prompt_id"],
+            ["prompts.id"],
+        ),
+        sa.PrimaryKeyConstraint("prompt_id", "included_prompt_id"),
+    )
+    op.create_index(
+        op.f("ix_prompts_includes_included_prompt_id"),
+        "prompts_includes",
+        ["included_prompt_id"],
+        unique=False,
+    )
+
+    # Existing revisions have no includes, so their flattened body is their body
+    op.add_column(
+        "prompts_revisions", sa.Column("flattened_hash", sa.String(length=64), nullable=True)
+    )
+    op.execute("UPDATE prompts_revisions SET flattened_hash = content_hash")
+    op.alter_column("prompts_revisions", "flattened_hash", nullable=False)
+    op.create_foreign_key(
+        "fk_prompts_revisions_flattened_hash",
+        "prompts_revisions",
+        "prompts_blobs",
+        ["flattened_hash"],
+        ["content_hash"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        "fk_prompts_revisions_flattened_hash", "prompts_revisions", type_="foreignkey"
+    )
+    op.drop_column("prompts_revisions", "flattened_hash")
+    op.drop_index(op.f("ix_prompts_includes_included_prompt_id"), table_name="prompts_includes")
+    op.drop_table("prompts_includes")
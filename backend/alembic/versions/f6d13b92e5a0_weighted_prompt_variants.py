@@ -0,0 +1,40 @@
+"""Weighted A/B prompt variants
+
+Revision ID: f6d13b92e5a0
+Revises: e2b8f5a3c907
+Create Date: 2026-10-19 16:21:47.150329
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f6d13b92e5a0"
+down_revision = "e2b8f5a3c907"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "prompts",
+        sa.Column("variants_version", sa.Integer(), server_default=sa.text("0"), nullable=False),
+    )
+    op.add_column(
+        "prompts_revisions",
+        sa.Column("variant_weight", sa.Integer(), server_default=sa.text("0"), nullable=False),
+    )
+    # Variant lookups only ever look at the few revisions with a weight
+    op.create_index(
+        "ix_prompts_revisions_variants",
+        "prompts_revisions",
+        ["prompt_id"],
+        unique=False,
+        postgresql_where=sa.text("variant_weight > 0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_prompts_revisions_variants", table_name="prompts_revisions")
+    op.drop_column("prompts_revisions", "variant_weight")
+    op.drop_column("prompts", "variants_version")
@@ -1,11 +1,18 @@
-import time
-
 from app.config import BaseConfig
+from app.core.admission import AdmissionMiddleware, get_admission_controller
+from app.core.compression import (
+    CompressionMiddleware,
+    get_available_encodings,
+    get_compression_cache,
+    get_compression_levels,
+)
+from app.core.deadlines import DeadlineMiddleware
 from app.core.error_handling import ERROR_HANDLERS
+from app.core.metrics import MetricsMiddleware, get_metrics_registry
+from app.core.middleware import ResponseHeadersMiddleware, parse_route_values
 
 from dpn_pyutils.common import get_logger
 from fastapi import APIRouter, FastAPI
-from fastapi.middleware.gzip import GZipMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
@@ -72,6 +79,42 @@ def create_webapp(config: BaseConfig) -> BotpromptsWebapp:
     ###
     ### HTTP section
     ###
+
+    # Added first so that the time spent queueing for admission does not count towards the
+    # deadline of a request
+    if config.DEADLINE_ENABLE:
+        log.info("Request deadlines enabled")
+        log.debug("Request deadline settings:")
+        log.debug("\t Default seconds: %s", config.DEADLINE_SECONDS)
+        log.debug("\t Route seconds: %s", config.DEADLINE_ROUTE_SECONDS)
+        log.debug("\t Lock timeout seconds: %s", config.DEADLINE_LOCK_TIMEOUT_SECONDS)
+
+        app.add_middleware(
+            DeadlineMiddleware,
+            default_seconds=float(config.DEADLINE_SECONDS),
+            route_seconds=parse_route_values(config.DEADLINE_ROUTE_SECONDS, float),
+            router=app.router,
+        )
+    else:
+        log.info("Request deadlines disabled")
+
+    # Added next so that it runs after ProxyHeadersMiddleware has set the client address, and
+    # its responses still get the CORS headers
+    if config.ADMISSION_ENABLE:
+        log.info("Admission control enabled")
+        log.debug("Admission control settings:")
+        log.debug("\t Rate per second: %s", config.ADMISSION_RATE_PER_SECOND)
+        log.debug("\t Burst: %s", config.ADMISSION_BURST)
+        log.debug("\t Concurrency: %s", config.ADMISSION_CONCURRENCY)
+        log.debug("\t Route concurrency: %s", config.ADMISSION_ROUTE_CONCURRENCY)
+        log.debug("\t Max queue: %s", config.ADMISSION_MAX_QUEUE)
+
+        app.add_middleware(
+            AdmissionMiddleware, controller=get_admission_controller(), router=app.router
+        )
+    else:
+        log.info("Admission control disabled")
+
     if config.CORS_ENABLE:
         log.info("CORS Enabled")
         log.debug("CORS settings:")
@@ -108,13 +151,20 @@ def create_webapp(config: BaseConfig) -> BotpromptsWebapp:
         log.info("Proxy Headers disabled")
 
     if config.GZIP_ENABLE:
-        log.info("Gzip Enabled")
-        log.debug("Gzip settings")
-        log.debug("\t Gzip minimum size: %d", int(config.GZIP_MINIMUM_SIZE))
+        log.info("Compression Enabled")
+        log.debug("Compression settings")
+        log.debug("\t Compression minimum size: %d", int(config.GZIP_MINIMUM_SIZE))
+        log.debug("\t Compression encodings: %s", get_available_encodings())
+        log.debug("\t Compression levels: %s", get_compression_levels())
 
-        app.add_middleware(GZipMiddleware, minimum_size=int(config.GZIP_MINIMUM_SIZE))
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=int(config.GZIP_MINIMUM_SIZE),
+            levels=get_compression_levels(),
+            cache=get_compression_cache(),
+        )
     else:
-        log.info("Gzip Disabled")
+        log.info("Compression Disabled")
 
     if config.THH_ENABLE:
         log.info("Trusted Host Headers")
@@ -131,28 +181,21 @@ def create_webapp(config: BaseConfig) -> BotpromptsWebapp:
     ### Middleware section
     ###
 
-    @app.middleware("http")
-    async def add_process_time_header(request, call_next):
-        do_add_header: bool = True
-        for exclude_path in EXCLUDE_PROCESS_TIME_PATHS:
-            if request.url.path.startswith(f"{config.API_URL_PREFIX_V1}{exclude_path}"):
-                do_add_header = False
-
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-
-        if do_add_header:
-            response.headers["X-Process-Time"] = str(f"{process_time:0.4f} sec")
-
-        return response
-
-    @app.middleware("http")
-    async def replace_server_name(request, call_next):
-        response = await call_next(request)
-        response.headers["server"] = f"{config.APP_NAME}/{config.APP_VERSION}"
-        return response
-
+    app.add_middleware(
+        ResponseHeadersMiddleware,
+        server_name=f"{config.APP_NAME}/{config.APP_VERSION}",
+        exclude_process_time_prefixes=[
+            f"{config.API_URL_PREFIX_V1}{exclude_path}"
+            for exclude_path in EXCLUDE_PROCESS_TIME_PATHS
+        ],
+    )
+
+    # Added last so that the recorded latency includes the time spent in the other middleware
+    if config.METRICS_ENABLE:
+        log.info("Request metrics enabled")
+        app.add_middleware(MetricsMiddleware, registry=get_metrics_registry(), router=app.router)
+    else:
+        log.info("Request metrics disabled")
 
     ###
     ### Router section
@@ -163,6 +206,11 @@ def create_webapp(config: BaseConfig) -> BotpromptsWebapp:
 
     main_router.include_router(api_router, prefix=f"{config.API_URL_PREFIX_V1}")
 
+    # Served outside the API prefix, so that it is not proxied with the public API
+    from app.modules.metrics.routing import get_router__metrics
+
+    main_router.include_router(get_router__metrics(), include_in_schema=False)
+
     # Connect the router structure to the entire app
     app.include_router(main_router)
 
@@ -175,18 +223,25 @@ def create_webapp(config: BaseConfig) -> BotpromptsWebapp:
             r.methods if hasattr(r, "methods") else "N/A",  # type: ignore
         )
 
+    from app.modules.prompts.similarity import get_similarity_index
+    from app.modules.prompts.snapshot import get_snapshot_store
+
     @app.on_event("startup")
-    def on_startup() -> None:
+    async def on_startup() -> None:
         """
         Events running on startup
         """
-        pass
+        if config.CATALOGUE_SNAPSHOT_ENABLE:
+            await get_snapshot_store().start()
+
+        get_similarity_index().start_build()
 
     @app.on_event("shutdown")
-    def on_shutdown() -> None:
+    async def on_shutdown() -> None:
         """
         Events running on shutdown
         """
-        pass
+        if config.CATALOGUE_SNAPSHOT_ENABLE:
+            await get_snapshot_store().stop()
 
     return app
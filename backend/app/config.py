@@ -24,6 +24,95 @@ class BaseConfig:
     SLUG_MAX_LENGTH: int = 12
     PROMPT_MAX_LENGTH: int = 1000
 
+    # Decoded revision bodies kept in memory, at least two per current prompt keeps a whole
+    # catalogue of bodies and flattened bodies cached
+    BODY_CACHE_SIZE: int = 4096
+
+    # Number of revisions returned per page of revision history
+    REVISION_HISTORY_PAGE_SIZE: int = 20
+
+    # Compiled prompt templates kept in memory, and how long a slug keeps its cached revision
+    TEMPLATE_CACHE_SIZE: int = 1024
+    TEMPLATE_SLUG_TTL_SECONDS: float = 5.0
+
+    # Similar prompt recommendations, the index file is memory-mapped and shared by all workers
+    SIMILARITY_INDEX_PATH: str = "similarity.index"
+    SIMILARITY_DIMENSIONS: int = 4096
+
+    # Near-duplicate detection on create and update, the mode is one of "off", "warn" or "reject"
+    DUPLICATE_CHECK_MODE: str = "warn"
+    DUPLICATE_SIMILARITY_THRESHOLD: float = 0.8
+    MINHASH_PERMUTATIONS: int = 128
+    MINHASH_BANDS: int = 16
+
+    # Refresh of the current catalogue view that serves the current and command lists
+    CATALOGUE_REFRESH_SETTLE_SECONDS: float = 0.5
+    CATALOGUE_REFRESH_MAX_WAIT_SECONDS: float = 5.0
+
+    # Snapshot of the current catalogue, loaded on startup and checked against the database
+    CATALOGUE_SNAPSHOT_ENABLE: bool = True
+    CATALOGUE_SNAPSHOT_PATH: str = "catalogue.snapshot"
+    CATALOGUE_SNAPSHOT_CHECK_SECONDS: float = 5.0
+
+    # Releases of the catalogue, created automatically once writes have settled for a while. All
+    # releases are kept unless a retention is set, and even then only releases older than the
+    # year they may be cached for are deleted, see app.modules.prompts.releases
+    RELEASE_AUTO_ENABLE: bool = True
+    RELEASE_SETTLE_SECONDS: float = 30.0
+    RELEASE_MAX_WAIT_SECONDS: float = 300.0
+    RELEASE_LIST_LIMIT: int = 20
+    RELEASE_RETENTION: int = 0
+
+    # Static export of the read-mostly endpoints for nginx, see config/snippet.nginx.conf
+    STATIC_EXPORT_ENABLE: bool = False
+    STATIC_EXPORT_PATH: str = "static"
+    STATIC_EXPORT_SETTLE_SECONDS: float = 1.0
+    STATIC_EXPORT_MAX_WAIT_SECONDS: float = 10.0
+
+    # Adapter result cache, bounded by the estimated memory of the cached results
+    RESULT_CACHE_ENABLE: bool = True
+    RESULT_CACHE_MAX_BYTES: int = 67108864
+
+    # Levels of the response compression, bodies are compressed once and the compressed bodies
+    # are cached up to a memory bound
+    COMPRESSION_GZIP_LEVEL: int = 9
+    COMPRESSION_BROTLI_LEVEL: int = 9
+    COMPRESSION_ZSTD_LEVEL: int = 15
+    COMPRESSION_CACHE_MAX_BYTES: int = 33554432
+
+    # Coalescing of identical concurrent reads, and how long a request waits for a shared read
+    SINGLE_FLIGHT_ENABLE: bool = True
+    SINGLE_FLIGHT_TIMEOUT_SECONDS: float = 10.0
+
+    # Admission control, a token bucket per client and a concurrency limit per route name, with
+    # route limits written as "route:name=limit,...". Past the queue, requests are shed
+    ADMISSION_ENABLE: bool = True
+    ADMISSION_RATE_PER_SECOND: float = 20.0
+    ADMISSION_BURST: int = 40
+    ADMISSION_MAX_CLIENTS: int = 65536
+    ADMISSION_CLIENT_KEY_HEADER: str = ""
+    ADMISSION_CONCURRENCY: int = 32
+    ADMISSION_ROUTE_CONCURRENCY: str = "prompts:list=4,prompts:single=64"
+    ADMISSION_MAX_QUEUE: int = 64
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 1.0
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
+
+    # Deadlines per route name, written as "route:name=seconds,...", which also bound the
+    # statement and lock timeouts of the database transactions of a request
+    DEADLINE_ENABLE: bool = True
+    DEADLINE_SECONDS: float = 10.0
+    DEADLINE_ROUTE_SECONDS: str = "prompts:single=2,prompts:current-list=2,prompts:list=5"
+    DEADLINE_LOCK_TIMEOUT_SECONDS: float = 2.0
+
+    # Prometheus metrics of the requests by route name, served at /metrics outside the API
+    # prefix, and only to clients that send the token as a bearer token when one is set
+    METRICS_ENABLE: bool = True
+    METRICS_TOKEN: str = ""
+
+    # Circuit breaker of the database, opened after consecutive connection failures
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RESET_SECONDS: float = 10.0
+
     CORS_ENABLE: bool
     CORS_ALLOW_ORIGINS: List[str]
     CORS_ALLOW_METHODS: List[str]
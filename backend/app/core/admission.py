@@ -0,0 +1,303 @@
+"""
+This module contains the admission control of the app.
+
+Every request takes a token from the token bucket of its client, keyed by the client address
+that ProxyHeadersMiddleware sets, or by an API key header when one is configured. A client whose
+bucket is empty gets a 429 straight away. Requests to a route then take a slot of the
+concurrency limit of the route name, for example "prompts:list", waiting in a bounded queue when
+every slot is taken. When the queue is full, or a request waits longer than the queue timeout,
+the request is shed with a 503. Both carry a Retry-After header.
+
+Shedding early keeps the requests that are admitted fast under overload, rather than letting
+every request queue in the worker until they all time out. Limits are per process.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Tuple
+
+from app.config import get_config
+from app.core.middleware import RouteNames, parse_route_values
+from dpn_pyutils.common import get_logger
+from starlette import status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.routing import Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+log = get_logger(__name__)
+
+
+class TokenBuckets:
+    """
+    A token bucket per client key, refilled at rate tokens per second up to burst tokens. The
+    least recently seen clients are forgotten past max_clients, which refills their buckets.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str, now: float) -> float:
+        """
+        Takes a token from the bucket of a client, returning 0.0 when one was taken, or the
+        seconds until the bucket has a token again
+        """
+
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+
+        wait_seconds = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait_seconds = (1.0 - tokens) / self.rate
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+        return wait_seconds
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class ConcurrencyLimit:
+    """
+    Lets at most limit requests run at once, queueing at most max_queue more in arrival order.
+    Must be used from the event loop.
+    """
+
+    def __init__(self, limit: int, max_queue: int) -> None:
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        """
+        The number of requests in the queue
+        """
+
+        return len(self._waiters)
+
+    async def acquire(self, timeout_seconds: float) -> bool:
+        """
+        Takes a slot, waiting at most timeout_seconds for one, and returns whether it was taken.
+        Returns False straight away when the queue is full.
+        """
+
+        if self.in_flight < self.limit and len(self._waiters) == 0:
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait((waiter,), timeout=timeout_seconds)
+        except asyncio.CancelledError:
+            # A slot that was handed over as the request was cancelled is passed on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+
+        return not waiter.cancelled()
+
+    def release(self) -> None:
+        """
+        Gives a slot back, handing it over to the first request in the queue
+        """
+
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+
+class AdmissionController:
+    """
+    The client token buckets and route concurrency limits of this process, and their counters.
+    """
+
+    def __init__(
+        self,
+        buckets: TokenBuckets,
+        default_limit: int,
+        route_limits: Dict[str, int],
+        max_queue: int,
+        queue_timeout_seconds: float,
+        retry_after_seconds: int,
+        client_key_header: str = "",
+    ) -> None:
+        self.buckets = buckets
+        self.default_limit = default_limit
+        self.route_limits = route_limits
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.client_key_header = client_key_header.lower()
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+        self._limits: Dict[str, ConcurrencyLimit] = {}
+
+    def get_client_key(self, scope: Scope) -> str:
+        """
+        Gets the key of the token bucket of a request, the API key when the header is configured
+        and sent, and otherwise the client address
+        """
+
+        if self.client_key_header:
+            api_key = Headers(scope=scope).get(self.client_key_header)
+            if api_key:
+                return f"key:{api_key}"
+
+        client = scope.get("client")
+
+        return f"addr:{client[0] if client else ''}"
+
+    def get_limit(self, route_name: str) -> ConcurrencyLimit:
+        """
+        Gets the concurrency limit of a route name
+        """
+
+        limit = self._limits.get(route_name)
+        if limit is None:
+            limit = ConcurrencyLimit(
+                self.route_limits.get(route_name, self.default_limit), self.max_queue
+            )
+            self._limits[route_name] = limit
+
+        return limit
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Gets the counters of the admission control, and the load of every route name
+        """
+
+        return {
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "clients": len(self.buckets),
+            "routes": {
+                name: {"limit": limit.limit, "in_flight": limit.in_flight, "waiting": limit.waiting}
+                for name, limit in self._limits.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Rate limits requests per client and limits the concurrency of every route name, shedding the
+    requests that cannot be admitted.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController, router: Router) -> None:
+        self.app = app
+        self.controller = controller
+        self.route_names = RouteNames(router)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        wait_seconds = controller.buckets.take(controller.get_client_key(scope), time.monotonic())
+        if wait_seconds > 0.0:
+            controller.rate_limited += 1
+            await self.reject(
+                scope,
+                receive,
+                send,
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "RATE_LIMITED",
+                math.ceil(wait_seconds),
+            )
+            return
+
+        route_name = self.route_names.get(scope)
+        if route_name is None:
+            controller.admitted += 1
+            await self.app(scope, receive, send)
+            return
+
+        limit = controller.get_limit(route_name)
+        if not await limit.acquire(controller.queue_timeout_seconds):
+            controller.shed += 1
+            await self.reject(
+                scope,
+                receive,
+                send,
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "OVERLOADED",
+                controller.retry_after_seconds,
+            )
+            return
+
+        controller.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def reject(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        status_code: int,
+        detail: str,
+        retry_after_seconds: int,
+    ) -> None:
+        """
+        Sends an error response in the format of AppHTTPError, with a Retry-After header
+        """
+
+        response = JSONResponse(
+            {"error": True, "detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, retry_after_seconds))},
+        )
+        await response(scope, receive, send)
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    """
+    Gets the admission controller of this process
+    """
+
+    config = get_config()
+
+    return AdmissionController(
+        buckets=TokenBuckets(
+            float(config.ADMISSION_RATE_PER_SECOND),
+            int(config.ADMISSION_BURST),
+            int(config.ADMISSION_MAX_CLIENTS),
+        ),
+        default_limit=int(config.ADMISSION_CONCURRENCY),
+        route_limits=parse_route_values(config.ADMISSION_ROUTE_CONCURRENCY, int),
+        max_queue=int(config.ADMISSION_MAX_QUEUE),
+        queue_timeout_seconds=float(config.ADMISSION_QUEUE_TIMEOUT_SECONDS),
+        retry_after_seconds=int(config.ADMISSION_RETRY_AFTER_SECONDS),
+        client_key_header=str(config.ADMISSION_CLIENT_KEY_HEADER),
+    )
@@ -0,0 +1,277 @@
+"""
+This module contains the response compression.
+
+GZipMiddleware compresses every response again on every request at a fast level. Most of the
+responses of this app are the same bytes served many times, so this middleware compresses a
+body once, at a high level, and keeps the compressed body in a memory-bounded LRU. The LRU is
+keyed by the encoding and the sha256 of the body, never by an ETag, which a route may not derive
+from the exact bytes it sends. Hashing a body is much cheaper than compressing it.
+
+The encoding is negotiated from Accept-Encoding between brotli, zstd and gzip, in that order of
+preference. Brotli and zstd are only offered when their packages are installed. Streamed
+responses cannot be cached, so they are compressed as they are sent, with gzip at a mid level.
+Bodies smaller than the minimum size are sent as they are.
+"""
+import gzip
+import hashlib
+import zlib
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
+
+from app.config import get_config
+from app.database.cache import MISSING, ResultCache
+from dpn_pyutils.common import get_logger
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+log = get_logger(__name__)
+
+ENCODING_PREFERENCE = ("br", "zstd", "gzip")
+"""
+The encodings that can be negotiated, most preferred first
+"""
+
+STREAM_GZIP_LEVEL = 6
+"""
+Streamed bodies are compressed once per request, so a mid level is used
+"""
+
+THREADPOOL_MINIMUM_SIZE = 65536
+"""
+Bodies at least this large are compressed in the thread pool rather than on the event loop
+"""
+
+
+def get_available_encodings() -> Tuple[str, ...]:
+    """
+    Gets the encodings whose compressor is installed, most preferred first
+    """
+
+    installed = {"br": brotli is not None, "zstd": zstandard is not None, "gzip": True}
+
+    return tuple(e for e in ENCODING_PREFERENCE if installed[e])
+
+
+def compress(encoding: str, data: bytes, level: int) -> bytes:
+    """
+    Compresses data with the supplied encoding and level
+    """
+
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str, encodings: Tuple[str, ...]) -> str | None:
+    """
+    Picks the encoding with the highest quality in the Accept-Encoding header, preferring the
+    earlier of the supplied encodings on a tie. Clients send a handful of distinct headers, so
+    the result is cached by header.
+    """
+
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+
+    best_encoding, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+
+    return best_encoding
+
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies with the encoding negotiated from Accept-Encoding, caching the
+    compressed bodies.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        levels: Dict[str, int],
+        cache: ResultCache,
+        encodings: Sequence[str] | None = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = levels
+        self.cache = cache
+        self.encodings = tuple(encodings or get_available_encodings())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Streamed bodies are only ever gzipped
+        can_stream = negotiate(accept_encoding, ("gzip",)) is not None
+        responder = CompressionResponder(self, send, encoding, can_stream)
+        await self.app(scope, receive, responder.send)
+
+    async def get_compressed(self, encoding: str, body: bytes) -> bytes:
+        """
+        Gets the compressed body from the cache, compressing and caching it on a miss
+        """
+
+        key = (encoding, hashlib.sha256(body).digest())
+
+        compressed = self.cache.get(key)
+        if compressed is MISSING:
+            level = self.levels[encoding]
+            if len(body) >= THREADPOOL_MINIMUM_SIZE:
+                compressed = await run_in_threadpool(compress, encoding, body, level)
+            else:
+                compressed = compress(encoding, body, level)
+
+            self.cache.put(key, compressed)
+
+        return compressed
+
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    """
+    Marks the entity tag of a response weak once its body is compressed, as the compressed bytes
+    differ from those the strong tag was made for. If-None-Match is compared weakly, so the tag
+    still matches the uncompressed response.
+    """
+
+    etag = headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+
+class CompressionResponder:
+    """
+    Holds back the start of a response until its first body message shows whether the body is
+    complete, then sends it compressed when it is worth it.
+    """
+
+    def __init__(
+        self, middleware: CompressionMiddleware, send: Send, encoding: str, can_stream: bool
+    ) -> None:
+        self.middleware = middleware
+        self.encoding = encoding
+        self.can_stream = can_stream
+
+        self._send = send
+        self._start_message: Message | None = None
+        self._is_started = False
+        self._stream_compressor = None
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self._start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self._start_message is None:
+            await self._send(message)
+            return
+
+        if self._is_started:
+            if self._stream_compressor is None:
+                await self._send(message)
+            else:
+                await self._send_stream_chunk(message)
+            return
+
+        self._is_started = True
+        headers = MutableHeaders(raw=list(self._start_message["headers"]))
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if "content-encoding" in headers or (
+            not more_body and len(body) < self.middleware.minimum_size
+        ):
+            await self._send(self._start_message)
+            await self._send(message)
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+
+        if more_body and not self.can_stream:
+            await self._send({**self._start_message, "headers": headers.raw})
+            await self._send(message)
+            return
+
+        if more_body:
+            self._stream_compressor = zlib.compressobj(STREAM_GZIP_LEVEL, zlib.DEFLATED, 31)
+            headers["Content-Encoding"] = "gzip"
+            weaken_etag(headers)
+            del headers["Content-Length"]
+            await self._send({**self._start_message, "headers": headers.raw})
+            await self._send_stream_chunk(message)
+            return
+
+        compressed = await self.middleware.get_compressed(self.encoding, body)
+        headers["Content-Encoding"] = self.encoding
+        headers["Content-Length"] = str(len(compressed))
+        weaken_etag(headers)
+        await self._send({**self._start_message, "headers": headers.raw})
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    async def _send_stream_chunk(self, message: Message) -> None:
+        compressed = self._stream_compressor.compress(message.get("body", b""))  # type: ignore
+        more_body = message.get("more_body", False)
+        if not more_body:
+            compressed += self._stream_compressor.flush()  # type: ignore
+
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+
+@lru_cache()
+def get_compression_cache() -> ResultCache:
+    """
+    Gets the compressed body cache for this process
+    """
+
+    return ResultCache(int(get_config().COMPRESSION_CACHE_MAX_BYTES))
+
+
+def get_compression_levels() -> Dict[str, int]:
+    """
+    Gets the configured compression level of every encoding
+    """
+
+    config = get_config()
+
+    return {
+        "br": int(config.COMPRESSION_BROTLI_LEVEL),
+        "zstd": int(config.COMPRESSION_ZSTD_LEVEL),
+        "gzip": int(config.COMPRESSION_GZIP_LEVEL),
+    }
@@ -0,0 +1,131 @@
+"""
+This module contains the per-request deadlines.
+
+Every request gets a deadline from the time budget of its route name, or the default budget. The
+deadline is kept in a context variable, which the thread pool copies, so the database sessions
+of the request can read the remaining budget. Every transaction they begin sets the remaining
+budget as its statement timeout, and its lock timeout, see app.database.meta. A request whose
+response has not started by its deadline is cancelled and gets a 504.
+
+The deadline only covers a request up to the start of its response. Streamed bodies and the
+background tasks that run after the response are not bound by it.
+
+Cancelling a request only interrupts it where it awaits. Database work that runs synchronously
+on the event loop, such as the adapter calls of the write endpoints, cannot be interrupted, and
+is only bounded by the statement and lock timeouts of its transaction, after it has held up the
+loop. Work in the thread pool carries on after its request has been cancelled, until it finishes
+or its statement timeout cancels it. The reads that are coalesced with single flight run on
+sessions of their own for this reason, and are bound by the remaining budget of the request that
+started them. Debounced background work starts without a deadline.
+"""
+import math
+import time
+from contextvars import ContextVar
+from typing import Dict
+
+import anyio
+from app.core.errors import AppHTTPError
+from app.core.middleware import RouteNames
+from dpn_pyutils.common import get_logger
+from starlette import status
+from starlette.responses import JSONResponse
+from starlette.routing import Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+log = get_logger(__name__)
+
+
+class DeadlineExceededError(AppHTTPError):
+    """
+    Raised when a request has run out of its time budget
+    """
+
+    def __init__(self) -> None:
+        super().__init__(detail="DEADLINE_EXCEEDED", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+class Deadline:
+    """
+    The time, on the time.monotonic clock, by which a request must have started its response.
+    """
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, expires_at: float | None) -> None:
+        self.expires_at = expires_at
+
+
+current_deadline: ContextVar[Deadline | None] = ContextVar("current_deadline", default=None)
+"""
+The deadline of the request being handled. It is shared by the copies of the context made for
+the thread pool and for tasks, so that lifting it is seen by all of them.
+"""
+
+
+def get_remaining_seconds() -> float | None:
+    """
+    Gets the seconds left until the deadline of the current request, or None when there is no
+    deadline
+    """
+
+    deadline = current_deadline.get()
+    if deadline is None or deadline.expires_at is None:
+        return None
+
+    return deadline.expires_at - time.monotonic()
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request the time budget of its route name, and answers requests that have not
+    started their response within it with a 504.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        default_seconds: float,
+        route_seconds: Dict[str, float],
+        router: Router,
+    ) -> None:
+        self.app = app
+        self.default_seconds = default_seconds
+        self.route_seconds = route_seconds
+        self.route_names = RouteNames(router)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        seconds = self.route_seconds.get(self.route_names.get(scope), self.default_seconds)
+        deadline = Deadline(time.monotonic() + seconds)
+        token = current_deadline.set(deadline)
+        is_started = False
+
+        with anyio.CancelScope(deadline=anyio.current_time() + seconds) as cancel_scope:
+
+            async def send_with_deadline(message: Message) -> None:
+                nonlocal is_started
+                if message["type"] == "http.response.start":
+                    is_started = True
+                    deadline.expires_at = None
+                    cancel_scope.deadline = math.inf
+
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_deadline)
+            finally:
+                current_deadline.reset(token)
+
+        # anyio 3 has no cancelled_caught, the scope is only cancelled by its deadline here
+        if cancel_scope.cancel_called and not is_started:
+            log.warning(
+                "Request to '%s' exceeded its deadline of %s seconds", scope["path"], seconds
+            )
+            response = JSONResponse(
+                {"error": True, "detail": "DEADLINE_EXCEEDED"},
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            )
+            await response(scope, receive, send)
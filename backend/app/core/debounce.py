@@ -0,0 +1,88 @@
+"""
+This module contains a debouncer for work that should run once a burst of writes has settled.
+"""
+import asyncio
+import contextvars
+import time
+from typing import Awaitable, Callable, Set
+
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+
+class Debouncer:
+    """
+    Runs a coroutine function once no trigger has arrived for settle_seconds. A steady stream
+    of triggers never delays the run by more than max_wait_seconds after the first trigger.
+
+    The coroutine runs on the event loop, so it must move database and file work to the thread
+    pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        callback: Callable[[], Awaitable[None]],
+        settle_seconds: float,
+        max_wait_seconds: float,
+    ) -> None:
+        self.name = name
+        self.callback = callback
+        self.settle_seconds = settle_seconds
+        self.max_wait_seconds = max_wait_seconds
+
+        self._timer: asyncio.TimerHandle | None = None
+        self._first_trigger: float | None = None
+        self._running: Set[asyncio.Task] = set()
+
+    @property
+    def is_pending(self) -> bool:
+        """
+        Whether a run is scheduled and has not started yet
+        """
+
+        return self._timer is not None
+
+    @property
+    def running(self) -> int:
+        """
+        The number of runs that have started and not finished
+        """
+
+        return len(self._running)
+
+    def trigger(self) -> None:
+        """
+        Schedules a run, pushing back a pending run that has not started yet. Must be called from
+        the event loop.
+        """
+
+        now = time.monotonic()
+        if self._first_trigger is None:
+            self._first_trigger = now
+
+        delay = min(self.settle_seconds, self._first_trigger + self.max_wait_seconds - now)
+        if self._timer is not None:
+            self._timer.cancel()
+
+        # The run starts in an empty context, so that it does not inherit the deadline of the
+        # request that triggered it
+        self._timer = asyncio.get_running_loop().call_later(
+            max(delay, 0.0), self._fire, context=contextvars.Context()
+        )
+
+    def _fire(self) -> None:
+        self._timer = None
+        self._first_trigger = None
+
+        # The loop only keeps weak references to tasks
+        task = asyncio.get_running_loop().create_task(self._run())
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self) -> None:
+        try:
+            await self.callback()
+        except Exception:
+            log.exception("Debounced task '%s' failed", self.name)
@@ -1,12 +1,14 @@
 from typing import TYPE_CHECKING, Callable, Dict, List, Type
 
 from app.core.errors import AppHTTPError
+from app.database.breaker import is_deadline_error
 from dpn_pyutils.common import get_logger
 from fastapi import Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from sqlalchemy.exc import OperationalError
 from starlette import status
 
 log = get_logger(__name__)
@@ -77,10 +79,32 @@ async def application_http_error_handler(request: Request, exc: AppHTTPError):
     return JSONResponse(
         status_code=exc.status_code,
         content=jsonable_encoder({"error": True, "detail": exc.detail}),
+        headers=exc.headers,
+    )
+
+
+async def database_error_handler(request: Request, exc: OperationalError):
+    """
+    Reports statement and lock timeouts as an exceeded deadline, and other operational database
+    errors as the database being unavailable
+    """
+
+    if is_deadline_error(exc):
+        return JSONResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            content={"error": True, "detail": "DEADLINE_EXCEEDED"},
+        )
+
+    log.error("Database error while handling '%s': %s", request.url.path, exc)
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": True, "detail": "DATABASE_UNAVAILABLE"},
     )
 
 
 ERROR_HANDLERS: Dict[Type[Exception], Callable] = {
     RequestValidationError: validation_error_handler,
     AppHTTPError: application_http_error_handler,
+    OperationalError: database_error_handler,
 }
@@ -0,0 +1,415 @@
+"""
+This module contains the Prometheus metrics of the app.
+
+Counters and histograms are recorded into a shard per thread, which only that thread writes, so
+recording a value takes no lock. The requests are recorded on the event loop thread and the
+database pool events on the thread pool threads. A scrape sums the shards and adds the values of
+the collectors, which read gauges such as queue depths at scrape time, and renders them in the
+Prometheus text format.
+
+Metrics are per worker process. Every sample carries a worker label, so that the counters of the
+workers that answer successive scrapes are kept apart. Under gunicorn the label is the index of
+the worker, which a worker that replaces another takes over, see gunicorn.conf.py, so restarts
+do not create new series. Elsewhere it is the process id.
+"""
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from app.core.middleware import RouteNames
+from dpn_pyutils.common import get_logger
+from starlette.routing import Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+log = get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+"""
+Media type of the Prometheus text format, Starlette appends the charset of text responses
+"""
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""
+Bucket bounds of the latency histograms, in seconds
+"""
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+"""
+Bucket bounds of the response size histogram, in bytes
+"""
+
+UNMATCHED_ROUTE = "unmatched"
+"""
+The route label of requests that no route matches
+"""
+
+WORKER_INDEX_ENV = "WORKER_INDEX"
+"""
+Environment variable with the index of the gunicorn worker, set by gunicorn.conf.py
+"""
+
+LabelValues = Tuple[str, ...]
+
+
+class MetricFamily(NamedTuple):
+    """
+    The samples of a metric collected at scrape time.
+    """
+
+    name: str
+    kind: str
+    documentation: str
+    label_names: Tuple[str, ...]
+    samples: List[Tuple[LabelValues, float]]
+
+
+class Shard:
+    """
+    The values recorded by one thread.
+    """
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, LabelValues], float] = {}
+        self.histograms: Dict[Tuple[str, LabelValues], List[float]] = {}
+
+    def merge(self, other: "Shard") -> None:
+        """
+        Adds the values of another shard to this one
+        """
+
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+        for key, counts in other.histograms.copy().items():
+            merged = self.histograms.setdefault(key, [0.0] * len(counts))
+            for i, count in enumerate(list(counts)):
+                merged[i] += count
+
+
+class Counter:
+    """
+    A monotonically increasing value per set of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self, registry: "MetricsRegistry", name: str, documentation: str, label_names: Sequence[str]
+    ) -> None:
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        counters = self.registry.get_shard().counters
+        key = (self.name, label_values)
+        counters[key] = counters.get(key, 0.0) + amount
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, with their sum, per set of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float],
+    ) -> None:
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, label_values: LabelValues, value: float) -> None:
+        # One count per bucket, the +Inf bucket, and the sum
+        histograms = self.registry.get_shard().histograms
+        key = (self.name, label_values)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = [0.0] * (len(self.buckets) + 2)
+            histograms[key] = counts
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process, recorded into per-thread shards and rendered on a scrape.
+    """
+
+    def __init__(self, worker_label: str | None = "worker") -> None:
+        self.worker_label = worker_label
+        self.metrics: Dict[str, Counter | Histogram] = {}
+        self.collectors: Dict[str, Callable[[], Iterable[MetricFamily]]] = {}
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[weakref.ref, Shard]] = []
+        self._retired = Shard()
+        self._constant_labels: List[Tuple[str, str]] = []
+
+    def get_shard(self) -> Shard:
+        """
+        Gets the shard of the current thread, registering it on the first use from a thread
+        """
+
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = Shard()
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+
+            self._local.shard = shard
+
+        return shard
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        """
+        Gets the counter with the supplied name, creating it on first use
+        """
+
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = Counter(self, name, documentation, label_names)
+            self.metrics[name] = metric
+
+        return metric  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """
+        Gets the histogram with the supplied name, creating it on first use
+        """
+
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = Histogram(self, name, documentation, label_names, buckets)
+            self.metrics[name] = metric
+
+        return metric  # type: ignore
+
+    def register_collector(
+        self, name: str, collect: Callable[[], Iterable[MetricFamily]]
+    ) -> None:
+        """
+        Adds a function that collects metrics at scrape time. A collector registered again under
+        the same name replaces the earlier one, so that building the app again does not render
+        its families twice.
+        """
+
+        self.collectors[name] = collect
+
+    def collect_shards(self) -> Shard:
+        """
+        Sums the shards of all threads. The shards of threads that have exited are folded into
+        one, as they will not be written again.
+        """
+
+        total = Shard()
+        with self._lock:
+            live_shards: List[Tuple[weakref.ref, Shard]] = []
+            for thread_ref, shard in self._shards:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    self._retired.merge(shard)
+                else:
+                    live_shards.append((thread_ref, shard))
+                    total.merge(shard)
+
+            self._shards = live_shards
+            total.merge(self._retired)
+
+        return total
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text format
+        """
+
+        total = self.collect_shards()
+        lines: List[str] = []
+
+        # The worker is read on every scrape, as the registry may be created before a fork
+        self._constant_labels: List[Tuple[str, str]] = []
+        if self.worker_label is not None:
+            worker = os.environ.get(WORKER_INDEX_ENV) or str(os.getpid())
+            self._constant_labels.append((self.worker_label, worker))
+
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+            if isinstance(metric, Counter):
+                for (name, label_values), value in total.counters.items():
+                    if name == metric.name:
+                        labels = self.format_labels(metric.label_names, label_values)
+                        lines.append(f"{name}{labels} {format_value(value)}")
+                continue
+
+            for (name, label_values), counts in total.histograms.items():
+                if name != metric.name:
+                    continue
+
+                cumulative = 0.0
+                bounds = [format_value(b) for b in metric.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, counts[:-1], strict=True):
+                    cumulative += count
+                    labels = self.format_labels(
+                        metric.label_names + ("le",), label_values + (bound,)
+                    )
+                    lines.append(f"{name}_bucket{labels} {format_value(cumulative)}")
+
+                labels = self.format_labels(metric.label_names, label_values)
+                lines.append(f"{name}_sum{labels} {format_value(counts[-1])}")
+                lines.append(f"{name}_count{labels} {format_value(cumulative)}")
+
+        for collect in self.collectors.values():
+            try:
+                families = list(collect())
+            except Exception:
+                log.exception("Could not collect metrics from %s", collect)
+                continue
+
+            for family in families:
+                lines.append(f"# HELP {family.name} {family.documentation}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                for label_values, value in family.samples:
+                    labels = self.format_labels(family.label_names, label_values)
+                    lines.append(f"{family.name}{labels} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def format_labels(self, label_names: Sequence[str], label_values: LabelValues) -> str:
+        """
+        Formats the constant labels and the supplied labels of a sample
+        """
+
+        pairs = self._constant_labels + list(zip(label_names, label_values, strict=True))
+        if len(pairs) == 0:
+            return ""
+
+        return "{" + ",".join(f'{n}="{escape_label_value(str(v))}"' for n, v in pairs) + "}"
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escapes a label value for the Prometheus text format
+    """
+
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    """
+    Formats a sample value for the Prometheus text format
+    """
+
+    if value == int(value):
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, response size and status code of every request by route name, and the
+    number of requests whose background tasks are still running.
+    """
+
+    def __init__(self, app: ASGIApp, registry: "MetricsRegistry", router: Router) -> None:
+        self.app = app
+        self.route_names = RouteNames(router)
+
+        self.requests = registry.counter(
+            "http_requests_total", "Requests by route name and status code", ("route", "status")
+        )
+        self.duration = registry.histogram(
+            "http_request_duration_seconds",
+            "Time until the response was sent, by route name",
+            ("route",),
+            LATENCY_BUCKETS,
+        )
+        self.size = registry.histogram(
+            "http_response_size_bytes",
+            "Size of the response bodies as sent, by route name",
+            ("route",),
+            SIZE_BUCKETS,
+        )
+
+        self.background_pending = 0
+        registry.register_collector("http_background_tasks", self.collect)
+
+    def collect(self) -> Iterable[MetricFamily]:
+        yield MetricFamily(
+            "http_background_tasks_pending",
+            "gauge",
+            "Requests whose response was sent and whose background tasks have not finished",
+            (),
+            [((), float(self.background_pending))],
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = (self.route_names.get(scope) or UNMATCHED_ROUTE,)
+        start_time = time.perf_counter()
+        status_code = 500
+        size = 0
+        is_complete = False
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code, size, is_complete
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if not message.get("more_body", False) and not is_complete:
+                    is_complete = True
+                    self.record(route, status_code, size, time.perf_counter() - start_time)
+                    self.background_pending += 1
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if is_complete:
+                self.background_pending -= 1
+            else:
+                self.record(route, status_code, size, time.perf_counter() - start_time)
+
+    def record(self, route: LabelValues, status_code: int, size: int, seconds: float) -> None:
+        self.requests.inc(route + (str(status_code),))
+        self.duration.observe(route, seconds)
+        self.size.observe(route, size)
+
+
+@lru_cache()
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Gets the metrics registry of this process
+    """
+
+    return MetricsRegistry()
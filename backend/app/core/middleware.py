@@ -0,0 +1,130 @@
+"""
+This module contains the pure ASGI middleware of the app.
+
+Middleware written with @app.middleware("http") runs on Starlette's BaseHTTPMiddleware, which
+starts a task and wraps the response body in a stream for every request and every layer. These
+middlewares instead wrap the send callable and edit the http.response.start message, so a
+request costs one extra function call per message.
+"""
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from dpn_pyutils.common import get_logger
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+log = get_logger(__name__)
+
+PROCESS_TIME_HEADER = b"x-process-time"
+SERVER_HEADER = b"server"
+
+ROUTE_NAME_CACHE_SIZE = 4096
+"""
+The number of request paths whose route name is remembered
+"""
+
+T = TypeVar("T")
+
+
+def compile_path_prefixes(prefixes: Iterable[str]) -> re.Pattern | None:
+    """
+    Compiles path prefixes into a single anchored pattern, or None when there are no prefixes
+    """
+
+    escaped_prefixes = [re.escape(p) for p in prefixes]
+    if len(escaped_prefixes) == 0:
+        return None
+
+    return re.compile("|".join(escaped_prefixes))
+
+
+def parse_route_values(route_values: str, value_type: Callable[[str], T]) -> Dict[str, T]:
+    """
+    Parses per route name settings written as "route:name=value,other:name=value"
+    """
+
+    values: Dict[str, T] = {}
+    for part in str(route_values).split(","):
+        name, _, value = part.partition("=")
+        if name.strip():
+            values[name.strip()] = value_type(value)
+
+    return values
+
+
+class RouteNames:
+    """
+    Finds the name of the route that will handle a request, before the router does, remembering
+    it per method and path.
+    """
+
+    def __init__(self, router: Router, max_size: int = ROUTE_NAME_CACHE_SIZE) -> None:
+        self.router = router
+        self.max_size = max_size
+        self._names: OrderedDict[Tuple[str, str], str | None] = OrderedDict()
+
+    def get(self, scope: Scope) -> str | None:
+        """
+        Gets the name of the route that will handle a request, or None when no route matches it
+        """
+
+        key = (scope["method"], scope["path"])
+        if key in self._names:
+            self._names.move_to_end(key)
+            return self._names[key]
+
+        route_name = None
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                route_name = getattr(route, "name", None)
+                break
+
+        self._names[key] = route_name
+        if len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+        return route_name
+
+
+class ResponseHeadersMiddleware:
+    """
+    Sets the server header on every response, and the X-Process-Time header on the responses to
+    paths that are not excluded from it.
+    """
+
+    def __init__(
+        self, app: ASGIApp, server_name: str, exclude_process_time_prefixes: Iterable[str] = ()
+    ) -> None:
+        self.app = app
+        self.server_header = (SERVER_HEADER, server_name.encode("latin-1"))
+        self.exclude_process_time = compile_path_prefixes(exclude_process_time_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        add_process_time = (
+            self.exclude_process_time is None
+            or self.exclude_process_time.match(scope["path"]) is None
+        )
+        start_time = time.perf_counter()
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers: List[Tuple[bytes, bytes]] = [
+                    h for h in message.get("headers", ()) if h[0].lower() != SERVER_HEADER
+                ]
+                headers.append(self.server_header)
+                if add_process_time:
+                    process_time = time.perf_counter() - start_time
+                    headers.append((PROCESS_TIME_HEADER, f"{process_time:0.4f} sec".encode()))
+
+                message = {**message, "headers": headers}
+
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,115 @@
+"""
+This module contains the coalescing of identical concurrent reads.
+
+When many requests ask for the same thing at the same moment, for example after a deploy or an
+invalidation, only the first request runs the read. The others wait for it and share its result,
+or its error. Every caller waits at most timeout_seconds; a caller that gives up does not cancel
+the read, which the remaining callers keep waiting for.
+
+Coalescing is per process and only covers reads that are in flight at the same time, it does not
+cache results.
+"""
+import asyncio
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.config import get_config
+from app.core.errors import AppHTTPError
+from dpn_pyutils.common import get_logger
+from starlette import status
+
+log = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlightTimeoutError(AppHTTPError):
+    """
+    Raised to a caller that waited longer than the timeout for a coalesced read
+    """
+
+    def __init__(self) -> None:
+        super().__init__(detail="READ_TIMEOUT", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+class SingleFlight:
+    """
+    Runs at most one read per key at a time, sharing its outcome with every concurrent caller.
+    Must be used from the event loop.
+    """
+
+    def __init__(self, name: str, timeout_seconds: float) -> None:
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.calls = 0
+        self.flights = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of reads running now
+        """
+
+        return len(self._flights)
+
+    def _on_done(self, key: Hashable, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        # Retrieve the error so that a flight whose callers all timed out is not reported as an
+        # exception that was never retrieved
+        if not flight.cancelled() and flight.exception() is not None:
+            self.errors += 1
+
+    async def run(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        """
+        Gets the result of load, joining the read for the same key if one is in flight
+        """
+
+        self.calls += 1
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.flights += 1
+            flight = asyncio.ensure_future(load())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda f: self._on_done(key, f))
+        else:
+            self.coalesced += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight), self.timeout_seconds)
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            log.warning(
+                "Gave up on %s read after %.1f seconds: %s", self.name, self.timeout_seconds, key
+            )
+            raise SingleFlightTimeoutError() from e
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Gets the counters with the share of calls that joined a read instead of running one
+        """
+
+        return {
+            "calls": self.calls,
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "coalescing_ratio": self.coalesced / self.calls if self.calls > 0 else 0.0,
+        }
+
+
+@lru_cache()
+def get_single_flight() -> SingleFlight:
+    """
+    Gets the single-flight group of the adapter reads for this process
+    """
+
+    return SingleFlight("adapters", float(get_config().SINGLE_FLIGHT_TIMEOUT_SECONDS))
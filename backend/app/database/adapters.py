@@ -1,13 +1,119 @@
+import json
 import uuid
-from typing import Any, Dict, Generic, List, Type
-
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from app.config import get_config
+from app.core.singleflight import get_single_flight
+from app.database.cache import MISSING, get_result_cache
+from app.database.meta import open_session
 from app.database.types import BaseRecordType, RecordProtocol
 from dpn_pyutils.common import get_logger
-from sqlalchemy import func, select
+from sqlalchemy import ColumnElement, Select, func, select, text
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.interfaces import ORMOption
+from starlette.concurrency import run_in_threadpool
 
 log = get_logger(__name__)
 
+T = TypeVar("T")
+
+STREAM_BATCH_SIZE = 500
+"""
+The number of rows fetched from the server-side cursor at a time when streaming records
+"""
+
+LIKE_WILDCARDS = ("%", "_")
+"""
+Characters that have a wildcard meaning in a LIKE/ILIKE pattern
+"""
+
+LIKE_ESCAPE = "\\"
+"""
+The default escape character of a LIKE/ILIKE pattern
+"""
+
+
+class TextFilterMatch(str, Enum):
+    """
+    The kind of match a text filter value asks for, which decides the index that can serve it.
+    """
+
+    EXACT = "exact"
+    """
+    No wildcards or escapes, served by equality on the lower(column) B-tree index
+    """
+
+    PREFIX = "prefix"
+    """
+    A single trailing '%' and no escapes, served by a range scan on the lower(column)
+    text_pattern_ops index
+    """
+
+    CONTAINS = "contains"
+    """
+    Any other pattern, served by the pg_trgm GIN index
+    """
+
+
+def classify_text_filter(value: str) -> TextFilterMatch:
+    """
+    Classifies an ILIKE-style filter value as an exact, prefix, or contains match
+    """
+
+    if not any(w in value for w in LIKE_WILDCARDS + (LIKE_ESCAPE,)):
+        return TextFilterMatch.EXACT
+
+    prefix = value[:-1]
+    if (
+        value.endswith("%")
+        and len(prefix) > 0
+        and not any(w in prefix for w in LIKE_WILDCARDS + (LIKE_ESCAPE,))
+    ):
+        return TextFilterMatch.PREFIX
+
+    return TextFilterMatch.CONTAINS
+
+
+def normalize_filter(row_filter: Dict[str, Any] | None) -> str:
+    """
+    Gets a canonical form of a row filter for use in a cache key, so that the same filter sent
+    with its keys in a different order maps to the same key
+    """
+
+    return json.dumps(row_filter or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def plan_text_filter(column: ColumnElement, value: str) -> ColumnElement:
+    """
+    Builds the filter clause for a case-insensitive text filter. The matching semantics are the
+    same as a plain column.ilike(value), but exact and prefix matches are rewritten against
+    lower(column) so that B-tree indexes can serve them instead of a sequential scan.
+
+    Both sides are lowered by Postgres, which is how ILIKE folds the case of multibyte text, and
+    values with escapes are left to ILIKE, so that they keep their escape semantics.
+    """
+
+    match classify_text_filter(value):
+        case TextFilterMatch.EXACT:
+            return func.lower(column) == func.lower(value)
+        case TextFilterMatch.PREFIX:
+            return func.lower(column).like(func.lower(value))
+        case _:
+            return column.ilike(value)
+
 
 class AdapterCRUDBase(Generic[RecordProtocol]):
     """
@@ -73,15 +179,125 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
     session: Session
     table: Type[BaseRecordType]
 
+    cache_tables: Tuple[str, ...] = ()
+    """
+    Tables besides the adapter's own table whose writes change the adapter's cached results
+    """
+
+    versioned: bool = False
+    """
+    Whether writes bump the version of the adapter's table, which cached reads require. Only
+    tables that cached reads depend on are versioned, as every bump takes the row lock of the
+    table's version.
+    """
+
     def __init__(self, session: Session, table: Type[BaseRecordType]) -> None:
         self.session = session
         self.table = table
 
+    def get_table_versions(self) -> Tuple[int, ...]:
+        """
+        Get the write versions of the adapter's table and its cache tables, in that order.
+        """
+
+        table_names = (self.table.__tablename__, *self.cache_tables)
+        versions = dict(
+            self.session.execute(
+                text(
+                    "SELECT table_name, version FROM table_versions "
+                    "WHERE table_name = ANY(:table_names)"
+                ),
+                {"table_names": list(table_names)},
+            ).all()
+        )
+
+        return tuple(versions.get(table_name, 0) for table_name in table_names)
+
+    async def read_table_versions(self) -> Tuple[int, ...]:
+        """
+        Get the write versions of get_table_versions, read in the thread pool on a session of
+        their own. They are read for every cached lookup and never shared with reads in flight,
+        so that a result cached before a committed write in any worker is not served again.
+        """
+
+        def run_read() -> Tuple[int, ...]:
+            with open_session() as session:
+                return self.with_session(session).get_table_versions()
+
+        return await run_in_threadpool(run_read)
+
+    def bump_version(self, table_name: str | None = None) -> None:
+        """
+        Bump the write version of a table, the adapter's table by default, as part of the current
+        transaction. Writes to a versioned table that do not go through create, update or delete
+        must call this. Does nothing for the adapter's table when it is not versioned.
+        """
+
+        if table_name is None and not self.versioned:
+            return
+
+        self.session.execute(
+            text(
+                """
+            INSERT INTO table_versions (table_name, version) VALUES (:table_name, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1
+            """
+            ),
+            {"table_name": table_name or self.table.__tablename__},
+        )
+
+    async def coalesced(self, operation: str, args: Hashable, load: Callable[[Any], T]) -> T:
+        """
+        Run a read in the thread pool, sharing it with identical reads that are in flight at the
+        same time. The read is passed a copy of the adapter bound to a session of its own, as it
+        may outlive the request that started it.
+        """
+
+        return await self._coalesced((self.table.__tablename__, operation, args), load)
+
+    async def _coalesced(self, key: Hashable, load: Callable[[Any], T]) -> T:
+        def run_load() -> T:
+            with open_session() as session:
+                return load(self.with_session(session))
+
+        if not get_config().SINGLE_FLIGHT_ENABLE:
+            return await run_in_threadpool(run_load)
+
+        return await get_single_flight().run(key, lambda: run_in_threadpool(run_load))
+
+    def with_session(self, session: Session) -> "AdapterCRUD[BaseRecordType]":
+        """
+        Get a copy of the adapter bound to another session
+        """
+
+        return type(self)(session, self.table)
+
+    async def cached(self, operation: str, args: Hashable, load: Callable[[Any], T]) -> T:
+        """
+        Get the result of a read from the result cache, running it as a coalesced read on a miss.
+        The result is shared with other requests and must not be mutated.
+        """
+
+        if not get_config().RESULT_CACHE_ENABLE or not self.versioned:
+            return await self.coalesced(operation, args, load)
+
+        result_cache = get_result_cache()
+        key = (self.table.__tablename__, operation, args, await self.read_table_versions())
+        result = result_cache.get(key)
+        if result is MISSING:
+            result = await self._coalesced(key, load)
+            result_cache.put(key, result)
+
+        return result
+
     async def total_rows(self) -> int:
         """
         Get the total number of rows in the table.
         """
 
+        return await self.cached("total_rows", (), lambda adapter: adapter._count_rows())
+
+    def _count_rows(self) -> int:
         return self.session.query(func.count(self.table.id)).scalar()
 
     async def get(self, id: int) -> BaseRecordType | None:
@@ -115,7 +331,59 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
         Get a list of records based on the filter, sort, and range.
         """
 
-        stmt = select(self.table)
+        stmt = self._many_statement(row_filter, sort_col, sort_direction, range_start, range_end)
+        results = [r[0] for r in self.session.execute(stmt).unique().all()]
+
+        return results
+
+    def get_stream_options(self) -> Sequence[ORMOption]:
+        """
+        Loader options applied when streaming records, override to eagerly load the relationships
+        that are read from every streamed record
+        """
+
+        return ()
+
+    def stream_batches(
+        self,
+        row_filter: Dict[str, str],
+        sort_col: str,
+        sort_direction: str,
+        range_start: int,
+        range_end: int,
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> Iterator[List[BaseRecordType]]:
+        """
+        Yield the records of get_many a batch at a time, reading them through a server-side
+        cursor so that memory use does not grow with the number of records. Every batch is
+        fetched when it is asked for, so the iterator must be consumed in the thread pool.
+        """
+
+        stmt = (
+            self._many_statement(row_filter, sort_col, sort_direction, range_start, range_end)
+            .options(*self.get_stream_options())
+            .execution_options(yield_per=batch_size)
+        )
+
+        for batch in self.session.execute(stmt).scalars().partitions():
+            yield list(batch)
+
+    def _many_statement(
+        self,
+        row_filter: Dict[str, str],
+        sort_col: str,
+        sort_direction: str,
+        range_start: int,
+        range_end: int,
+        stmt: Select | None = None,
+    ) -> Select:
+        """
+        Builds the statement for the filter, sort, and range of get_many, selecting full records
+        unless a statement selecting columns of the table is supplied.
+        """
+
+        if stmt is None:
+            stmt = select(self.table)
         column_names = self.table.__table__.columns.keys()
 
         for col_name in column_names:
@@ -129,9 +397,11 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
                         isinstance(row_filter[filter_col_name], str)
                         and col_sql_type != "BINARY(16)"
                     ):
-                        # The column is a generic string type, use case-insensitive match (ilike)
-                        filter_statement = self.table.__table__.columns[col_name].ilike(
-                            row_filter[filter_col_name]
+                        # The column is a generic string type, use a case-insensitive match
+                        # planned so that the matching index can serve it
+                        filter_statement = plan_text_filter(
+                            self.table.__table__.columns[col_name],
+                            row_filter[filter_col_name],
                         )
 
                     else:
@@ -167,26 +437,34 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
         else:
             stmt = stmt.limit(None)
 
-        results = [r[0] for r in self.session.execute(stmt).unique().all()]
-
-        return results
+        return stmt
 
     async def apply_and_commit(self, record: BaseRecordType) -> BaseRecordType:
         """
         Add the record to the session and commits.
         """
         self.session.add(record)
+        self.bump_version()
         self.session.commit()
         self.session.refresh(record)
 
         return record
 
-    async def create(self, create_dict: Dict[str, Any]) -> BaseRecordType:
+    async def create(self, create_dict: Dict[str, Any], autocommit: bool = True) -> BaseRecordType:
         """
-        Create and commits the record.
+        Create and commits the record. Without autocommit, the record is only flushed, so that it
+        has its id and is committed with the rest of the transaction.
         """
 
-        return await self.apply_and_commit(self.table(**create_dict))
+        record = self.table(**create_dict)
+        if autocommit:
+            return await self.apply_and_commit(record)
+
+        self.session.add(record)
+        self.bump_version()
+        self.session.flush()
+
+        return record
 
     async def update(
         self,
@@ -206,6 +484,7 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
 
         if is_dirty:
             self.session.add(record)
+            self.bump_version()
 
             if autocommit:
                 self.session.commit()
@@ -226,6 +505,7 @@ class AdapterCRUD(AdapterCRUDBase, Generic[BaseRecordType]):
             return
 
         self.session.delete(record)
+        self.bump_version()
 
         if autocommit:
             self.session.commit()
@@ -0,0 +1,158 @@
+"""
+This module contains the circuit breaker of the database connections.
+
+After failure_threshold consecutive connection failures, the breaker opens and requests fail
+fast with a 503 instead of each waiting on the database to time out. After reset_seconds, one
+request is let through to try the database again. The breaker closes when it succeeds, and opens
+for another reset_seconds when it fails.
+
+Statement and lock timeouts are outcomes of the request deadlines, not of the health of the
+database, so they do not count as failures.
+"""
+import threading
+import time
+from typing import Any, Dict
+
+from app.core.errors import AppHTTPError
+from dpn_pyutils.common import get_logger
+from sqlalchemy import event
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.future import Engine
+from starlette import status
+
+log = get_logger(__name__)
+
+DEADLINE_PGCODES = frozenset(("57014", "55P03"))
+"""
+The Postgres error codes of a cancelled statement and of a lock that was not acquired in time
+"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class DatabaseUnavailableError(AppHTTPError):
+    """
+    Raised while the circuit breaker of the database is open
+    """
+
+    def __init__(self, retry_after_seconds: float) -> None:
+        super().__init__(
+            detail="DATABASE_UNAVAILABLE",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(max(1, round(retry_after_seconds)))},
+        )
+
+
+def is_deadline_error(error: BaseException) -> bool:
+    """
+    Whether a database error is a statement or lock timeout
+    """
+
+    return getattr(getattr(error, "orig", None), "pgcode", None) in DEADLINE_PGCODES
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive database connection failures and fails fast while there were too many.
+    Thread-safe, as the database is used from the thread pool.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """
+        Raises DatabaseUnavailableError while the breaker is open. Once reset_seconds have
+        passed, lets a single request through to try the database.
+        """
+
+        if self.state == CLOSED:
+            return
+
+        with self._lock:
+            retry_after_seconds = self._opened_at + self.reset_seconds - time.monotonic()
+            # A trial that has not finished within reset_seconds is given up on
+            if retry_after_seconds <= 0:
+                log.info("Trying the database again after %s seconds", self.reset_seconds)
+                self.state = HALF_OPEN
+                self._opened_at = time.monotonic()
+                return
+
+            if self.state != CLOSED:
+                self.rejected += 1
+                raise DatabaseUnavailableError(retry_after_seconds)
+
+    def record_success(self) -> None:
+        """
+        Records a successful use of the database, closing the breaker
+        """
+
+        if self.state == CLOSED and self.failures == 0:
+            return
+
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("Database is available again, closing the circuit breaker")
+
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        """
+        Records a failed use of the database, opening the breaker when there were too many
+        """
+
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                log.warning(
+                    "Opening the database circuit breaker after %d failures for %s seconds",
+                    self.failures,
+                    self.reset_seconds,
+                )
+                self.state = OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+
+    def watch(self, engine: Engine) -> None:
+        """
+        Records the outcome of the statements of an engine, and of its connection attempts
+        """
+
+        def on_statement(*args: Any) -> None:
+            self.record_success()
+
+        def on_error(context: ExceptionContext) -> None:
+            error = context.sqlalchemy_exception
+            if context.is_disconnect or (
+                isinstance(error, OperationalError) and not is_deadline_error(error)
+            ):
+                self.record_failure()
+
+        event.listen(engine, "after_cursor_execute", on_statement)
+        event.listen(engine, "handle_error", on_error)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Gets the state and counters of the breaker
+        """
+
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,123 @@
+"""
+This module contains the adapter result cache.
+
+Read results are cached under a key made of the query and the write versions of the tables the
+query reads. Every write through an adapter of a versioned table bumps the version of its table
+in the table_versions table, in the same transaction as the write. The versions are read for
+every lookup, a single indexed row per table, so a cached result is never served once a write
+to one of its tables has committed in any worker. The cache holds results up to a memory bound
+and evicts the least recently used results beyond it.
+
+Cached results are shared between requests and must not be mutated, so only read-only rows are
+cached and never ORM entities, which belong to the session that loaded them.
+"""
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Tuple
+
+from app.config import get_config
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+MISSING = object()
+"""
+Returned by ResultCache.get when there is no cached result
+"""
+
+SIZE_ESTIMATE_MAX_DEPTH = 4
+"""
+How deep estimate_size follows nested objects
+"""
+
+
+def estimate_size(value: Any, depth: int = 0) -> int:
+    """
+    Estimates the memory held by a result, following containers and the attributes of slotted
+    and plain objects a few levels deep. Shared objects are counted every time they are seen,
+    which overestimates and keeps the cache safely under its bound.
+    """
+
+    size = sys.getsizeof(value)
+    if depth >= SIZE_ESTIMATE_MAX_DEPTH or isinstance(value, (str, bytes, int, float, bool)):
+        return size
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(v, depth + 1) for v in value)
+
+    if isinstance(value, dict):
+        return size + sum(
+            estimate_size(k, depth + 1) + estimate_size(v, depth + 1) for k, v in value.items()
+        )
+
+    for slot in getattr(type(value), "__slots__", ()):
+        size += estimate_size(getattr(value, slot, None), depth + 1)
+
+    if hasattr(value, "__dict__"):
+        size += estimate_size(vars(value), depth + 1)
+
+    return size
+
+
+class ResultCache:
+    """
+    Bounded LRU of query results, bounded by the estimated memory of the results.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._results.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        self.hits += 1
+        self._results.move_to_end(key)
+
+        return entry[0]
+
+    def put(self, key: Hashable, result: Any) -> None:
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+
+        previous = self._results.pop(key, None)
+        if previous is not None:
+            self.size_bytes -= previous[1]
+
+        self._results[key] = (result, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._results.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Gets the counters and the share of reads served from the cache
+        """
+
+        reads = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._results),
+            "size_bytes": self.size_bytes,
+            "hit_ratio": self.hits / reads if reads > 0 else 0.0,
+        }
+
+
+@lru_cache()
+def get_result_cache() -> ResultCache:
+    """
+    Gets the adapter result cache for this process
+    """
+
+    return ResultCache(int(get_config().RESULT_CACHE_MAX_BYTES))
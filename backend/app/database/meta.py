@@ -1,27 +1,40 @@
+from contextlib import contextmanager
 from datetime import tzinfo
-from typing import Dict
+from typing import Dict, Iterator
 
 import pytz
 from app.config import BaseConfig, get_config
+from app.core.deadlines import DeadlineExceededError, get_remaining_seconds
 from app.database.base import Base
+from app.database.breaker import CircuitBreaker
 from app.database.helper import (
     get_connection_string,
     get_db_key_from_connection_string,
     get_db_settings_from_config,
     test_connection,
 )
+from app.database.pool import TimedQueuePool, register_pool_collector, watch_pool
 from dpn_pyutils.common import get_logger
 from fastapi import Depends
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, event, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.future import Engine, create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session, SessionTransaction, sessionmaker
 
 log = get_logger(__name__)
 
 config = get_config()
 
+SET_TIMEOUTS_STATEMENT = text(
+    "SELECT set_config('statement_timeout', :statement_timeout, true), "
+    "set_config('lock_timeout', :lock_timeout, true)"
+)
+"""
+Sets the statement and lock timeouts of the current transaction, like SET LOCAL, in one round trip
+"""
+
 
 class DatabaseManager:
     """
@@ -81,6 +94,12 @@ class DatabaseManager:
     however if multiple databases are being used, this will contain a sessionmaker for each one.
     """
 
+    DB_BREAKERS: Dict[str, CircuitBreaker] = {}
+    """
+    This is the circuit breaker of every database engine, which fails requests fast while the
+    database is unavailable.
+    """
+
     DB_SETTINGS_OVERRIDE_EXCLUSION_SET = {
         "DB_IS_ASYNC",
         "DB_ENGINE",
@@ -109,29 +128,14 @@ class DatabaseManager:
             get_connection_string(self.config)
         )
 
-        db_settings = get_db_settings_from_config(
-            config=self.config,
-            exclude_keys=list(self.DB_SETTINGS_OVERRIDE_EXCLUSION_SET),
-        )
-
-        self.DB_ENGINES[self.focused_db_key] = create_engine(
-            get_connection_string(self.config), **db_settings
-        )
+        # The engine and its connection pool are created once per process and shared by every
+        # request, which only checks the circuit breaker of the database
+        if self.focused_db_key not in self.DB_ENGINES:
+            self.create_engine()
 
         self.db = self.DB_ENGINES[self.focused_db_key]
-
-        try:
-            if test_connection(self.db):
-                log.debug("Database connection test successful")
-
-        except OperationalError as e:
-            log.error(
-                "Could not test connection using connection string. "
-                "Attempted connection string is '%s'",
-                get_connection_string(self.config),
-            )
-
-            raise e
+        self.breaker = self.DB_BREAKERS[self.focused_db_key]
+        self.breaker.check()
 
         self.base = declarative_base()
 
@@ -154,6 +158,44 @@ class DatabaseManager:
         log.debug("Ready to import declarative models")
         self.on_import_declarative_models()
 
+    def create_engine(self) -> None:
+        """
+        Creates the engine of the focused database and its circuit breaker, and tests that the
+        database can be connected to
+        """
+
+        db_settings = get_db_settings_from_config(
+            config=self.config,
+            exclude_keys=list(self.DB_SETTINGS_OVERRIDE_EXCLUSION_SET),
+        )
+
+        engine = create_engine(
+            get_connection_string(self.config), poolclass=TimedQueuePool, **db_settings
+        )
+        watch_pool(engine)
+        breaker = CircuitBreaker(
+            int(self.config.CIRCUIT_BREAKER_FAILURE_THRESHOLD),
+            float(self.config.CIRCUIT_BREAKER_RESET_SECONDS),
+        )
+        breaker.watch(engine)
+
+        # Kept even when the test fails, so that the failures count towards the breaker
+        self.DB_ENGINES[self.focused_db_key] = engine
+        self.DB_BREAKERS[self.focused_db_key] = breaker
+
+        try:
+            if test_connection(engine):
+                log.debug("Database connection test successful")
+
+        except OperationalError as e:
+            log.error(
+                "Could not test connection using connection string. "
+                "Attempted connection string is '%s'",
+                get_connection_string(self.config),
+            )
+
+            raise e
+
     def on_import_declarative_models(self) -> None:
         """
         Override this method in a subclass and list all of the declarative models that need
@@ -162,6 +204,9 @@ class DatabaseManager:
         import_declarative_models()
 
 
+register_pool_collector(DatabaseManager.DB_ENGINES)
+
+
 def import_declarative_models() -> None:
     """
     This method contains all the declarative models that we need to import
@@ -170,6 +215,30 @@ def import_declarative_models() -> None:
     from app.modules.prompts.models import PromptHistoryRecord, PromptRecord  # noqa
 
 
+@event.listens_for(Session, "after_begin")
+def apply_deadline(
+    session: Session, transaction: SessionTransaction, connection: Connection
+) -> None:
+    """
+    Sets the remaining time budget of the current request as the statement timeout of every
+    transaction that it begins, and as the lock timeout up to DEADLINE_LOCK_TIMEOUT_SECONDS
+    """
+
+    remaining_seconds = get_remaining_seconds()
+    if remaining_seconds is None:
+        return
+
+    if remaining_seconds <= 0:
+        raise DeadlineExceededError()
+
+    statement_timeout_ms = max(1, int(remaining_seconds * 1000))
+    lock_timeout_ms = min(statement_timeout_ms, int(config.DEADLINE_LOCK_TIMEOUT_SECONDS * 1000))
+    connection.execute(
+        SET_TIMEOUTS_STATEMENT,
+        {"statement_timeout": f"{statement_timeout_ms}ms", "lock_timeout": f"{lock_timeout_ms}ms"},
+    )
+
+
 def get_db(db_manager: DatabaseManager = Depends(DatabaseManager)) -> Engine:
     """
     Gets the configured database engine
@@ -183,3 +252,12 @@ def get_session(db_manager: DatabaseManager = Depends(DatabaseManager)):
     """
     with sessionmaker(db_manager.db)() as session:
         yield session
+
+
+@contextmanager
+def open_session() -> Iterator[Session]:
+    """
+    Opens a session outside of a request, for work that runs after the request has finished
+    """
+    with sessionmaker(DatabaseManager(get_config()).db)() as session:
+        yield session
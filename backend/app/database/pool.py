@@ -0,0 +1,93 @@
+"""
+This module contains the metrics of the database connection pools.
+
+Checkouts, new connections and invalidated connections are counted from the pool events of every
+engine in DatabaseManager.DB_ENGINES. The time a checkout waits for a connection has no event,
+so the engines use a QueuePool that times it. The size, checked out connections and overflow of
+the pools are read when the metrics are scraped.
+"""
+import time
+from typing import Any, Dict, Iterable
+
+from app.core.metrics import MetricFamily, get_metrics_registry
+from dpn_pyutils.common import get_logger
+from sqlalchemy import event
+from sqlalchemy.future import Engine
+from sqlalchemy.pool import QueuePool
+
+log = get_logger(__name__)
+
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+"""
+Bucket bounds of the checkout wait histogram, in seconds
+"""
+
+metrics_registry = get_metrics_registry()
+
+pool_checkouts = metrics_registry.counter(
+    "db_pool_checkouts_total", "Connections checked out of the database pools"
+)
+pool_connects = metrics_registry.counter(
+    "db_pool_connections_created_total", "Connections opened by the database pools"
+)
+pool_invalidations = metrics_registry.counter(
+    "db_pool_invalidations_total", "Connections invalidated by the database pools"
+)
+pool_wait_seconds = metrics_registry.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time a checkout waited for a connection, including opening a new one",
+    (),
+    POOL_WAIT_BUCKETS,
+)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long every checkout waits for a connection.
+    """
+
+    def _do_get(self) -> Any:
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_seconds.observe((), time.perf_counter() - start_time)
+
+
+def watch_pool(engine: Engine) -> None:
+    """
+    Counts the checkouts, new connections and invalidations of the pool of an engine
+    """
+
+    def on_checkout(*args: Any) -> None:
+        pool_checkouts.inc()
+
+    def on_connect(*args: Any) -> None:
+        pool_connects.inc()
+
+    def on_invalidate(*args: Any) -> None:
+        pool_invalidations.inc()
+
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "invalidate", on_invalidate)
+
+
+def register_pool_collector(engines: Dict[str, Engine]) -> None:
+    """
+    Reports the size, checked out connections and overflow of the pools of the supplied engines,
+    summed over the engines, when the metrics are scraped
+    """
+
+    def collect() -> Iterable[MetricFamily]:
+        pools = [e.pool for e in engines.values() if isinstance(e.pool, QueuePool)]
+        for name, documentation, read in (
+            ("db_pool_size", "Configured size of the database pools", QueuePool.size),
+            ("db_pool_checked_out", "Connections checked out now", QueuePool.checkedout),
+            ("db_pool_overflow", "Connections open beyond the pool size now", QueuePool.overflow),
+        ):
+            # The overflow of a pool counts down from -pool_size while it is below its size
+            value = sum(max(0, read(p)) for p in pools)
+            yield MetricFamily(name, "gauge", documentation, (), [((), float(value))])
+
+    metrics_registry.register_collector("db_pool", collect)
@@ -0,0 +1,163 @@
+import hmac
+from typing import Any, Dict, Iterable
+
+from app.config import get_config
+from app.core.admission import get_admission_controller
+from app.core.compression import get_compression_cache
+from app.core.errors import AppHTTPError
+from app.core.metrics import CONTENT_TYPE, MetricFamily, get_metrics_registry
+from app.core.singleflight import get_single_flight
+from app.database.cache import get_result_cache
+from app.database.meta import DatabaseManager
+from app.modules.prompts.catalogue import get_catalogue_debouncer
+from app.modules.prompts.export import get_export_debouncer
+from app.modules.prompts.releases import get_release_debouncer
+from dpn_pyutils.common import get_logger
+from fastapi import APIRouter, Depends, Header, Response, status
+
+log = get_logger(__name__)
+
+
+def collect_app_metrics() -> Iterable[MetricFamily]:
+    """
+    Collects the counters of the read coalescing, the caches, the admission control, the
+    database circuit breakers and the debounced background tasks
+    """
+
+    single_flight = get_single_flight().get_metrics()
+    for key in ("calls", "flights", "coalesced", "timeouts", "errors"):
+        yield MetricFamily(
+            f"single_flight_{key}_total",
+            "counter",
+            f"Coalesced read {key}",
+            (),
+            [((), single_flight[key])],
+        )
+
+    yield MetricFamily(
+        "single_flight_in_flight",
+        "gauge",
+        "Coalesced reads running now",
+        (),
+        [((), single_flight["in_flight"])],
+    )
+
+    caches = {"result": get_result_cache(), "compression": get_compression_cache()}
+    cache_metrics = {name: cache.get_metrics() for name, cache in caches.items()}
+    for key, kind, documentation in (
+        ("hits", "counter", "Reads served from the cache"),
+        ("misses", "counter", "Reads not found in the cache"),
+        ("entries", "gauge", "Entries in the cache"),
+        ("size_bytes", "gauge", "Estimated size of the cache"),
+    ):
+        suffix = "_total" if kind == "counter" else ""
+        yield MetricFamily(
+            f"cache_{key}{suffix}",
+            kind,
+            documentation,
+            ("cache",),
+            [((name,), m[key]) for name, m in cache_metrics.items()],
+        )
+
+    admission = get_admission_controller().get_metrics()
+    yield MetricFamily(
+        "admission_requests_total",
+        "counter",
+        "Requests by admission outcome",
+        ("outcome",),
+        [((outcome,), admission[outcome]) for outcome in ("admitted", "rate_limited", "shed")],
+    )
+    for key, documentation in (
+        ("in_flight", "Admitted requests running now, by route name"),
+        ("waiting", "Requests queued for admission now, by route name"),
+    ):
+        yield MetricFamily(
+            f"admission_{key}",
+            "gauge",
+            documentation,
+            ("route",),
+            [((name,), route[key]) for name, route in admission["routes"].items()],
+        )
+
+    breakers = [b.get_metrics() for b in DatabaseManager.DB_BREAKERS.values()]
+    yield MetricFamily(
+        "db_circuit_breaker_open",
+        "gauge",
+        "Database circuit breakers that are open or half-open",
+        (),
+        [((), sum(1 for b in breakers if b["state"] != "closed"))],
+    )
+    yield MetricFamily(
+        "db_circuit_breaker_rejected_total",
+        "counter",
+        "Requests failed fast by the database circuit breakers",
+        (),
+        [((), sum(b["rejected"] for b in breakers))],
+    )
+
+    debouncers = (get_catalogue_debouncer(), get_export_debouncer(), get_release_debouncer())
+    yield MetricFamily(
+        "background_tasks_pending",
+        "gauge",
+        "Debounced background tasks that are scheduled and have not started",
+        ("task",),
+        [((d.name,), int(d.is_pending)) for d in debouncers],
+    )
+    yield MetricFamily(
+        "background_tasks_running",
+        "gauge",
+        "Debounced background tasks that are running",
+        ("task",),
+        [((d.name,), d.running) for d in debouncers],
+    )
+
+
+def verify_metrics_token(authorization: str | None = Header(None)) -> None:
+    """
+    Requires the METRICS_TOKEN as a bearer token, when one is configured
+    """
+
+    token = str(get_config().METRICS_TOKEN)
+    if token and not hmac.compare_digest(authorization or "", f"Bearer {token}"):
+        raise AppHTTPError(
+            detail="METRICS_TOKEN_INVALID",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def get_router__metrics() -> APIRouter:
+    """
+    Get the APIRouter for the metrics of this worker process. It is mounted at the root of the
+    app rather than under the API prefix, so that the public /api location of nginx does not
+    proxy it.
+    """
+
+    router = APIRouter(prefix="/metrics", dependencies=[Depends(verify_metrics_token)])
+
+    get_metrics_registry().register_collector("app", collect_app_metrics)
+
+    @router.get("", status_code=status.HTTP_200_OK, name="metrics:get")
+    async def metrics__get() -> Response:
+        """
+        Get the metrics of the worker that serves the request in the Prometheus text format
+        """
+
+        return Response(content=get_metrics_registry().render(), media_type=CONTENT_TYPE)
+
+    @router.get("/json", status_code=status.HTTP_200_OK, name="metrics:json")
+    async def metrics__json() -> Dict[str, Any]:
+        """
+        Get the read coalescing, cache and admission counters of the worker that serves the
+        request
+        """
+
+        return {
+            "admission": get_admission_controller().get_metrics(),
+            "single_flight": get_single_flight().get_metrics(),
+            "result_cache": get_result_cache().get_metrics(),
+            "compression_cache": get_compression_cache().get_metrics(),
+            "circuit_breakers": [b.get_metrics() for b in DatabaseManager.DB_BREAKERS.values()],
+        }
+
+    return router
@@ -1,21 +1,106 @@
-from typing import List, Type
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Sequence, Set, Tuple, Type
 
-from app.database.adapters import AdapterCRUD
+from app.database.adapters import AdapterCRUD, normalize_filter
 from app.database.meta import get_session
-from app.modules.prompts import models, schemas
+from app.modules.prompts import models
+from app.modules.prompts.content import RevisionBody, encode_blob, get_body_cache
+from app.modules.prompts.includes import topological_order
+from app.modules.prompts.rows import CurrentRow, PromptRow, RevisionRow
 from dpn_pyutils.common import get_logger
 from fastapi import Depends
-from sqlalchemy import select, text
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, Select, delete, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.interfaces import ORMOption
 
 log = get_logger(__name__)
 
+CURRENT_CATALOGUE_VIEW = "prompts_current"
+"""
+Materialized view of the current revision of every active prompt, with a unique index on slug
+"""
+
+CURRENT_REVISION_INDEX = "ux_prompts_revisions_current"
+"""
+Unique partial index that allows a single current revision per prompt
+"""
+
+
+def is_current_revision_conflict(error: IntegrityError) -> bool:
+    """
+    Whether an integrity error is a second current revision of a prompt, which is what a write
+    racing a concurrent update of the same prompt runs into
+    """
+
+    diag = getattr(getattr(error, "orig", None), "diag", None)
+
+    return getattr(diag, "constraint_name", None) == CURRENT_REVISION_INDEX
+
+
+def get_bodies(session: Session, content_hashes: Iterable[str]) -> Dict[str, RevisionBody]:
+    """
+    Get the decoded revision bodies for the supplied content hashes, loading only the bodies that
+    are not already cached, together with their delta chains in one query.
+    """
+
+    body_cache = get_body_cache()
+    bodies: Dict[str, RevisionBody] = {}
+    missing: Set[str] = set()
+    for content_hash in content_hashes:
+        body = body_cache.get(content_hash)
+        if body is None:
+            missing.add(content_hash)
+        else:
+            bodies[content_hash] = body
+
+    if len(missing) > 0:
+        blobs = models.load_blob_chains(session, missing)
+        for content_hash in missing:
+            blob = blobs.get(content_hash)
+            if blob is not None:
+                bodies[content_hash] = blob.decode()
+
+    return bodies
+
+
+def get_revision_columns(table: Type[models.PromptRevisionRecord]) -> Tuple:
+    """
+    Get the columns of a revision that make up a RevisionRow, in order and without the bodies
+    """
+
+    return (
+        table.id,
+        table.prompt_id,
+        table.is_current,
+        table.content_hash,
+        table.flattened_hash,
+        table.created_at,
+        table.updated_at,
+    )
+
+
+def to_revision_rows(session: Session, rows: Iterable[Sequence]) -> List[RevisionRow]:
+    """
+    Turn result rows of get_revision_columns into revision rows, decoding their bodies and
+    flattened bodies with one blob query for those that are not cached.
+    """
+
+    rows = list(rows)
+    bodies = get_bodies(session, {h for r in rows for h in (r[3], r[4])})
+
+    return [RevisionRow(*r, bodies[r[3]], bodies[r[4]]) for r in rows]
+
 
 class AdapterPrompts(AdapterCRUD[models.PromptRecord]):
     """
     Implementation of Prompts adapter.
     """
 
+    cache_tables = ("prompts_revisions",)
+    versioned = True
+
     def __init__(self, session: Session, table: Type[models.PromptRecord]) -> None:
         super().__init__(session, table)
 
@@ -32,54 +117,373 @@ class AdapterPrompts(AdapterCRUD[models.PromptRecord]):
 
         return self.session.execute(stmt).unique().scalar_one_or_none()
 
+    def _prompt_columns(self) -> Tuple:
+        return (
+            self.table.id,
+            self.table.slug,
+            self.table.is_active,
+            self.table.variants_version,
+            self.table.current_revision_id,
+        )
+
+    def _to_prompt_rows(self, prompt_rows: Iterable[Sequence]) -> List[PromptRow]:
+        """
+        Turn result rows of _prompt_columns into prompt rows, loading the current revisions of
+        all of them by primary key in one query. Prompts without a current revision are left out.
+        """
+
+        prompt_rows = list(prompt_rows)
+        if len(prompt_rows) == 0:
+            return []
+
+        revision_table = models.PromptRevisionRecord
+        stmt = select(*get_revision_columns(revision_table)).where(
+            revision_table.id.in_([r[4] for r in prompt_rows if r[4] is not None])  # type: ignore
+        )
+        revisions = {
+            r.id: r for r in to_revision_rows(self.session, self.session.execute(stmt).all())
+        }
+
+        return [PromptRow(*r[:4], revisions[r[4]]) for r in prompt_rows if r[4] in revisions]
+
+    async def read_by_slug(self, slug: str) -> PromptRow | None:
+        """
+        Read-only get_by_slug, returning a compact row instead of an ORM entity.
+        """
+
+        return await self.cached("read_by_slug", slug, lambda adapter: adapter._read_by_slug(slug))
+
+    def _read_by_slug(self, slug: str) -> PromptRow | None:
+        stmt = (
+            select(*self._prompt_columns())
+            .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .where(self.table.slug == slug)
+        )
+        prompt_rows = self._to_prompt_rows(self.session.execute(stmt).all())
+
+        return prompt_rows[0] if len(prompt_rows) > 0 else None
+
+    async def read_by_ids(self, ids: List[int]) -> List[PromptRow]:
+        """
+        Read-only get_by_ids, returning compact rows instead of ORM entities.
+        """
+
+        return await self.cached(
+            "read_by_ids", tuple(ids), lambda adapter: adapter._read_by_ids(ids)
+        )
+
+    def _read_by_ids(self, ids: List[int]) -> List[PromptRow]:
+        stmt = select(*self._prompt_columns()).where(self.table.id.in_(ids))  # type: ignore
+
+        return self._to_prompt_rows(self.session.execute(stmt).all())
+
+    def read_active(self, ids: List[int] | None = None) -> List[PromptRow]:
+        """
+        Read the active prompts with the supplied ids, or every active prompt, from the tables.
+        Not cached, so it must not be called from the event loop.
+        """
+
+        stmt = select(*self._prompt_columns()).where(
+            self.table.is_active == True  # trunk-ignore(ruff/E712)
+        )
+        if ids is not None:
+            stmt = stmt.where(self.table.id.in_(ids))  # type: ignore
+
+        return self._to_prompt_rows(self.session.execute(stmt).all())
+
+    async def read_many(
+        self,
+        row_filter: Dict[str, str],
+        sort_col: str,
+        sort_direction: str,
+        range_start: int,
+        range_end: int,
+    ) -> List[PromptRow]:
+        """
+        Read-only get_many, returning compact rows instead of ORM entities.
+        """
+
+        return await self.cached(
+            "read_many",
+            (
+                normalize_filter(row_filter),
+                sort_col,
+                sort_direction.upper(),
+                range_start,
+                range_end,
+            ),
+            lambda adapter: adapter._read_many(
+                row_filter, sort_col, sort_direction, range_start, range_end
+            ),
+        )
+
+    def _read_many(
+        self,
+        row_filter: Dict[str, str],
+        sort_col: str,
+        sort_direction: str,
+        range_start: int,
+        range_end: int,
+    ) -> List[PromptRow]:
+        stmt = self._many_statement(
+            row_filter,
+            sort_col,
+            sort_direction,
+            range_start,
+            range_end,
+            stmt=select(*self._prompt_columns()),
+        )
+
+        return self._to_prompt_rows(self.session.execute(stmt).all())
+
+    def get_stream_options(self) -> Sequence[ORMOption]:
+        """
+        Streamed prompts are serialized with their current revision, which is loaded for each
+        batch in one query instead of once per prompt
+        """
+
+        return (selectinload(self.table.revision),)
+
+    def get_current_prompts(self) -> List[models.PromptRecord]:
+        """
+        Get every active prompt with its current revision, loading the revisions in one query.
+        Reads the whole catalogue, so it must not be called from the event loop.
+        """
+
+        stmt = (
+            select(self.table)
+            .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .options(selectinload(self.table.revision))
+            .order_by(self.table.slug)
+        )
+
+        return list(self.session.execute(stmt).unique().scalars())
+
+    def refresh_current_view(self) -> None:
+        """
+        Refresh the current catalogue view without blocking readers of the view. Waits for a
+        refresh that is running in another worker, so it must not be called from the event loop.
+        """
+
+        self.session.execute(
+            text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {CURRENT_CATALOGUE_VIEW}")
+        )
+        self.session.commit()
+
+    async def get_by_slugs(self, slugs: List[str]) -> List[models.PromptRecord]:
+        """
+        Get the active prompts with the supplied slugs.
+        """
+
+        stmt = (
+            select(self.table)
+            .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .where(self.table.slug.in_(slugs))  # type: ignore
+        )
+
+        return list(self.session.execute(stmt).unique().scalars())
+
+    async def includes_create_cycle(self, prompt_id: int, included_prompt_ids: List[int]) -> bool:
+        """
+        Whether a prompt including the supplied prompts would create a cycle, i.e. whether the
+        prompt can be reached from any of them in the include graph.
+        """
+
+        if prompt_id in included_prompt_ids:
+            return True
+
+        if len(included_prompt_ids) == 0:
+            return False
+
+        sql_statement = text(
+            """
+        WITH RECURSIVE reachable(prompt_id) AS (
+            SELECT pi.included_prompt_id FROM prompts_includes pi
+            WHERE pi.prompt_id = ANY(:included_prompt_ids)
+            UNION
+            SELECT pi.included_prompt_id FROM prompts_includes pi
+                INNER JOIN reachable r ON pi.prompt_id = r.prompt_id
+        )
+        SELECT EXISTS (SELECT 1 FROM reachable WHERE prompt_id = :prompt_id)
+        """
+        )
+
+        return bool(
+            self.session.execute(
+                sql_statement,
+                {"prompt_id": prompt_id, "included_prompt_ids": included_prompt_ids},
+            ).scalar()
+        )
+
+    async def set_includes(
+        self, prompt_id: int, included_prompt_ids: List[int], autocommit: bool = True
+    ) -> None:
+        """
+        Replace the edges of a prompt in the include graph.
+        """
+
+        self.session.execute(
+            delete(models.PromptIncludeRecord).where(
+                models.PromptIncludeRecord.prompt_id == prompt_id
+            )
+        )
+        if len(included_prompt_ids) > 0:
+            self.session.execute(
+                insert(models.PromptIncludeRecord),
+                [
+                    {"prompt_id": prompt_id, "included_prompt_id": included_prompt_id}
+                    for included_prompt_id in included_prompt_ids
+                ],
+            )
+
+        if autocommit:
+            self.session.commit()
+
+    async def get_dependent_ids(self, prompt_id: int) -> List[int]:
+        """
+        Get the ids of every prompt that includes the supplied prompt, directly or indirectly,
+        ordered so that each prompt comes after the prompts it includes.
+        """
+
+        sql_statement = text(
+            """
+        WITH RECURSIVE dependents(prompt_id) AS (
+            SELECT pi.prompt_id FROM prompts_includes pi
+            WHERE pi.included_prompt_id = :prompt_id
+            UNION
+            SELECT pi.prompt_id FROM prompts_includes pi
+                INNER JOIN dependents d ON pi.included_prompt_id = d.prompt_id
+        )
+        SELECT d.prompt_id, pi.included_prompt_id
+        FROM dependents d
+            INNER JOIN prompts_includes pi ON pi.prompt_id = d.prompt_id
+        """
+        )
+
+        edges = [
+            (r[0], r[1])
+            for r in self.session.execute(sql_statement, {"prompt_id": prompt_id}).all()
+        ]
+
+        return topological_order((e[0] for e in edges), edges)
+
     async def get_current_commands(self) -> List[str]:
         """
-        Get a list of current command slugs.
+        Get a list of current command slugs, read from the current catalogue view.
         """
 
+        return await self.coalesced(
+            "get_current_commands", (), lambda adapter: adapter._get_current_commands()
+        )
+
+    def _get_current_commands(self) -> List[str]:
         sql_statement = text(
-            "SELECT p.slug as command FROM prompts p WHERE is_active=True ORDER BY p.slug ASC"
+            f"SELECT pc.slug as command FROM {CURRENT_CATALOGUE_VIEW} pc ORDER BY pc.slug ASC"
         )
 
         command_list = [r[0] for r in self.session.execute(sql_statement).all()]
 
         return command_list
 
-    async def get_current_list(self) -> List[schemas.PromptListRow]:
+    async def get_current_list(
+        self, as_of: datetime | None = None, fresh: bool = False
+    ) -> List[CurrentRow]:
         """
-        Get a list of current prompts.
+        Get a list of current prompts, or of the prompts that were current at the supplied time.
+
+        The current list is read from the current catalogue view, which trails writes by the
+        refresh debounce; pass fresh to read the tables instead. The point-in-time list is
+        served by the GiST index on the revision validity intervals.
+
+        Reads of the tables are not coalesced, as they are made by writers that must see their
+        own transaction.
         """
 
-        sql_statement = text(
+        if fresh and as_of is None:
+            return self.read_current_list()
+
+        return await self.coalesced(
+            "get_current_list", as_of, lambda adapter: adapter._get_current_list(as_of)
+        )
+
+    def read_current_list(self) -> List[CurrentRow]:
+        """
+        Read the current list from the tables, seeing the writes of the session's transaction.
+        """
+
+        return self._get_current_list(None, fresh=True)
+
+    def read_catalogue(self) -> Tuple[Tuple[int, ...], int, List[CurrentRow]]:
+        """
+        Read the table versions, the total number of prompts and the current list from the
+        tables, for a snapshot of the catalogue. The versions are read first, so a write that lands
+        during the read can only make the snapshot look older than it is.
+        """
+
+        versions = self.get_table_versions()
+
+        return versions, self._count_rows(), self.read_current_list()
+
+    def _get_current_list(self, as_of: datetime | None, fresh: bool = False) -> List[CurrentRow]:
+        if as_of is None and not fresh:
+            sql_statement = text(
+                f"""
+            SELECT
+                pc.id, pc.revision_id, pc.slug, pc.is_active,
+                pc.flattened_hash, pc.created_at, pc.updated_at
+            FROM {CURRENT_CATALOGUE_VIEW} pc
+            ORDER BY pc.slug ASC
             """
-        SELECT
-            p.id, pr.id as revision_id, p.slug, p.is_active,
-            pr.description, pr.prompt_text, pr.created_at, pr.updated_at
-        FROM prompts p
-            INNER JOIN prompts_revisions pr ON pr.prompt_id = p.id AND pr.is_current=True
-        WHERE
-            p.is_active=True
-        ORDER BY p.slug ASC
-        """
-        )
-
-        unmapped_rows = [r for r in self.session.execute(sql_statement).all()]
-        current_result = []
-        for um_row in unmapped_rows:
-            current_result.append(
-                schemas.PromptListRow(
-                    id=um_row[0],
-                    revision_id=um_row[1],
-                    slug=um_row[2],
-                    is_active=um_row[3],
-                    description=um_row[4],
-                    prompt_text=um_row[5],
-                    created_at=um_row[6],
-                    updated_at=um_row[7],
-                )
             )
+            unmapped_rows = [r for r in self.session.execute(sql_statement).all()]
 
-        return current_result
+        elif as_of is None:
+            sql_statement = text(
+                """
+            SELECT
+                p.id, pr.id as revision_id, p.slug, p.is_active,
+                pr.flattened_hash, pr.created_at, pr.updated_at
+            FROM prompts p
+                INNER JOIN prompts_revisions pr ON pr.id = p.current_revision_id
+            WHERE
+                p.is_active=True
+            ORDER BY p.slug ASC
+            """
+            )
+            unmapped_rows = [r for r in self.session.execute(sql_statement).all()]
+
+        else:
+            sql_statement = text(
+                """
+            SELECT
+                p.id, pr.id as revision_id, p.slug, p.is_active,
+                pr.flattened_hash, pr.created_at, pr.updated_at
+            FROM prompts_revisions pr
+                INNER JOIN prompts p ON p.id = pr.prompt_id
+            WHERE
+                tstzrange(pr.valid_from, pr.valid_to, '[)') @> CAST(:as_of AS timestamptz)
+            ORDER BY p.slug ASC
+            """
+            )
+            unmapped_rows = [
+                r for r in self.session.execute(sql_statement, {"as_of": as_of}).all()
+            ]
+
+        bodies = get_bodies(self.session, (um_row[4] for um_row in unmapped_rows))
+
+        return [
+            CurrentRow(
+                um_row[0],
+                um_row[1],
+                um_row[2],
+                bodies[um_row[4]].description,
+                bodies[um_row[4]].prompt_text,
+                um_row[3],
+                um_row[6],
+                um_row[5],
+            )
+            for um_row in unmapped_rows
+        ]
 
 
 class AdapterPromptsHistory(AdapterCRUD[models.PromptRecord]):
@@ -93,32 +497,456 @@ class AdapterPromptsHistory(AdapterCRUD[models.PromptRecord]):
         super().__init__(session, table)
 
 
+class AdapterPromptReleases(AdapterCRUD[models.PromptReleaseRecord]):
+    """
+    Implementation of the PromptReleases adapter.
+    """
+
+    RELEASE_LOCK_KEY = 0x70726C73
+    """
+    Advisory lock key that serializes release creation across workers
+    """
+
+    def __init__(self, session: Session, table: Type[models.PromptReleaseRecord]) -> None:
+        super().__init__(session, table)
+
+    def lock(self) -> None:
+        """
+        Take the release lock until the end of the transaction, so that the catalogue read next
+        and the release numbering happen in the same order in every worker. Waits for the
+        release of another worker, so it must not be called from the event loop.
+        """
+
+        self.session.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": self.RELEASE_LOCK_KEY}
+        )
+
+    async def get_latest(self) -> models.PromptReleaseRecord | None:
+        """
+        Get the most recent release.
+        """
+
+        return self.read_latest()
+
+    def read_latest(self) -> models.PromptReleaseRecord | None:
+        """
+        Get the most recent release, for work that runs in the thread pool.
+        """
+
+        stmt = select(self.table).order_by(self.table.id.desc()).limit(1)  # type: ignore
+
+        return self.session.execute(stmt).scalar_one_or_none()
+
+    async def get_recent(self, limit: int) -> List[Row]:
+        """
+        Get the metadata of the most recent releases, newest first, without their payloads.
+        """
+
+        stmt = (
+            select(
+                self.table.id,
+                self.table.content_hash,
+                self.table.total,
+                self.table.created_at,
+            )
+            .order_by(self.table.id.desc())  # type: ignore
+            .limit(limit)
+        )
+
+        return list(self.session.execute(stmt).all())
+
+    def prune(self, keep: int, created_before: datetime) -> int:
+        """
+        Delete the releases created before the supplied time, except the keep most recent
+        releases, as part of the current transaction, returning the number of releases deleted.
+        """
+
+        newest_pruned_id = (
+            select(self.table.id)
+            .order_by(self.table.id.desc())  # type: ignore
+            .offset(keep)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+        return self.session.execute(
+            delete(self.table)
+            .where(self.table.id <= newest_pruned_id)
+            .where(self.table.created_at < created_before)
+        ).rowcount
+
+
 class AdapterPromptRevision(AdapterCRUD[models.PromptRevisionRecord]):
     """
     Implementation of the PromptRevision adapter.
     """
 
+    versioned = True
+
     def __init__(
         self, session: Session, table: Type[models.PromptRevisionRecord]
     ) -> None:
         super().__init__(session, table)
 
+    def _history_statement(
+        self, stmt: Select, prompt_id: int, limit: int | None, before_id: int | None
+    ) -> Select:
+        """
+        Applies the prompt, cursor, and limit conditions of a page of revision history. The
+        conditions match the (prompt_id, id DESC) index, so a page costs the same no matter how
+        many revisions the prompt has.
+        """
+
+        # SqlAlchemy requires a "cond == True" rather than the pythonic "if cond"
+        stmt = (
+            stmt.where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .where(self.table.prompt_id == prompt_id)
+            .order_by(self.table.id.desc())  # type: ignore
+        )
+
+        if before_id is not None:
+            stmt = stmt.where(self.table.id < before_id)
+
+        if limit is not None:
+            stmt = stmt.limit(limit)
+
+        return stmt
+
     async def get_by_prompt_id(
-        self, prompt_id: int
+        self, prompt_id: int, limit: int | None = None, before_id: int | None = None
     ) -> List[models.PromptRevisionRecord]:
         """
-        Get a list of revisions for a given prompt
+        Get a list of revisions for a given prompt, newest first, optionally limited and starting
+        before a revision id
         """
 
-        # SqlAlchemy requires a "cond == True" rather than the pythonic "if cond"
+        stmt = self._history_statement(select(self.table), prompt_id, limit, before_id)
+
+        return [r[0] for r in self.session.execute(stmt).unique().all()]
+
+    def get_by_prompt_ids(
+        self, prompt_ids: List[int], limit: int
+    ) -> Dict[int, List[models.PromptRevisionRecord]]:
+        """
+        Get up to limit revisions of each of the given prompts, newest first, in one query. For
+        work that runs in the thread pool.
+        """
+
+        ranked = (
+            select(
+                self.table.id,
+                func.row_number()
+                .over(partition_by=self.table.prompt_id, order_by=self.table.id.desc())
+                .label("rank"),
+            )
+            .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .where(self.table.prompt_id.in_(prompt_ids))  # type: ignore
+            .subquery()
+        )
         stmt = (
             select(self.table)
+            .join(ranked, ranked.c.id == self.table.id)
+            .where(ranked.c.rank <= limit)
+            .order_by(self.table.id.desc())  # type: ignore
+        )
+
+        revisions: Dict[int, List[models.PromptRevisionRecord]] = {i: [] for i in prompt_ids}
+        for r in self.session.execute(stmt).unique().scalars():
+            revisions[r.prompt_id].append(r)
+
+        return revisions
+
+    async def read_by_prompt_id(
+        self, prompt_id: int, limit: int | None = None, before_id: int | None = None
+    ) -> List[RevisionRow]:
+        """
+        Read-only get_by_prompt_id, returning compact rows instead of ORM entities.
+        """
+
+        stmt = self._history_statement(
+            select(*get_revision_columns(self.table)), prompt_id, limit, before_id
+        )
+
+        return to_revision_rows(self.session, self.session.execute(stmt).all())
+
+    async def read_by_id(self, id: int) -> RevisionRow | None:
+        """
+        Read-only get, returning a compact row instead of an ORM entity.
+        """
+
+        stmt = select(*get_revision_columns(self.table)).where(self.table.id == id)
+        revision_rows = to_revision_rows(self.session, self.session.execute(stmt).all())
+
+        return revision_rows[0] if len(revision_rows) > 0 else None
+
+    async def get_summaries_by_prompt_id(
+        self, prompt_id: int, limit: int, before_id: int | None = None
+    ) -> List[Row]:
+        """
+        Get a page of revision summaries for a given prompt, newest first. Summaries leave out the
+        revision body, so neither the blob table nor full ORM entities are loaded.
+        """
+
+        stmt = self._history_statement(
+            select(
+                self.table.id,
+                self.table.is_current,
+                self.table.content_hash,
+                self.table.created_at,
+                self.table.updated_at,
+            ),
+            prompt_id,
+            limit,
+            before_id,
+        )
+
+        return list(self.session.execute(stmt).all())
+
+    async def get_as_of(self, slug: str, as_of: datetime) -> models.PromptRevisionRecord | None:
+        """
+        Get the revision that was current for the prompt with the supplied slug at the supplied
+        time, including prompts that have since been deleted. This is an index lookup on
+        (prompt_id, valid_from DESC) for each prompt that ever had the slug.
+        """
+
+        stmt = (
+            select(self.table)
+            .join(models.PromptRecord, models.PromptRecord.id == self.table.prompt_id)
+            .where(models.PromptRecord.slug == slug)
+            .where(self.table.valid_from <= as_of)
+            .where(or_(self.table.valid_to.is_(None), self.table.valid_to > as_of))
+            .order_by(self.table.valid_from.desc())
+            .limit(1)
+        )
+
+        return self.session.execute(stmt).unique().scalar_one_or_none()
+
+    async def retire_revision(
+        self, revision: models.PromptRevisionRecord, at: datetime, is_current: bool = False
+    ) -> None:
+        """
+        Close the validity interval of a revision that is no longer current. The revision of a
+        deleted prompt stays flagged current, only its interval is closed.
+
+        This is not committed, so that retiring the previous revision and creating the new one
+        commit together and the prompt is never left without a current revision.
+        """
+
+        self.session.execute(
+            update(self.table)
+            .where(self.table.id == revision.id)
+            .values(is_current=is_current, valid_to=at)
+        )
+        self.bump_version()
+
+    def get_prompt_ids_with_variants(self) -> Set[int]:
+        """
+        Get the ids of the prompts that have active variants
+        """
+
+        stmt = (
+            select(self.table.prompt_id)
+            .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
+            .where(self.table.variant_weight > 0)
+            .distinct()
+        )
+
+        return {r[0] for r in self.session.execute(stmt).all()}
+
+    async def get_variant_weights(self, prompt_id: int) -> List[Tuple[int, int]]:
+        """
+        Get the (revision_id, weight) of the active variants of a prompt
+        """
+
+        stmt = (
+            select(self.table.id, self.table.variant_weight)
             .where(self.table.is_active == True)  # trunk-ignore(ruff/E712)
             .where(self.table.prompt_id == prompt_id)
-            .order_by(self.table.id.desc())  # type: ignore
+            .where(self.table.variant_weight > 0)
+            .order_by(self.table.id)
+        )
+
+        return [(r[0], r[1]) for r in self.session.execute(stmt).all()]
+
+    async def set_variant_weights(
+        self, prompt: models.PromptRecord, weights: Dict[int, int]
+    ) -> None:
+        """
+        Replace the active variants of a prompt with the supplied revision weights, and bump the
+        prompt's variants version so that cached alias tables are rebuilt
+        """
+
+        self.session.execute(
+            update(self.table)
+            .where(self.table.prompt_id == prompt.id)
+            .where(self.table.variant_weight > 0)
+            .values(variant_weight=0)
+        )
+        for revision_id, weight in weights.items():
+            if weight > 0:
+                self.session.execute(
+                    update(self.table)
+                    .where(self.table.prompt_id == prompt.id)
+                    .where(self.table.id == revision_id)
+                    .values(variant_weight=weight)
+                )
+
+        prompt.variants_version = prompt.variants_version + 1
+        self.session.add(prompt)
+        self.bump_version()
+        self.bump_version(models.PromptRecord.__tablename__)
+        self.session.commit()
+
+    async def get_current_signatures_since(
+        self, horizon: int | None
+    ) -> Tuple[int, List[Tuple[int, bytes | None, str]]]:
+        """
+        Get the (prompt_id, minhash, prompt_text) of the current revisions of active prompts that
+        were written by the transaction with the supplied id or a later one, or of all of them
+        when no transaction id is supplied.
+
+        Revision ids are not in commit order, so the returned horizon is the id of the oldest
+        transaction that was still running before the revisions were read. Every revision that
+        was not committed yet was written by it or a later transaction, and is returned when the
+        horizon is passed to the next call.
+        """
+
+        # The 32 bits of the transaction id that are stored with a row, see age() below
+        new_horizon = (
+            int(
+                self.session.execute(
+                    text("SELECT CAST(pg_snapshot_xmin(pg_current_snapshot()) AS text)")
+                ).scalar_one()
+            )
+            % 2**32
+        )
+
+        # age() compares transaction ids in a way that is safe across their wraparound
+        horizon_condition = "AND age(pr.xmin) <= age(CAST(:horizon AS xid))"
+        sql_statement = text(
+            f"""
+        SELECT pr.prompt_id, pr.minhash, pr.content_hash
+        FROM prompts p
+            INNER JOIN prompts_revisions pr ON pr.id = p.current_revision_id
+        WHERE
+            p.is_active=True {horizon_condition if horizon is not None else ""}
+        """
         )
 
-        return [r[0] for r in self.session.execute(stmt).all()]
+        rows = self.session.execute(sql_statement, {"horizon": str(horizon)}).all()
+
+        # Only revisions written before signatures existed need their text
+        bodies = get_bodies(self.session, (r[2] for r in rows if r[1] is None))
+
+        return new_horizon, [
+            (r[0], r[1], bodies[r[2]].prompt_text if r[1] is None else "") for r in rows
+        ]
+
+    async def create_revision(
+        self,
+        prompt_id: int,
+        body: RevisionBody,
+        flattened_body: RevisionBody | None = None,
+        minhash: bytes | None = None,
+        template: str | None = None,
+        previous_revision: models.PromptRevisionRecord | None = None,
+        valid_from: datetime | None = None,
+        autocommit: bool = True,
+    ) -> models.PromptRevisionRecord:
+        """
+        Create a new current revision of a prompt, storing its body, its flattened body, and the
+        compiled template of the flattened body in the blob table. Bodies are deduplicated by
+        content hash; the body may be stored as a delta against the previous body, and the
+        flattened body as a delta against the body. Pass the time the previous revision was
+        retired as valid_from, so that the validity intervals of a prompt never overlap or gap.
+        The prompt's current_revision_id is set by the statement that inserts the revision.
+        """
+
+        base = None
+        if previous_revision is not None:
+            base = (
+                previous_revision.content_hash,
+                previous_revision.body,
+                previous_revision.blob.delta_depth,
+            )
+
+        if flattened_body is None or flattened_body == body:
+            content_hash, _ = self._store_blob(body, base=base, template=template)
+            flattened_hash = content_hash
+        else:
+            content_hash, delta_depth = self._store_blob(body, base=base)
+            flattened_hash, _ = self._store_blob(
+                flattened_body, base=(content_hash, body, delta_depth), template=template
+            )
+
+        # Inserting the revision and pointing the prompt at it is a single statement, written
+        # against the tables as the ORM cannot return columns of a CTE from an UPDATE
+        revisions_table = self.table.__table__
+        prompts_table = models.PromptRecord.__table__
+        new_revision = (
+            insert(revisions_table)
+            .values(
+                prompt_id=prompt_id,
+                is_current=True,
+                content_hash=content_hash,
+                flattened_hash=flattened_hash,
+                minhash=minhash,
+                valid_from=valid_from or datetime.now(timezone.utc),
+            )
+            .returning(revisions_table.c.id, revisions_table.c.prompt_id)
+            .cte("new_revision")
+        )
+        revision_id = self.session.execute(
+            update(prompts_table)
+            .where(prompts_table.c.id == new_revision.c.prompt_id)
+            .values(current_revision_id=new_revision.c.id)
+            .returning(new_revision.c.id)
+        ).scalar_one()
+        self.bump_version()
+        self.bump_version(models.PromptRecord.__tablename__)
+
+        if autocommit:
+            self.session.commit()
+        else:
+            # The statement bypasses the ORM, so a loaded prompt reloads its current revision
+            prompt = self.session.identity_map.get(
+                self.session.identity_key(models.PromptRecord, prompt_id)
+            )
+            if prompt is not None:
+                self.session.expire(prompt, ["current_revision_id", "revision"])
+
+        return await self.get(revision_id)  # type: ignore
+
+    def _store_blob(
+        self,
+        body: RevisionBody,
+        base: Tuple[str, RevisionBody, int] | None = None,
+        template: str | None = None,
+    ) -> Tuple[str, int]:
+        """
+        Store a body in the blob table unless it is already there, returning its content hash and
+        the depth of its delta chain.
+        """
+
+        encoded_blob = encode_blob(body, base=base)
+        result = self.session.execute(
+            insert(models.PromptBlobRecord)
+            .values(
+                content_hash=encoded_blob.content_hash,
+                base_hash=encoded_blob.base_hash,
+                delta_depth=encoded_blob.delta_depth,
+                payload=encoded_blob.payload,
+                template=template,
+            )
+            .on_conflict_do_nothing(index_elements=["content_hash"])
+        )
+
+        if result.rowcount == 0:
+            # The body was already stored, possibly with a different delta chain
+            existing_blob = self.session.get(models.PromptBlobRecord, encoded_blob.content_hash)
+            return encoded_blob.content_hash, existing_blob.delta_depth  # type: ignore
+
+        return encoded_blob.content_hash, encoded_blob.delta_depth
 
 
 async def get_db_prompts(session: Session = Depends(get_session)):
@@ -129,5 +957,9 @@ async def get_db_prompts_history(session: Session = Depends(get_session)):
     yield AdapterPromptsHistory(session, models.PromptHistoryRecord)
 
 
+async def get_db_prompts_releases(session: Session = Depends(get_session)):
+    yield AdapterPromptReleases(session, models.PromptReleaseRecord)
+
+
 async def get_db_prompts_revision(session: Session = Depends(get_session)):
     yield AdapterPromptRevision(session, models.PromptRevisionRecord)
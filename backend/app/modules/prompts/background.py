@@ -1,4 +1,5 @@
 from app.modules.prompts.adapters import AdapterPromptsHistory
+from app.modules.prompts.similarity import get_similarity_index
 
 
 async def update_prompt_history(
@@ -9,3 +10,12 @@ async def update_prompt_history(
     """
 
     await db_prompt_history.create({"prompt_id": prompt_id, "revision_id": revision_id})
+
+
+def update_similarity_index(*prompt_ids: int):
+    """
+    Bring the vectors of created, updated or deleted prompts in the similarity index in line
+    with the database.
+    """
+
+    get_similarity_index().update(prompt_ids)
@@ -0,0 +1,56 @@
+"""
+This module contains the refresh of the current catalogue view.
+
+The current list and the command list are read from the prompts_current materialized view,
+which holds the current revision of every active prompt with a unique index on slug, so reading
+them is a single ordered index scan instead of a join. The view is refreshed concurrently, which
+never blocks its readers, once writes have settled.
+"""
+from functools import lru_cache
+
+from app.config import get_config
+from app.core.debounce import Debouncer
+from app.database.meta import open_session
+from app.modules.prompts import models
+from app.modules.prompts.adapters import AdapterPrompts
+from dpn_pyutils.common import get_logger
+from starlette.concurrency import run_in_threadpool
+
+log = get_logger(__name__)
+
+
+def refresh_catalogue_view() -> None:
+    """
+    Refresh the current catalogue view on a session of its own
+    """
+
+    with open_session() as session:
+        AdapterPrompts(session, models.PromptRecord).refresh_current_view()
+
+
+async def refresh_after_writes() -> None:
+    """
+    Refresh the current catalogue view once writes have settled, outside of any request. The
+    refresh runs in the thread pool, as it waits on the database.
+    """
+
+    await run_in_threadpool(refresh_catalogue_view)
+
+    log.debug("Refreshed the current catalogue view")
+
+
+@lru_cache()
+def get_catalogue_debouncer() -> Debouncer:
+    """
+    Gets the debouncer that refreshes the current catalogue view once writes have settled in
+    this process
+    """
+
+    config = get_config()
+
+    return Debouncer(
+        "prompt-catalogue-refresh",
+        refresh_after_writes,
+        settle_seconds=float(config.CATALOGUE_REFRESH_SETTLE_SECONDS),
+        max_wait_seconds=float(config.CATALOGUE_REFRESH_MAX_WAIT_SECONDS),
+    )
@@ -0,0 +1,170 @@
+"""
+This module contains the content-addressed storage of revision bodies.
+
+A revision body is its description and prompt text. Bodies are stored once in the
+prompts_blobs table, keyed by the sha256 of their canonical encoding, and compressed with zlib.
+A body may instead be stored as a delta against the body of the previous revision, by using the
+previous body as the zlib preset dictionary; this is only done when it is smaller, and the
+chain of deltas is bounded so that decoding a body never walks a long history.
+
+Bodies are immutable, so decoded bodies are kept in a bounded LRU keyed by content hash, sized
+by BODY_CACHE_SIZE. Reads may run in the thread pool, so the LRU is guarded by a lock.
+"""
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+from app.config import get_config
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+COMPRESSION_LEVEL = 9
+"""
+Bodies are compressed once when written and read many times, so the highest level is used
+"""
+
+MAX_DELTA_DEPTH = 8
+"""
+The maximum number of deltas between a body and a fully stored body
+"""
+
+ZDICT_MAX_BYTES = 32768
+"""
+zlib only uses the last 32 KiB of a preset dictionary
+"""
+
+
+class RevisionBody(NamedTuple):
+    """
+    The content of a revision.
+    """
+
+    description: str
+    prompt_text: str
+
+
+class EncodedBlob(NamedTuple):
+    """
+    A body encoded for the prompts_blobs table.
+    """
+
+    content_hash: str
+    payload: bytes
+    base_hash: str | None
+    delta_depth: int
+
+
+def encode_body(body: RevisionBody) -> bytes:
+    """
+    Gets the canonical byte encoding of a body, the content hash is computed over these bytes
+    """
+
+    return json.dumps(
+        [body.description, body.prompt_text], ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def decode_body(data: bytes) -> RevisionBody:
+    """
+    Reads a body from its canonical byte encoding
+    """
+
+    description, prompt_text = json.loads(data.decode("utf-8"))
+
+    return RevisionBody(description=description, prompt_text=prompt_text)
+
+
+def get_content_hash(body: RevisionBody) -> str:
+    """
+    Gets the content hash of a body
+    """
+
+    return hashlib.sha256(encode_body(body)).hexdigest()
+
+
+def compress(data: bytes, zdict: bytes | None = None) -> bytes:
+    """
+    Compresses data, optionally against a preset dictionary
+    """
+
+    if zdict is None:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=zdict[-ZDICT_MAX_BYTES:])
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(payload: bytes, zdict: bytes | None = None) -> bytes:
+    """
+    Decompresses data, optionally against the preset dictionary it was compressed with
+    """
+
+    if zdict is None:
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = zlib.decompressobj(zdict=zdict[-ZDICT_MAX_BYTES:])
+
+    return decompressor.decompress(payload) + decompressor.flush()
+
+
+def encode_blob(
+    body: RevisionBody, base: Tuple[str, RevisionBody, int] | None = None
+) -> EncodedBlob:
+    """
+    Encodes a body for storage. When a (content_hash, body, delta_depth) base is supplied and the
+    delta chain is not too deep, the body is stored as a delta against the base if that is smaller.
+    """
+
+    data = encode_body(body)
+    content_hash = hashlib.sha256(data).hexdigest()
+    full_payload = compress(data)
+
+    if base is not None:
+        base_hash, base_body, base_depth = base
+        if base_hash != content_hash and base_depth < MAX_DELTA_DEPTH:
+            delta_payload = compress(data, zdict=encode_body(base_body))
+            if len(delta_payload) < len(full_payload):
+                return EncodedBlob(content_hash, delta_payload, base_hash, base_depth + 1)
+
+    return EncodedBlob(content_hash, full_payload, None, 0)
+
+
+class BodyCache:
+    """
+    Bounded LRU of decoded bodies keyed by content hash.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._bodies: OrderedDict[str, RevisionBody] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash: str) -> RevisionBody | None:
+        with self._lock:
+            body = self._bodies.get(content_hash)
+            if body is not None:
+                self._bodies.move_to_end(content_hash)
+
+        return body
+
+    def put(self, content_hash: str, body: RevisionBody) -> None:
+        with self._lock:
+            self._bodies[content_hash] = body
+            self._bodies.move_to_end(content_hash)
+            while len(self._bodies) > self.max_size:
+                self._bodies.popitem(last=False)
+
+
+@lru_cache()
+def get_body_cache() -> BodyCache:
+    """
+    Gets the decoded body cache for this process
+    """
+
+    return BodyCache(int(get_config().BODY_CACHE_SIZE))
@@ -0,0 +1,230 @@
+"""
+This module contains the near-duplicate prompt detection.
+
+Each revision gets a MinHash signature of the character shingles of its prompt text when it is
+written. The signatures of the current revisions are kept in an in-memory LSH banding index: the
+signature is cut into bands and every band is a bucket key, so prompts that share any band are
+candidates. A check only looks at the buckets of the new signature, which keeps its cost the
+same no matter how large the catalogue grows, and never compares the prompt against every other
+prompt.
+
+Every worker keeps its own index. Before a check, a worker whose revisions table version has
+moved loads the current revisions written since the oldest transaction that was running at its
+last load, which covers revisions that committed out of the order of their ids.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+from app.config import get_config
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+SHINGLE_LENGTH = 5
+"""
+Length of the character shingles that make up a prompt's set
+"""
+
+MINHASH_SEED = 1729
+"""
+Fixed seed for the hash functions, every worker and every write must use the same functions for
+the signatures to be comparable
+"""
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@lru_cache()
+def get_hash_parameters(permutations: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gets the multiply-shift hash parameters for the supplied number of permutations
+    """
+
+    rng = np.random.default_rng(MINHASH_SEED)
+    a = rng.integers(1, 2**63, size=permutations, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, size=permutations, dtype=np.uint64)
+
+    return a, b
+
+
+def get_shingles(text: str) -> Set[bytes]:
+    """
+    Gets the set of character shingles of the whitespace-normalized, lowercased text
+    """
+
+    normalized = WHITESPACE_PATTERN.sub(" ", text.lower()).strip()
+    if len(normalized) <= SHINGLE_LENGTH:
+        return {normalized.encode("utf-8")}
+
+    return {
+        normalized[i : i + SHINGLE_LENGTH].encode("utf-8")
+        for i in range(len(normalized) - SHINGLE_LENGTH + 1)
+    }
+
+
+def compute_signature(text: str, permutations: int) -> np.ndarray:
+    """
+    Computes the MinHash signature of the text as an array of uint32
+    """
+
+    shingles = np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s, digest_size=4).digest(), "little")
+            for s in get_shingles(text)
+        ],
+        dtype=np.uint64,
+    )
+    a, b = get_hash_parameters(permutations)
+
+    # Multiply-shift hashing, the uint64 arithmetic wraps around which is what the scheme expects
+    with np.errstate(over="ignore"):
+        hashed = (np.outer(a, shingles) + b[:, None]) >> np.uint64(32)
+
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    """
+    Serializes a signature for storage alongside its revision
+    """
+
+    return signature.astype("<u4").tobytes()
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    """
+    Deserializes a stored signature
+    """
+
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+class DuplicateIndex:
+    """
+    In-memory LSH banding index over the signatures of the current revisions.
+    """
+
+    permutations: int
+    bands: int
+    threshold: float
+
+    versions: Tuple[int, ...] | None = None
+    """
+    The write versions of the revisions table when the signatures were last loaded, nothing is
+    loaded while they are unchanged
+    """
+
+    horizon: int | None = None
+    """
+    The oldest transaction that was running when the signatures were last loaded, later loads
+    only read the revisions written by it or later transactions
+    """
+
+    def __init__(self, permutations: int, bands: int, threshold: float) -> None:
+        if permutations % bands != 0:
+            raise ValueError(
+                f"MinHash permutations ({permutations}) must be a multiple of the bands ({bands})"
+            )
+
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: Dict[bytes, Set[int]] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            band.to_bytes(2, "little")
+            + signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, prompt_id: int, signature: np.ndarray) -> None:
+        """
+        Adds or replaces the signature of a prompt
+        """
+
+        self.remove(prompt_id)
+        self._signatures[prompt_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(prompt_id)
+
+    def remove(self, prompt_id: int) -> None:
+        """
+        Removes the signature of a prompt
+        """
+
+        signature = self._signatures.pop(prompt_id, None)
+        if signature is None:
+            return
+
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(prompt_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def load(
+        self,
+        versions: Tuple[int, ...],
+        horizon: int,
+        rows: Iterable[Tuple[int, bytes | None, str]],
+    ) -> None:
+        """
+        Loads (prompt_id, minhash, prompt_text) rows of current revisions, read after the
+        supplied write versions and transaction horizon. Revisions written before signatures
+        existed have no stored signature and get one computed here.
+        """
+
+        for prompt_id, minhash, prompt_text in rows:
+            if minhash is not None:
+                signature = signature_from_bytes(minhash)
+            else:
+                signature = compute_signature(prompt_text, self.permutations)
+
+            self.add(prompt_id, signature)
+
+        self.versions = versions
+        self.horizon = horizon
+
+    def query(
+        self, signature: np.ndarray, exclude_prompt_id: int | None = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Gets the (prompt_id, estimated Jaccard similarity) pairs at or above the threshold,
+        most similar first
+        """
+
+        candidates: Set[int] = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        candidates.discard(exclude_prompt_id)  # type: ignore
+
+        matches = []
+        for prompt_id in candidates:
+            estimate = float(np.mean(self._signatures[prompt_id] == signature))
+            if estimate >= self.threshold:
+                matches.append((prompt_id, estimate))
+
+        return sorted(matches, key=lambda m: m[1], reverse=True)
+
+
+@lru_cache()
+def get_duplicate_index() -> DuplicateIndex:
+    """
+    Gets the near-duplicate index for this process
+    """
+
+    config = get_config()
+
+    return DuplicateIndex(
+        permutations=int(config.MINHASH_PERMUTATIONS),
+        bands=int(config.MINHASH_BANDS),
+        threshold=float(config.DUPLICATE_SIMILARITY_THRESHOLD),
+    )
@@ -0,0 +1,219 @@
+"""
+This module contains the static export of the read-mostly prompt endpoints.
+
+The current list, the command list, and the detail of every current prompt change a few times a
+day but are read constantly. After every change they are written to a directory as the exact
+JSON the API would return, together with precompressed .gz and .br siblings, so that nginx can
+serve them straight from disk and only fall back to the API when a file is missing (see
+config/snippet.nginx.conf). Every file is written to a temporary file and renamed into place, so
+nginx never serves a partial file.
+
+Prompts with active A/B variants get no detail file, as their detail differs between requests.
+"""
+import fcntl
+import gzip
+import re
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict
+
+from app.config import get_config
+from app.core.debounce import Debouncer
+from app.database.meta import open_session
+from app.modules.prompts import models, schemas
+from app.modules.prompts.adapters import AdapterPromptRevision, AdapterPrompts
+from app.utils.files import read_file_bytes_or_none, write_file_atomic
+from dpn_pyutils.common import get_logger
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+log = get_logger(__name__)
+
+DETAIL_DIRECTORY = "detail"
+"""
+Directory of the per-slug detail files, relative to the export directory
+"""
+
+STATIC_SLUG_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+"""
+Slugs that are safe to use as file names and that the nginx location matches
+"""
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+"""
+Files are compressed once when they change and served many times, so the highest levels are used
+"""
+
+
+def to_json_bytes(model: BaseModel) -> bytes:
+    """
+    Serializes a response model the way the API's JSON responses do
+    """
+
+    return model.json(ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def get_compressed_siblings(data: bytes) -> Dict[str, bytes]:
+    """
+    Gets the precompressed versions of a file keyed by file suffix, brotli is only produced when
+    the brotli package is installed
+    """
+
+    siblings = {".gz": gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        siblings[".br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+
+    return siblings
+
+
+class StaticExporter:
+    """
+    Writes the exported files into a directory, leaving files whose content is unchanged alone.
+    """
+
+    path: Path
+    """
+    The export directory that nginx serves
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds an exclusive lock on the export directory, so that two workers never interleave the
+        files of two exports
+        """
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / ".export.lock", "a+b") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _publish(self, path: Path, data: bytes) -> bool:
+        """
+        Writes a file and its compressed siblings unless it already has this content. The siblings
+        are written first, so a changed file is never served compressed from stale content for
+        longer than the rename that follows.
+        """
+
+        if read_file_bytes_or_none(path) == data:
+            return False
+
+        for suffix, compressed in get_compressed_siblings(data).items():
+            write_file_atomic(path.with_name(path.name + suffix), compressed)
+        write_file_atomic(path, data)
+
+        return True
+
+    def _unpublish(self, path: Path) -> None:
+        for suffix in ("", ".gz", ".br"):
+            path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+    def export(self, current: bytes, commands: bytes, details: Dict[str, bytes]) -> None:
+        """
+        Writes the current list, the command list, and the detail files, and removes the detail
+        files of prompts that are no longer exported
+        """
+
+        with self._locked():
+            detail_path = self.path / DETAIL_DIRECTORY
+            written = 0
+            for slug, data in details.items():
+                written += self._publish(detail_path / f"{slug}.json", data)
+
+            if detail_path.exists():
+                for stale_path in detail_path.glob("*.json"):
+                    if stale_path.stem not in details:
+                        self._unpublish(stale_path)
+
+            written += self._publish(self.path / "current.json", current)
+            written += self._publish(self.path / "commands.json", commands)
+
+        log.debug("Exported static prompt files to '%s', %d changed", self.path, written)
+
+
+def export_catalogue(
+    db_prompts: AdapterPrompts, db_prompts_revision: AdapterPromptRevision
+) -> None:
+    """
+    Export the current catalogue to the static export directory. Both adapters must share a
+    session.
+
+    Reads the whole catalogue, compresses every file and waits on the export lock of the other
+    workers, so it runs in the thread pool.
+    """
+
+    _, total_rows, current_rows = db_prompts.read_catalogue()
+    current = to_json_bytes(schemas.PromptCurrentList(total=total_rows, prompts=current_rows))
+    commands = to_json_bytes(
+        schemas.PromptCommandsList(commands=[r.slug for r in current_rows])
+    )
+
+    prompt_ids_with_variants = db_prompts_revision.get_prompt_ids_with_variants()
+    details: Dict[str, bytes] = {}
+    for prompt in db_prompts.get_current_prompts():
+        if prompt.id in prompt_ids_with_variants or not STATIC_SLUG_PATTERN.match(prompt.slug):
+            continue
+
+        prompt_dto = schemas.Prompt.from_orm(prompt)
+        prompt_dto.revision.prompt_text = prompt.revision.flattened_text
+        details[prompt.slug] = to_json_bytes(prompt_dto)
+
+    get_static_exporter().export(current, commands, details)
+
+
+def export_on_own_session() -> None:
+    """
+    Export the catalogue on a session of its own
+    """
+
+    with open_session() as session:
+        export_catalogue(
+            AdapterPrompts(session, models.PromptRecord),
+            AdapterPromptRevision(session, models.PromptRevisionRecord),
+        )
+
+
+async def export_after_writes() -> None:
+    """
+    Export the catalogue once writes have settled, outside of any request
+    """
+
+    await run_in_threadpool(export_on_own_session)
+
+
+@lru_cache()
+def get_static_exporter() -> StaticExporter:
+    """
+    Gets the static exporter for this process
+    """
+
+    return StaticExporter(Path(get_config().STATIC_EXPORT_PATH))
+
+
+@lru_cache()
+def get_export_debouncer() -> Debouncer:
+    """
+    Gets the debouncer that exports the catalogue once writes have settled in this process
+    """
+
+    config = get_config()
+
+    return Debouncer(
+        "prompt-static-export",
+        export_after_writes,
+        settle_seconds=float(config.STATIC_EXPORT_SETTLE_SECONDS),
+        max_wait_seconds=float(config.STATIC_EXPORT_MAX_WAIT_SECONDS),
+    )
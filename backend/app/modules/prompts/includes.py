@@ -0,0 +1,68 @@
+"""
+This module contains the prompt include directives.
+
+A prompt can include the current text of another prompt, e.g. a shared preamble, with:
+
+    {{> slug}}
+
+Includes are resolved when a revision is written, and the result is stored as the revision's
+flattened body, so reads never follow includes. The includes of every current revision form the
+dependency graph in the prompts_includes table, which is kept free of cycles and is used to
+write new revisions, with recomputed flattened bodies, of the prompts that depend on a prompt
+when it changes.
+"""
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+INCLUDE_PATTERN = re.compile(r"(?<!\\)\{\{>\s*(?P<slug>[A-Za-z0-9_-]+)\s*\}\}")
+
+
+def get_included_slugs(text: str) -> List[str]:
+    """
+    Gets the slugs included by the text, in order of first appearance
+    """
+
+    return list(dict.fromkeys(m.group("slug") for m in INCLUDE_PATTERN.finditer(text)))
+
+
+def flatten(text: str, included_texts: Dict[str, str]) -> str:
+    """
+    Replaces the include directives of the text with the supplied flattened texts
+    """
+
+    return INCLUDE_PATTERN.sub(lambda m: included_texts[m.group("slug")], text)
+
+
+def topological_order(nodes: Iterable[int], edges: Iterable[Tuple[int, int]]) -> List[int]:
+    """
+    Orders prompts so that each prompt comes after the prompts it includes. The edges are
+    (prompt_id, included_prompt_id) pairs, edges to prompts outside of the nodes are ignored.
+    """
+
+    node_set = set(nodes)
+    pending_includes: Dict[int, int] = {n: 0 for n in node_set}
+    dependents: Dict[int, List[int]] = {n: [] for n in node_set}
+    for prompt_id, included_prompt_id in edges:
+        if prompt_id in node_set and included_prompt_id in node_set:
+            pending_includes[prompt_id] += 1
+            dependents[included_prompt_id].append(prompt_id)
+
+    ready = sorted(n for n, count in pending_includes.items() if count == 0)
+    ordered: List[int] = []
+    while ready:
+        prompt_id = ready.pop()
+        ordered.append(prompt_id)
+        for dependent_id in dependents[prompt_id]:
+            pending_includes[dependent_id] -= 1
+            if pending_includes[dependent_id] == 0:
+                ready.append(dependent_id)
+
+    if len(ordered) != len(node_set):
+        # The graph is kept acyclic on write, so this only happens if it was edited by hand
+        raise ValueError("The prompt include graph contains a cycle")
+
+    return ordered
@@ -1,12 +1,44 @@
-from typing import TYPE_CHECKING, List
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, List
 
 from app.config import get_config
+from app.database.base import Base, utcnow
 from app.database.types import BaseRecord
-from sqlalchemy import Boolean, ForeignKey, Index, Integer, String
-from sqlalchemy.orm import Mapped, mapped_column, relationship  # type: ignore
+from app.modules.prompts.content import (
+    RevisionBody,
+    decode_body,
+    decompress,
+    encode_body,
+    get_body_cache,
+)
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    select,
+    text,
+)
+from sqlalchemy.orm import (  # type: ignore
+    Mapped,
+    Session,
+    aliased,
+    mapped_column,
+    object_session,
+    relationship,
+)
 
 config = get_config()
 
+CONTENT_HASH_LENGTH = 64
+"""
+Length of a hex encoded sha256 content hash
+"""
+
 
 class PromptRecord(BaseRecord):
     """
@@ -15,22 +47,47 @@ class PromptRecord(BaseRecord):
 
     __tablename__ = "prompts"
 
-    __table_args__ = (Index("ix_slug_is_active", "slug", "is_active"),)
+    __table_args__ = (
+        Index("ix_slug_is_active", "slug", "is_active"),
+        # Serves exact and prefix filters in get_many, see app.database.adapters.plan_text_filter
+        Index("ix_prompts_slug_lower_pattern", text("lower(slug) text_pattern_ops")),
+        # Serves contains (ILIKE '%...%') filters in get_many, requires the pg_trgm extension
+        Index(
+            "ix_prompts_slug_trgm",
+            "slug",
+            postgresql_using="gin",
+            postgresql_ops={"slug": "gin_trgm_ops"},
+        ),
+    )
 
     if TYPE_CHECKING:
         slug: str
+        variants_version: int
+        current_revision_id: int | None
         revision: "PromptRevisionRecord"
         history: List["PromptRevisionRecord"] = []
     else:
         slug: Mapped[str] = mapped_column(
             String(length=config.SLUG_MAX_LENGTH), index=True, nullable=False
         )
+        # Incremented whenever the variant weights of the prompt change
+        variants_version: Mapped[int] = mapped_column(
+            Integer, nullable=False, default=0, server_default=text("0")
+        )
+        # Set in the same statement that creates the revision, see
+        # AdapterPromptRevision.create_revision. The foreign key is created after both tables as
+        # the two tables reference each other.
+        current_revision_id: Mapped[int | None] = mapped_column(
+            Integer(),
+            ForeignKey(
+                "prompts_revisions.id", use_alter=True, name="fk_prompts_current_revision_id"
+            ),
+            nullable=True,
+        )
         revision: Mapped["PromptRevisionRecord"] = relationship(
             "PromptRevisionRecord",
-            back_populates="prompt",
-            # trunk-ignore(ruff/E501)
-            primaryjoin="and_(PromptRecord.id==PromptRevisionRecord.prompt_id, PromptRevisionRecord.is_current==True)",
-            cascade="all,delete",
+            foreign_keys=[current_revision_id],
+            post_update=True,
         )
         history: List["PromptRevisionRecord"] = []
 
@@ -42,28 +99,265 @@ class PromptRevisionRecord(BaseRecord):
 
     __tablename__ = "prompts_revisions"
 
+    __table_args__ = (
+        # Serves paged revision history, see AdapterPromptRevision.get_by_prompt_id
+        Index("ix_prompts_revisions_prompt_id_id", "prompt_id", text("id DESC")),
+        # A prompt has at most one current revision, see adapters.is_current_revision_conflict
+        Index(
+            "ux_prompts_revisions_current",
+            "prompt_id",
+            unique=True,
+            postgresql_where=text("is_current"),
+        ),
+        # Serves variant lookups, see AdapterPromptRevision.get_variant_weights
+        Index(
+            "ix_prompts_revisions_variants",
+            "prompt_id",
+            postgresql_where=text("variant_weight > 0"),
+        ),
+        # Serves point-in-time lookups of a single prompt, see AdapterPromptRevision.get_as_of
+        Index("ix_prompts_revisions_prompt_id_valid_from", "prompt_id", text("valid_from DESC")),
+        # Serves point-in-time lookups of the whole catalogue, see AdapterPrompts.get_current_list
+        Index(
+            "ix_prompts_revisions_validity",
+            text("tstzrange(valid_from, valid_to, '[)')"),
+            postgresql_using="gist",
+        ),
+    )
+
     if TYPE_CHECKING:
         prompt_id: int
         prompt: PromptRecord
         is_current: bool
-        description: str
-        prompt_text: str
+        content_hash: str
+        blob: "PromptBlobRecord"
+        flattened_hash: str
+        flattened_blob: "PromptBlobRecord"
+        variant_weight: int
+        valid_from: datetime
+        valid_to: datetime | None
+        minhash: bytes | None
 
     else:
         prompt_id: Mapped[int] = mapped_column(
-            Integer(), ForeignKey("prompts.id"), index=True, nullable=False
+            Integer(), ForeignKey("prompts.id"), nullable=False
         )
         prompt: Mapped["PromptRecord"] = relationship(
             "PromptRecord",
-            back_populates="revision",
+            foreign_keys=[prompt_id],
         )
         is_current: Mapped[bool] = mapped_column(Boolean, nullable=False)
-        description: Mapped[str] = mapped_column(
-            String(length=config.PROMPT_MAX_LENGTH), nullable=False
+        # The description and prompt text are stored in prompts_blobs, keyed by content hash
+        content_hash: Mapped[str] = mapped_column(
+            String(length=CONTENT_HASH_LENGTH),
+            ForeignKey("prompts_blobs.content_hash"),
+            index=True,
+            nullable=False,
+        )
+        blob: Mapped["PromptBlobRecord"] = relationship(
+            "PromptBlobRecord", foreign_keys=[content_hash], lazy="joined"
+        )
+        # The body with include directives resolved, equal to content_hash without includes
+        flattened_hash: Mapped[str] = mapped_column(
+            String(length=CONTENT_HASH_LENGTH),
+            ForeignKey("prompts_blobs.content_hash"),
+            nullable=False,
+        )
+        flattened_blob: Mapped["PromptBlobRecord"] = relationship(
+            "PromptBlobRecord", foreign_keys=[flattened_hash], lazy="joined"
+        )
+        # Traffic weight of the revision when it is an active A/B variant, zero otherwise
+        variant_weight: Mapped[int] = mapped_column(
+            Integer, nullable=False, default=0, server_default=text("0")
         )
-        prompt_text: Mapped[str] = mapped_column(
-            String(length=config.PROMPT_MAX_LENGTH), nullable=False
+        # The revision was the current revision of its prompt from valid_from (inclusive) until
+        # valid_to (exclusive), valid_to is null while it is still current
+        valid_from: Mapped[datetime] = mapped_column(
+            DateTime(timezone=True), nullable=False, default=utcnow(), server_default=utcnow()
+        )
+        valid_to: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+        # MinHash signature of the prompt text, see app.modules.prompts.duplicates
+        minhash: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+
+    @property
+    def body(self) -> RevisionBody:
+        return self.blob.get_body()
+
+    @property
+    def description(self) -> str:
+        return self.body.description
+
+    @property
+    def prompt_text(self) -> str:
+        return self.body.prompt_text
+
+    @property
+    def flattened_body(self) -> RevisionBody:
+        return self.flattened_blob.get_body()
+
+    @property
+    def flattened_text(self) -> str:
+        return self.flattened_body.prompt_text
+
+
+class PromptIncludeRecord(Base):
+    """
+    Defines the prompts_includes table.
+
+    This table is the dependency graph between prompts: a row means that the current revision of
+    prompt_id includes the prompt included_prompt_id.
+    """
+
+    __tablename__ = "prompts_includes"
+
+    if TYPE_CHECKING:
+        prompt_id: int
+        included_prompt_id: int
+
+    else:
+        prompt_id: Mapped[int] = mapped_column(
+            Integer(), ForeignKey("prompts.id"), primary_key=True
+        )
+        included_prompt_id: Mapped[int] = mapped_column(
+            Integer(), ForeignKey("prompts.id"), primary_key=True, index=True
+        )
+
+
+class PromptBlobRecord(Base):
+    """
+    Defines the prompts_blobs table.
+
+    This table stores each distinct revision body once, compressed and keyed by its content hash.
+    A body may be stored as a delta against a base body, see app.modules.prompts.content.
+    """
+
+    __tablename__ = "prompts_blobs"
+
+    if TYPE_CHECKING:
+        content_hash: str
+        base_hash: str | None
+        base: "PromptBlobRecord | None"
+        delta_depth: int
+        payload: bytes
+        template: str | None
+        created_at: datetime
+
+    else:
+        content_hash: Mapped[str] = mapped_column(
+            String(length=CONTENT_HASH_LENGTH), primary_key=True
+        )
+        base_hash: Mapped[str | None] = mapped_column(
+            String(length=CONTENT_HASH_LENGTH),
+            ForeignKey("prompts_blobs.content_hash"),
+            nullable=True,
+        )
+        base: Mapped["PromptBlobRecord | None"] = relationship(
+            "PromptBlobRecord", remote_side="PromptBlobRecord.content_hash"
+        )
+        delta_depth: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+        payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+        # Placeholder spans of the prompt text, see app.modules.prompts.templates
+        template: Mapped[str | None] = mapped_column(Text, nullable=True)
+        created_at: Mapped[datetime] = mapped_column(
+            DateTime(timezone=True), default=utcnow(), server_default=utcnow()
+        )
+
+    def get_body(self) -> RevisionBody:
+        """
+        Decodes the body, decoding the delta base first when there is one. The blobs of the delta
+        chain are loaded in one query when the base body is not cached.
+        """
+
+        body_cache = get_body_cache()
+        body = body_cache.get(self.content_hash)
+        if body is None:
+            # The identity map only holds weak references, so the chain is kept until decoded
+            chain: Dict[str, PromptBlobRecord] = {}
+            session = object_session(self)
+            if (
+                session is not None
+                and self.base_hash is not None
+                and body_cache.get(self.base_hash) is None
+            ):
+                chain = load_blob_chains(session, (self.base_hash,))
+
+            body = self.decode()
+            chain.clear()
+
+        return body
+
+    def decode(self) -> RevisionBody:
+        """
+        Decodes the body from the blobs of its delta chain that are loaded, using cached base
+        bodies where there are any. A base blob that is neither cached nor loaded is lazy-loaded.
+        """
+
+        body_cache = get_body_cache()
+        body = body_cache.get(self.content_hash)
+        if body is None:
+            zdict = None
+            if self.base_hash is not None:
+                base_body = body_cache.get(self.base_hash)
+                if base_body is None and self.base is not None:
+                    base_body = self.base.decode()
+
+                zdict = encode_body(base_body) if base_body is not None else None
+
+            body = decode_body(decompress(self.payload, zdict=zdict))
+            body_cache.put(self.content_hash, body)
+
+        return body
+
+
+def load_blob_chains(
+    session: Session, content_hashes: Iterable[str]
+) -> Dict[str, PromptBlobRecord]:
+    """
+    Loads the blobs with the supplied content hashes and every blob of their delta chains with
+    one recursive query. While the returned blobs are referenced, their bases are found in the
+    identity map of the session, so decoding them does not query for the bases one at a time.
+    """
+
+    base = aliased(PromptBlobRecord)
+    chain = (
+        select(PromptBlobRecord.content_hash, PromptBlobRecord.base_hash)
+        .where(PromptBlobRecord.content_hash.in_(list(content_hashes)))  # type: ignore
+        .cte("blob_chain", recursive=True)
+    )
+    chain = chain.union(
+        select(base.content_hash, base.base_hash).join(
+            chain, base.content_hash == chain.c.base_hash
+        )
+    )
+    stmt = select(PromptBlobRecord).join(
+        chain, PromptBlobRecord.content_hash == chain.c.content_hash
+    )
+
+    return {blob.content_hash: blob for blob in session.execute(stmt).scalars()}
+
+
+class PromptReleaseRecord(BaseRecord):
+    """
+    Defines the prompts_releases table.
+
+    A release is a frozen snapshot of the current prompt catalogue. The payload is the serialized
+    catalogue, written once when the release is created and never changed, so it can be cached
+    forever by its content hash.
+    """
+
+    __tablename__ = "prompts_releases"
+
+    if TYPE_CHECKING:
+        content_hash: str
+        total: int
+        payload: bytes
+
+    else:
+        content_hash: Mapped[str] = mapped_column(
+            String(length=CONTENT_HASH_LENGTH), index=True, nullable=False
         )
+        total: Mapped[int] = mapped_column(Integer, nullable=False)
+        payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
 
 
 class PromptHistoryRecord(BaseRecord):
@@ -0,0 +1,171 @@
+"""
+This module contains the prompt releases.
+
+A release is a frozen, numbered snapshot of the current prompt catalogue, serialized once when
+it is created and never recomputed. Releases are created on demand, or automatically once writes
+to the catalogue have settled. Their payloads never change, so they are served with a strong
+ETag of their content hash and cached forever by nginx and clients, and bots can pin a release
+and move to a newer one in a single step.
+
+All releases are kept by default. With RELEASE_RETENTION set, releases beyond the most recent
+RELEASE_RETENTION are deleted when a new one is created, but only once they are older than the
+max-age they were served with, so a release that a client may still have cached or pinned never
+answers with a 404.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Tuple
+
+from app.config import get_config
+from app.core.debounce import Debouncer
+from app.database.meta import open_session
+from app.modules.prompts import models, schemas
+from app.modules.prompts.adapters import AdapterPromptReleases, AdapterPrompts
+from app.modules.prompts.rows import CurrentRow
+from dpn_pyutils.common import get_logger
+from starlette.concurrency import run_in_threadpool
+
+log = get_logger(__name__)
+
+RELEASE_CACHE_SIZE = 64
+"""
+The number of release payloads kept in memory
+"""
+
+RELEASE_MAX_AGE_SECONDS = 31536000
+"""
+How long clients and nginx may cache a release payload, one year
+"""
+
+RELEASE_CACHE_CONTROL = f"public, max-age={RELEASE_MAX_AGE_SECONDS}, immutable"
+"""
+Cache-Control of a release payload, which never changes once it is created
+"""
+
+
+def serialize_catalogue(total_rows: int, rows: List[CurrentRow]) -> bytes:
+    """
+    Serializes the current catalogue into a release payload. The total counts all prompt rows,
+    as the total of /current does.
+    """
+
+    return (
+        schemas.PromptCurrentList(total=total_rows, prompts=rows)
+        .json(separators=(",", ":"))
+        .encode("utf-8")
+    )
+
+
+def create_release(
+    db_prompts: AdapterPrompts, db_prompts_releases: AdapterPromptReleases
+) -> models.PromptReleaseRecord:
+    """
+    Create a release of the current catalogue, unless it is identical to the latest release, in
+    which case the latest release is returned. When RELEASE_RETENTION is set, releases beyond the
+    most recent RELEASE_RETENTION that are older than RELEASE_MAX_AGE_SECONDS are deleted in the
+    same transaction. Both adapters must share a session.
+
+    Waits on the release lock and serializes the whole catalogue, so it runs in the thread pool.
+    """
+
+    db_prompts_releases.lock()
+    _, total_rows, rows = db_prompts.read_catalogue()
+    payload = serialize_catalogue(total_rows, rows)
+    content_hash = hashlib.sha256(payload).hexdigest()
+
+    session = db_prompts_releases.session
+    latest_release = db_prompts_releases.read_latest()
+    if latest_release is not None and latest_release.content_hash == content_hash:
+        # Ends the transaction, which releases the lock
+        session.commit()
+        return latest_release
+
+    release = models.PromptReleaseRecord(
+        content_hash=content_hash, total=total_rows, payload=payload
+    )
+    session.add(release)
+    session.flush()
+
+    retention = int(get_config().RELEASE_RETENTION)
+    pruned = 0
+    if retention > 0:
+        pruned = db_prompts_releases.prune(
+            retention,
+            created_before=datetime.now(timezone.utc) - timedelta(seconds=RELEASE_MAX_AGE_SECONDS),
+        )
+
+    session.commit()
+    session.refresh(release)
+    log.info(
+        "Created release %d with %d prompts, deleted %d old releases",
+        release.id,
+        release.total,
+        pruned,
+    )
+
+    return release
+
+
+def create_release_on_own_session() -> None:
+    """
+    Create a release on a session of its own
+    """
+
+    with open_session() as session:
+        create_release(
+            AdapterPrompts(session, models.PromptRecord),
+            AdapterPromptReleases(session, models.PromptReleaseRecord),
+        )
+
+
+async def create_release_after_writes() -> None:
+    """
+    Create a release once writes have settled, outside of any request
+    """
+
+    await run_in_threadpool(create_release_on_own_session)
+
+
+class ReleaseCache:
+    """
+    Bounded LRU of release payloads keyed by release id, payloads never change so entries are
+    never invalidated.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._releases: OrderedDict[int, Tuple[str, bytes]] = OrderedDict()
+
+    def get(self, release_id: int) -> Tuple[str, bytes] | None:
+        release = self._releases.get(release_id)
+        if release is not None:
+            self._releases.move_to_end(release_id)
+
+        return release
+
+    def put(self, release_id: int, content_hash: str, payload: bytes) -> None:
+        self._releases[release_id] = (content_hash, payload)
+        self._releases.move_to_end(release_id)
+        while len(self._releases) > self.max_size:
+            self._releases.popitem(last=False)
+
+
+release_cache = ReleaseCache(RELEASE_CACHE_SIZE)
+
+
+@lru_cache()
+def get_release_debouncer() -> Debouncer:
+    """
+    Gets the debouncer that creates a release once writes have settled in this process
+    """
+
+    config = get_config()
+
+    return Debouncer(
+        "prompt-release",
+        create_release_after_writes,
+        settle_seconds=float(config.RELEASE_SETTLE_SECONDS),
+        max_wait_seconds=float(config.RELEASE_MAX_WAIT_SECONDS),
+    )
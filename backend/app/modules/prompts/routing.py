@@ -1,24 +1,403 @@
+import difflib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple
+
 from app.config import get_config
 from app.core.errors import AppHTTPError
 from app.modules.prompts import background, schemas
 from app.modules.prompts.adapters import (
+    AdapterPromptReleases,
     AdapterPromptRevision,
     AdapterPrompts,
     AdapterPromptsHistory,
     get_db_prompts,
     get_db_prompts_history,
+    get_db_prompts_releases,
     get_db_prompts_revision,
+    is_current_revision_conflict,
+)
+from app.modules.prompts.catalogue import get_catalogue_debouncer
+from app.modules.prompts.content import RevisionBody, get_content_hash
+from app.modules.prompts.duplicates import (
+    compute_signature,
+    get_duplicate_index,
+    signature_from_bytes,
+    signature_to_bytes,
+)
+from app.modules.prompts.export import get_export_debouncer
+from app.modules.prompts.includes import flatten, get_included_slugs
+from app.modules.prompts.models import PromptRecord
+from app.modules.prompts.releases import (
+    RELEASE_CACHE_CONTROL,
+    create_release,
+    get_release_debouncer,
+    release_cache,
+)
+from app.modules.prompts.rows import PromptRow
+from app.modules.prompts.similarity import get_similarity_index
+from app.modules.prompts.snapshot import get_snapshot_store
+from app.modules.prompts.templates import (
+    CompiledTemplate,
+    TemplateRenderError,
+    TemplateSyntaxError,
+    get_template_cache,
+    parse_placeholders,
+    spans_from_json,
+    spans_to_json,
+)
+from app.modules.prompts.variants import AliasTable, get_uniform, variant_cache
+from app.utils.wire import (
+    JSON_MEDIA_TYPE,
+    WireResponse,
+    matches_if_none_match,
+    negotiate_media_type,
+    rows_to_plain,
 )
 from dpn_pyutils.common import get_logger
-from fastapi import APIRouter, BackgroundTasks, Depends, Query, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Query, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import Json
 from slugify import slugify
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 config = get_config()
 
 log = get_logger(__name__)
 
 
+REVISION_HISTORY_MAX_LIMIT = 100
+"""
+The largest page of revision history that can be requested
+"""
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+"""
+Media type of the streamed prompt list, one JSON prompt per line
+"""
+
+TOTAL_COUNT_HEADER = "X-Total-Count"
+"""
+Response header carrying the total number of prompts of a streamed prompt list
+"""
+
+NEAR_DUPLICATE_HEADER = "X-Near-Duplicate-Of"
+"""
+Response header listing the slugs of near-duplicate prompts when the check mode is "warn"
+"""
+
+
+def vary_on_accept(response: Response) -> None:
+    """
+    Marks a response as negotiated from the Accept header, so that caches keep the JSON and
+    binary wire formats apart
+    """
+
+    response.headers["Vary"] = "Accept"
+
+
+async def check_near_duplicates(
+    prompt_text: str,
+    response: Response,
+    db_prompts: AdapterPrompts,
+    db_prompts_revision: AdapterPromptRevision,
+    exclude_prompt_id: int | None = None,
+) -> bytes | None:
+    """
+    Checks the prompt text against the near-duplicate index and returns the MinHash signature to
+    store with the new revision. Depending on DUPLICATE_CHECK_MODE, near-duplicates are either
+    reported in a response header or rejected.
+    """
+
+    check_mode = str(config.DUPLICATE_CHECK_MODE).lower()
+    if check_mode == "off":
+        return None
+
+    # The versions are read first and are commit-ordered, so a revision committed while the
+    # signatures are read is loaded again by the next check
+    duplicate_index = get_duplicate_index()
+    versions = db_prompts_revision.get_table_versions()
+    if versions != duplicate_index.versions:
+        duplicate_index.load(
+            versions,
+            *await db_prompts_revision.get_current_signatures_since(duplicate_index.horizon),
+        )
+
+    signature = compute_signature(prompt_text, duplicate_index.permutations)
+    matches = duplicate_index.query(signature, exclude_prompt_id=exclude_prompt_id)
+    if len(matches) > 0:
+        duplicate_slugs = [
+            r.slug for r in await db_prompts.get_by_ids([m[0] for m in matches]) if r.is_active
+        ]
+
+        if len(duplicate_slugs) > 0:
+            log.info("Prompt is a near-duplicate of %s", duplicate_slugs)
+            response.headers[NEAR_DUPLICATE_HEADER] = ",".join(duplicate_slugs)
+
+            if check_mode == "reject":
+                raise AppHTTPError(
+                    detail="PROMPT_NEAR_DUPLICATE",
+                    status_code=status.HTTP_409_CONFLICT,
+                    headers={NEAR_DUPLICATE_HEADER: ",".join(duplicate_slugs)},
+                )
+
+    return signature_to_bytes(signature)
+
+
+def compile_prompt_template(prompt_text: str) -> str:
+    """
+    Parses and validates the placeholders of prompt text that is about to be written, returning
+    the compiled template to store alongside the revision body.
+    """
+
+    try:
+        return spans_to_json(parse_placeholders(prompt_text))
+    except TemplateSyntaxError as e:
+        raise AppHTTPError(
+            detail={"code": "PROMPT_TEMPLATE_INVALID", "reason": str(e)},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        ) from e
+
+
+def serialize_prompts_ndjson(
+    batches: Iterable[List[PromptRecord]],
+    db_prompts_revision: AdapterPromptRevision,
+    history: bool,
+    history_limit: int,
+) -> Iterator[bytes]:
+    """
+    Serializes prompts one per line a batch at a time as they are read, so that the response is
+    never held in memory as a whole. The history of a whole batch is read in one query.
+    """
+
+    for batch in batches:
+        # fetching history is an expensive operation
+        if history:
+            histories = db_prompts_revision.get_by_prompt_ids([r.id for r in batch], history_limit)
+            for r in batch:
+                r.history = histories[r.id]
+
+        yield "".join(
+            schemas.Prompt.from_orm(r).json(ensure_ascii=False, separators=(",", ":")) + "\n"
+            for r in batch
+        ).encode("utf-8")
+
+
+async def stream_prompts_ndjson(
+    batches: Iterable[List[PromptRecord]],
+    db_prompts_revision: AdapterPromptRevision,
+    history: bool,
+    history_limit: int,
+) -> AsyncIterator[bytes]:
+    """
+    Streams the serialized prompts of serialize_prompts_ndjson, reading and serializing every
+    batch in the thread pool
+    """
+
+    async for chunk in iterate_in_threadpool(
+        serialize_prompts_ndjson(batches, db_prompts_revision, history, history_limit)
+    ):
+        yield chunk
+
+
+def on_catalogue_changed() -> None:
+    """
+    Schedules the work that follows a change to the current catalogue, once writes have settled
+    """
+
+    get_catalogue_debouncer().trigger()
+
+    if config.CATALOGUE_SNAPSHOT_ENABLE:
+        get_snapshot_store().mark_changed()
+
+    if config.RELEASE_AUTO_ENABLE:
+        get_release_debouncer().trigger()
+
+    if config.STATIC_EXPORT_ENABLE:
+        get_export_debouncer().trigger()
+
+
+def normalize_as_of(as_of: datetime) -> datetime:
+    """
+    Treats a point-in-time timestamp without a timezone as UTC, as every stored time is UTC
+    """
+
+    if as_of.tzinfo is None:
+        return as_of.replace(tzinfo=timezone.utc)
+
+    return as_of
+
+
+async def pick_variant(
+    prompt: PromptRow, client_key: str | None, db_prompts_revision: AdapterPromptRevision
+) -> int | None:
+    """
+    Picks the revision id of the variant to serve, or None when the prompt has no active
+    variants. The alias table is only loaded and built when the variants version changes.
+    """
+
+    if prompt.variants_version == 0:
+        return None
+
+    cache_key = (prompt.id, prompt.variants_version)
+    if cache_key not in variant_cache:
+        weights = await db_prompts_revision.get_variant_weights(prompt.id)
+        variant_cache.put(cache_key, AliasTable(weights) if len(weights) > 0 else None)
+
+    alias_table = variant_cache.get(cache_key)
+    if alias_table is None:
+        return None
+
+    return alias_table.pick(get_uniform(prompt.id, client_key))
+
+
+async def resolve_includes(
+    prompt_text: str, db_prompts: AdapterPrompts, prompt_id: int | None = None
+) -> Tuple[str, List[int]]:
+    """
+    Resolves the include directives of prompt text that is about to be written, returning the
+    flattened text and the ids of the included prompts. Missing prompts and includes that would
+    create a cycle are rejected.
+    """
+
+    included_slugs = get_included_slugs(prompt_text)
+    if len(included_slugs) == 0:
+        return prompt_text, []
+
+    included_prompts = {p.slug: p for p in await db_prompts.get_by_slugs(included_slugs)}
+    missing_slugs = [slug for slug in included_slugs if slug not in included_prompts]
+    if len(missing_slugs) > 0:
+        raise AppHTTPError(
+            detail={"code": "PROMPT_INCLUDE_DOES_NOT_EXIST", "reason": ",".join(missing_slugs)},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+
+    included_prompt_ids = [p.id for p in included_prompts.values()]
+    if prompt_id is not None and await db_prompts.includes_create_cycle(
+        prompt_id, included_prompt_ids
+    ):
+        raise AppHTTPError(
+            detail={"code": "PROMPT_INCLUDE_CYCLE", "reason": ",".join(included_slugs)},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+
+    flattened_text = flatten(
+        prompt_text, {slug: p.revision.flattened_text for slug, p in included_prompts.items()}
+    )
+
+    return flattened_text, included_prompt_ids
+
+
+async def refresh_dependents(
+    prompt_id: int,
+    retired_at: datetime,
+    db_prompts: AdapterPrompts,
+    db_prompts_revision: AdapterPromptRevision,
+) -> List[str]:
+    """
+    Recomputes the flattened bodies of the prompts that include a changed prompt, directly or
+    indirectly, in dependency order, returning the slugs of the prompts that changed. Prompts
+    that do not depend on it are not touched.
+
+    Revisions are immutable, so a dependent whose flattened body changes gets a new revision with
+    the same body, valid from the same instant as the changed prompt's new revision. Nothing is
+    committed, so that the dependents change in the same transaction as the prompt they include.
+    """
+
+    refreshed_slugs = []
+    for dependent_id in await db_prompts.get_dependent_ids(prompt_id):
+        dependent_prompt = await db_prompts.get(dependent_id)
+        if dependent_prompt is None or not dependent_prompt.is_active:
+            continue
+
+        revision = dependent_prompt.revision
+        included_prompts = await db_prompts.get_by_slugs(get_included_slugs(revision.prompt_text))
+        flattened_text = flatten(
+            revision.prompt_text, {p.slug: p.revision.flattened_text for p in included_prompts}
+        )
+        if flattened_text == revision.flattened_text:
+            continue
+
+        log.debug("Refreshing flattened text of prompt '%s'", dependent_prompt.slug)
+        await db_prompts_revision.retire_revision(revision, retired_at)
+        await db_prompts_revision.create_revision(
+            dependent_id,
+            revision.body,
+            flattened_body=RevisionBody(
+                description=revision.description, prompt_text=flattened_text
+            ),
+            minhash=revision.minhash,
+            template=compile_prompt_template(flattened_text),
+            previous_revision=revision,
+            valid_from=retired_at,
+            autocommit=False,
+        )
+        refreshed_slugs.append(dependent_prompt.slug)
+
+    return refreshed_slugs
+
+
+async def get_compiled_template(
+    prompt_slug: str, db_prompts: AdapterPrompts
+) -> Tuple[int, CompiledTemplate]:
+    """
+    Gets the current revision id and compiled template of a prompt, from the template cache when
+    the prompt is hot and from the database otherwise.
+    """
+
+    template_cache = get_template_cache()
+
+    template_key = template_cache.get_key(prompt_slug)
+    if template_key is not None:
+        template = template_cache.get(template_key)
+        if template is not None:
+            return template_key[0], template
+
+    existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+    if existing_prompt is None:
+        raise AppHTTPError(
+            detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    revision = existing_prompt.revision
+    template_key = (revision.id, revision.flattened_hash)
+    template = template_cache.get(template_key)
+    if template is None:
+        try:
+            # Bodies written before templates existed have no stored template
+            spans = (
+                spans_from_json(revision.flattened_blob.template)
+                if revision.flattened_blob.template is not None
+                else parse_placeholders(revision.flattened_text)
+            )
+        except TemplateSyntaxError as e:
+            raise AppHTTPError(
+                detail={"code": "PROMPT_TEMPLATE_INVALID", "reason": str(e)},
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            ) from e
+
+        template = CompiledTemplate(revision.flattened_text, spans)
+
+    template_cache.put(prompt_slug, template_key, template)
+
+    return revision.id, template
+
+
+def get_unified_diff(from_text: str, to_text: str, from_id: int, to_id: int) -> str:
+    """
+    Gets the unified diff between the texts of two revisions.
+    """
+
+    return "".join(
+        difflib.unified_diff(
+            from_text.splitlines(keepends=True),
+            to_text.splitlines(keepends=True),
+            fromfile=f"revision/{from_id}",
+            tofile=f"revision/{to_id}",
+        )
+    )
+
+
 def get_router__prompts() -> APIRouter:
     """
     Get the APIRouter for the prompts REST resource.
@@ -27,7 +406,11 @@ def get_router__prompts() -> APIRouter:
     router = APIRouter(prefix="/prompts")
 
     @router.get(
-        "", response_model=None, status_code=status.HTTP_200_OK, name="prompts:list"
+        "",
+        response_model=None,
+        status_code=status.HTTP_200_OK,
+        name="prompts:list",
+        dependencies=[Depends(vary_on_accept)],
     )
     async def prompts__list(
         filter_input: Json | None = Query({}),
@@ -37,18 +420,51 @@ def get_router__prompts() -> APIRouter:
         range_end: int = Query(-1),  # No limit
         ids: Json | None = Query({}),
         history: bool = Query(False),
+        history_limit: int = Query(
+            config.REVISION_HISTORY_PAGE_SIZE, ge=1, le=REVISION_HISTORY_MAX_LIMIT
+        ),
+        stream: bool = Query(False),
+        accept: str | None = Header(None),
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
         db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
     ):
         """
         Get a list of prompts.
+
+        With stream=true or "Accept: application/x-ndjson" the prompts are streamed as newline
+        delimited JSON while they are read from the database, and the total is sent in the
+        X-Total-Count header. With "Accept: application/msgpack", or application/cbor when it is
+        available, the list is sent in that binary wire format.
         """
 
+        if stream or (accept is not None and NDJSON_MEDIA_TYPE in accept):
+            if ids is not None and len(ids) > 0:
+                id_records = await db_prompts.get_by_ids(ids)
+                stream_batches: Iterable[List[PromptRecord]] = [id_records]
+                total_rows = len(id_records)
+            else:
+                total_rows = await db_prompts.total_rows()
+                stream_batches = db_prompts.stream_batches(
+                    row_filter=filter_input,  # type: ignore
+                    sort_col=sort_field,
+                    sort_direction=sort_order,
+                    range_start=range_start,
+                    range_end=range_end,
+                )
+
+            return StreamingResponse(
+                stream_prompts_ndjson(
+                    stream_batches, db_prompts_revision, history, history_limit
+                ),
+                media_type=NDJSON_MEDIA_TYPE,
+                headers={TOTAL_COUNT_HEADER: str(total_rows)},
+            )
+
         if ids is not None and len(ids) > 0:
-            records = await db_prompts.get_by_ids(ids)
+            records = await db_prompts.read_by_ids(ids)
             total_rows = len(records)
         else:
-            records = await db_prompts.get_many(
+            records = await db_prompts.read_many(
                 row_filter=filter_input,  # type: ignore
                 sort_col=sort_field,
                 sort_direction=sort_order,
@@ -58,31 +474,67 @@ def get_router__prompts() -> APIRouter:
 
             total_rows = await db_prompts.total_rows()
 
+        # The rows may be shared through the result cache, so history is set on the DTOs
+        prompts = [schemas.Prompt.from_orm(r) for r in records]
+
         # fetching history is an expensive operation
         if history:
-            for r in records:
-                r.history = await db_prompts_revision.get_by_prompt_id(r.id)
+            for prompt in prompts:
+                prompt.history = [
+                    schemas.PromptRevision.from_orm(h)
+                    for h in await db_prompts_revision.read_by_prompt_id(
+                        prompt.id, limit=history_limit
+                    )
+                ]
 
-        return schemas.PromptList(
-            total=total_rows,
-            prompts=[schemas.Prompt.from_orm(r) for r in records],
-        )
+        prompt_list = schemas.PromptList(total=total_rows, prompts=prompts)
+        media_type = negotiate_media_type(accept)
+        if media_type != JSON_MEDIA_TYPE:
+            return WireResponse(prompt_list.dict(), media_type=media_type)
+
+        return prompt_list
 
     @router.get(
         "/current",
         response_model=schemas.PromptCurrentList,
         status_code=status.HTTP_200_OK,
         name="prompts:current-list",
+        dependencies=[Depends(vary_on_accept)],
     )
     async def prompts__current_list(
+        as_of: datetime | None = Query(None),
+        accept: str | None = Header(None),
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
     ):
         """
-        Get a flat list of current prompts
+        Get a flat list of current prompts, or of the prompts that were current at as_of. The
+        list is sent in the binary wire format negotiated from the Accept header, if any.
         """
 
-        records = await db_prompts.get_current_list()
-        total_rows = await db_prompts.total_rows()
+        media_type = negotiate_media_type(accept)
+
+        if as_of is not None:
+            records = await db_prompts.get_current_list(as_of=normalize_as_of(as_of))
+            total_rows = len(records)
+        else:
+            snapshot = get_snapshot_store().snapshot if config.CATALOGUE_SNAPSHOT_ENABLE else None
+            if snapshot is not None:
+                return Response(
+                    content=get_snapshot_store().get_body(snapshot, "current", media_type),
+                    media_type=media_type,
+                    headers={"Vary": "Accept"},
+                )
+
+            records = await db_prompts.get_current_list()
+            total_rows = await db_prompts.total_rows()
+
+        if media_type != JSON_MEDIA_TYPE:
+            # The rows already have the fields of the schema, so they are sent without
+            # validating them into models first
+            return WireResponse(
+                {"prompts": rows_to_plain(schemas.PromptListRow, records), "total": total_rows},
+                media_type=media_type,
+            )
 
         return schemas.PromptCurrentList(total=total_rows, prompts=records)
 
@@ -91,64 +543,503 @@ def get_router__prompts() -> APIRouter:
         response_model=schemas.PromptCommandsList,
         status_code=status.HTTP_200_OK,
         name="prompts:commands-list",
+        dependencies=[Depends(vary_on_accept)],
     )
     async def prompts__commands_list(
+        accept: str | None = Header(None),
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
     ):
         """
-        Get a flat list of current commands
+        Get a flat list of current commands, in the binary wire format negotiated from the
+        Accept header, if any
         """
 
+        media_type = negotiate_media_type(accept)
+
+        snapshot = get_snapshot_store().snapshot if config.CATALOGUE_SNAPSHOT_ENABLE else None
+        if snapshot is not None:
+            return Response(
+                content=get_snapshot_store().get_body(snapshot, "commands", media_type),
+                media_type=media_type,
+                headers={"Vary": "Accept"},
+            )
+
         records = await db_prompts.get_current_commands()
+        if media_type != JSON_MEDIA_TYPE:
+            return WireResponse({"commands": records}, media_type=media_type)
 
         return schemas.PromptCommandsList(commands=records)
 
 
 
+    @router.get(
+        "/releases",
+        response_model=schemas.PromptReleaseList,
+        status_code=status.HTTP_200_OK,
+        name="prompts:releases",
+    )
+    async def prompts__releases(
+        db_prompts_releases: AdapterPromptReleases = Depends(get_db_prompts_releases),
+    ):
+        """
+        Get the most recent releases, newest first
+        """
+
+        releases = await db_prompts_releases.get_recent(int(config.RELEASE_LIST_LIMIT))
+
+        return schemas.PromptReleaseList(
+            releases=[schemas.PromptRelease.from_orm(r) for r in releases]
+        )
+
+    @router.post(
+        "/releases",
+        response_model=schemas.PromptRelease,
+        status_code=status.HTTP_201_CREATED,
+        name="prompts:release-create",
+    )
+    async def prompts__release_create(
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_releases: AdapterPromptReleases = Depends(get_db_prompts_releases),
+    ):
+        """
+        Create a release of the current catalogue, returning the latest release instead when the
+        catalogue has not changed since
+        """
+
+        release = await run_in_threadpool(create_release, db_prompts, db_prompts_releases)
+
+        return schemas.PromptRelease.from_orm(release)
+
+    @router.get(
+        "/releases/latest",
+        response_model=schemas.PromptRelease,
+        status_code=status.HTTP_200_OK,
+        name="prompts:release-latest",
+    )
+    async def prompts__release_latest(
+        response: Response,
+        db_prompts_releases: AdapterPromptReleases = Depends(get_db_prompts_releases),
+    ):
+        """
+        Get the latest release, which bots poll to find out when to move to a newer release
+        """
+
+        latest_release = await db_prompts_releases.get_latest()
+        if latest_release is None:
+            raise AppHTTPError(
+                detail="PROMPT_RELEASE_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        response.headers["Cache-Control"] = "no-cache"
+
+        return schemas.PromptRelease.from_orm(latest_release)
+
+    @router.get(
+        "/releases/{release_id}",
+        response_model=schemas.PromptCurrentList,
+        status_code=status.HTTP_200_OK,
+        name="prompts:release",
+    )
+    async def prompts__release(
+        release_id: int,
+        if_none_match: str | None = Header(None),
+        db_prompts_releases: AdapterPromptReleases = Depends(get_db_prompts_releases),
+    ):
+        """
+        Get the catalogue of a release. The payload is served exactly as it was stored when the
+        release was created, with a strong ETag of its content hash.
+        """
+
+        cached_release = release_cache.get(release_id)
+        if cached_release is None:
+            release = await db_prompts_releases.get(release_id)
+            if release is None:
+                raise AppHTTPError(
+                    detail="PROMPT_RELEASE_DOES_NOT_EXIST",
+                    status_code=status.HTTP_404_NOT_FOUND,
+                )
+
+            release_cache.put(release.id, release.content_hash, release.payload)
+            cached_release = (release.content_hash, release.payload)
+
+        content_hash, payload = cached_release
+        headers = {"ETag": f'"{content_hash}"', "Cache-Control": RELEASE_CACHE_CONTROL}
+        if if_none_match is not None and matches_if_none_match(if_none_match, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(content=payload, media_type="application/json", headers=headers)
+
     @router.get(
         "/detail/{prompt_slug}",
         response_model=schemas.Prompt,
         status_code=status.HTTP_200_OK,
         name="prompts:single",
+        dependencies=[Depends(vary_on_accept)],
     )
     async def prompts__get_one(
         prompt_slug: str,
         background_tasks: BackgroundTasks,
         history: bool = Query(False),
+        history_limit: int = Query(
+            config.REVISION_HISTORY_PAGE_SIZE, ge=1, le=REVISION_HISTORY_MAX_LIMIT
+        ),
+        history_before_id: int | None = Query(None),
+        client_key: str | None = Query(None),
+        x_client_key: str | None = Header(None),
+        as_of: datetime | None = Query(None),
+        accept: str | None = Header(None),
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
         db_prompts_history: AdapterPromptsHistory = Depends(get_db_prompts_history),
         db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
     ):
         """
-        Get an individual prompt by slug.
+        Get an individual prompt by slug. When the prompt has active variants, one is picked by
+        weight, sticky per client key when one is supplied.
+
+        With as_of, the revision that was current at that time is returned instead; variants are
+        not applied and the lookup is not recorded as a use of the prompt.
+
+        The prompt is sent in the binary wire format negotiated from the Accept header, if any.
         """
 
+        media_type = negotiate_media_type(accept)
+
+        if as_of is not None:
+            log.debug("Getting prompt '%s' as of %s", prompt_slug, as_of)
+            revision_as_of = await db_prompts_revision.get_as_of(
+                prompt_slug, normalize_as_of(as_of)
+            )
+            if revision_as_of is None:
+                raise AppHTTPError(
+                    detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+                )
+
+            prompt_as_of = revision_as_of.prompt
+            dto_as_of = schemas.Prompt(
+                id=prompt_as_of.id,
+                slug=prompt_as_of.slug,
+                is_active=prompt_as_of.is_active,
+                revision=schemas.PromptRevision.from_orm(revision_as_of),
+            )
+            dto_as_of.revision.prompt_text = revision_as_of.flattened_text
+
+            if history:
+                history_records = await db_prompts_revision.get_by_prompt_id(
+                    prompt_as_of.id, limit=history_limit, before_id=history_before_id
+                )
+                dto_as_of.history = [schemas.PromptRevision.from_orm(h) for h in history_records]
+
+            if media_type != JSON_MEDIA_TYPE:
+                return WireResponse(dto_as_of.dict(), media_type=media_type)
+
+            return dto_as_of
+
         log.debug("Getting an individual prompt by slug '%s'", prompt_slug)
-        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        existing_prompt = await db_prompts.read_by_slug(prompt_slug)
         if existing_prompt is None:
             raise AppHTTPError(
                 detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
             )
 
+        served_revision = existing_prompt.revision
+        variant_revision_id = await pick_variant(
+            existing_prompt, client_key or x_client_key, db_prompts_revision
+        )
+        if variant_revision_id is not None and variant_revision_id != served_revision.id:
+            served_revision = (
+                await db_prompts_revision.read_by_id(variant_revision_id) or served_revision
+            )
+
         background_tasks.add_task(
             background.update_prompt_history,
             db_prompts_history,
             existing_prompt.id,
-            existing_prompt.revision.id,
+            served_revision.id,
         )
 
         existing_dto = schemas.Prompt.from_orm(existing_prompt)
+        existing_dto.revision = schemas.PromptRevision.from_orm(served_revision)
+        existing_dto.revision.prompt_text = served_revision.flattened_text
 
         if history:
-            history_records = await db_prompts_revision.get_by_prompt_id(
-                existing_prompt.id
+            history_records = await db_prompts_revision.read_by_prompt_id(
+                existing_prompt.id, limit=history_limit, before_id=history_before_id
             )
             existing_dto.history = [
                 schemas.PromptRevision.from_orm(h) for h in history_records
             ]
 
+        if media_type != JSON_MEDIA_TYPE:
+            return WireResponse(existing_dto.dict(), media_type=media_type)
+
         return existing_dto
 
+    @router.get(
+        "/detail/{prompt_slug}/revisions",
+        response_model=schemas.PromptRevisionPage,
+        status_code=status.HTTP_200_OK,
+        name="prompts:revisions",
+    )
+    async def prompts__revisions(
+        prompt_slug: str,
+        limit: int = Query(config.REVISION_HISTORY_PAGE_SIZE, ge=1, le=REVISION_HISTORY_MAX_LIMIT),
+        before_id: int | None = Query(None),
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
+    ):
+        """
+        Get a page of revision summaries for an individual prompt, newest first.
+        """
+
+        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        if existing_prompt is None:
+            raise AppHTTPError(
+                detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        # Fetch one extra summary to know whether there is a next page
+        summaries = await db_prompts_revision.get_summaries_by_prompt_id(
+            existing_prompt.id, limit=limit + 1, before_id=before_id
+        )
+        page = summaries[:limit]
+
+        return schemas.PromptRevisionPage(
+            revisions=[schemas.PromptRevisionSummary.from_orm(r) for r in page],
+            next_before_id=page[-1].id if len(summaries) > limit else None,
+        )
+
+    @router.get(
+        "/variants/{prompt_slug}",
+        response_model=schemas.PromptVariantList,
+        status_code=status.HTTP_200_OK,
+        name="prompts:variants",
+    )
+    async def prompts__variants(
+        prompt_slug: str,
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
+    ):
+        """
+        Get the active A/B variants of a prompt.
+        """
+
+        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        if existing_prompt is None:
+            raise AppHTTPError(
+                detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        weights = await db_prompts_revision.get_variant_weights(existing_prompt.id)
+
+        return schemas.PromptVariantList(
+            variants=[schemas.PromptVariant(revision_id=r, weight=w) for r, w in weights],
+            variants_version=existing_prompt.variants_version,
+        )
+
+    @router.put(
+        "/variants/{prompt_slug}",
+        response_model=schemas.PromptVariantList,
+        status_code=status.HTTP_200_OK,
+        name="prompts:variants-update",
+    )
+    async def prompts__variants_update(
+        prompt_slug: str,
+        update_request: schemas.PromptVariantsUpdate,
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
+    ):
+        """
+        Replace the active A/B variants of a prompt with the supplied revision weights.
+        """
+
+        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        if existing_prompt is None:
+            raise AppHTTPError(
+                detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        weights = {v.revision_id: v.weight for v in update_request.variants}
+        revisions = await db_prompts_revision.get_by_ids(list(weights))
+        valid_revision_ids = {
+            r.id for r in revisions if r.prompt_id == existing_prompt.id and r.is_active
+        }
+        if any(revision_id not in valid_revision_ids for revision_id in weights):
+            raise AppHTTPError(
+                detail="PROMPT_REVISION_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        await db_prompts_revision.set_variant_weights(existing_prompt, weights)
+        on_catalogue_changed()
+        weights_list = await db_prompts_revision.get_variant_weights(existing_prompt.id)
+
+        return schemas.PromptVariantList(
+            variants=[schemas.PromptVariant(revision_id=r, weight=w) for r, w in weights_list],
+            variants_version=existing_prompt.variants_version,
+        )
+
+    @router.get(
+        "/detail/{prompt_slug}/similar",
+        response_model=schemas.PromptSimilarList,
+        status_code=status.HTTP_200_OK,
+        name="prompts:similar",
+    )
+    async def prompts__similar(
+        prompt_slug: str,
+        k: int = Query(5, ge=1, le=50),
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+    ):
+        """
+        Get the prompts most similar to an individual prompt. Answers with a 503 while the
+        similarity index is being built.
+        """
+
+        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        if existing_prompt is None:
+            raise AppHTTPError(
+                detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        # The index is built in the background when a worker starts without one
+        similarity_index = get_similarity_index()
+        if not similarity_index.is_built:
+            raise AppHTTPError(
+                detail="SIMILARITY_INDEX_NOT_READY",
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "5"},
+            )
+
+        scores = dict(await run_in_threadpool(similarity_index.similar, existing_prompt.id, k))
+        similar_prompts = [
+            r for r in await db_prompts.get_by_ids(list(scores)) if r.is_active
+        ]
+
+        return schemas.PromptSimilarList(
+            prompts=sorted(
+                (
+                    schemas.PromptSimilarRow(
+                        id=r.id,
+                        slug=r.slug,
+                        description=r.revision.description,
+                        score=scores[r.id],
+                    )
+                    for r in similar_prompts
+                ),
+                key=lambda r: r.score,
+                reverse=True,
+            )
+        )
+
+    @router.get(
+        "/detail/{prompt_slug}/diff",
+        response_model=schemas.PromptRevisionDiff,
+        status_code=status.HTTP_200_OK,
+        name="prompts:revision-diff",
+    )
+    async def prompts__revision_diff(
+        prompt_slug: str,
+        from_id: int = Query(...),
+        to_id: int = Query(...),
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
+    ):
+        """
+        Get a unified diff between two revisions of an individual prompt.
+        """
+
+        existing_prompt = await db_prompts.get_by_slug(prompt_slug)
+        if existing_prompt is None:
+            raise AppHTTPError(
+                detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
+            )
+
+        revisions = {r.id: r for r in await db_prompts_revision.get_by_ids([from_id, to_id])}
+        for revision_id in (from_id, to_id):
+            revision = revisions.get(revision_id)
+            if revision is None or revision.prompt_id != existing_prompt.id:
+                raise AppHTTPError(
+                    detail="PROMPT_REVISION_DOES_NOT_EXIST",
+                    status_code=status.HTTP_404_NOT_FOUND,
+                )
+
+        from_body = revisions[from_id].body
+        to_body = revisions[to_id].body
+
+        return schemas.PromptRevisionDiff(
+            from_id=from_id,
+            to_id=to_id,
+            is_identical=revisions[from_id].content_hash == revisions[to_id].content_hash,
+            description_diff=get_unified_diff(
+                from_body.description, to_body.description, from_id, to_id
+            ),
+            prompt_text_diff=get_unified_diff(
+                from_body.prompt_text, to_body.prompt_text, from_id, to_id
+            ),
+        )
+
+    @router.post(
+        "/render/{prompt_slug}",
+        response_model=schemas.PromptRendered,
+        status_code=status.HTTP_200_OK,
+        name="prompts:render",
+    )
+    async def prompts__render(
+        prompt_slug: str,
+        render_request: schemas.PromptRenderRequest,
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+    ):
+        """
+        Render the current revision of a prompt with the supplied template variables.
+        """
+
+        revision_id, template = await get_compiled_template(prompt_slug, db_prompts)
+
+        try:
+            text = template.render(render_request.variables)
+        except TemplateRenderError as e:
+            raise AppHTTPError(
+                detail={"code": "TEMPLATE_VARIABLES_MISSING", "reason": ",".join(e.missing)},
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            ) from e
+
+        return schemas.PromptRendered(slug=prompt_slug, revision_id=revision_id, text=text)
+
+    @router.post(
+        "/render",
+        response_model=schemas.PromptRenderedBatch,
+        status_code=status.HTTP_200_OK,
+        name="prompts:render-batch",
+    )
+    async def prompts__render_batch(
+        render_request: schemas.PromptRenderBatchRequest,
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+    ):
+        """
+        Render a batch of prompts, each item reports its own error instead of failing the batch.
+        """
+
+        results = []
+        for item in render_request.items:
+            try:
+                revision_id, template = await get_compiled_template(item.slug, db_prompts)
+                results.append(
+                    schemas.PromptRendered(
+                        slug=item.slug,
+                        revision_id=revision_id,
+                        text=template.render(item.variables),
+                    )
+                )
+            except AppHTTPError as e:
+                error = e.detail["code"] if isinstance(e.detail, dict) else e.detail
+                results.append(schemas.PromptRendered(slug=item.slug, error=error))
+            except TemplateRenderError as e:
+                results.append(
+                    schemas.PromptRendered(
+                        slug=item.slug, error="TEMPLATE_VARIABLES_MISSING", missing=e.missing
+                    )
+                )
+
+        return schemas.PromptRenderedBatch(results=results)
+
     @router.post(
         "",
         response_model=schemas.Prompt,
@@ -157,6 +1048,8 @@ def get_router__prompts() -> APIRouter:
     )
     async def prompts__create(
         create_request: schemas.PromptCreate,
+        response: Response,
+        background_tasks: BackgroundTasks,
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
         db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
     ):
@@ -171,17 +1064,39 @@ def get_router__prompts() -> APIRouter:
                 detail="PROMPT_ALREADY_EXISTS", status_code=status.HTTP_400_BAD_REQUEST
             )
 
+        flattened_text, included_prompt_ids = await resolve_includes(
+            create_request.prompt_text, db_prompts
+        )
+        template = compile_prompt_template(flattened_text)
+        minhash = await check_near_duplicates(
+            create_request.prompt_text, response, db_prompts, db_prompts_revision
+        )
+
         prompt_dict = create_request.dict(include={"slug"})
         prompt_dict["slug"] = slugify(prompt_dict["slug"])
 
-        created_prompt = await db_prompts.create(prompt_dict)
+        # The prompt, its first revision and its include edges are committed together
+        created_prompt = await db_prompts.create(prompt_dict, autocommit=False)
+
+        await db_prompts_revision.create_revision(
+            created_prompt.id,
+            RevisionBody(
+                description=create_request.description, prompt_text=create_request.prompt_text
+            ),
+            flattened_body=RevisionBody(
+                description=create_request.description, prompt_text=flattened_text
+            ),
+            minhash=minhash,
+            template=template,
+            autocommit=False,
+        )
+        await db_prompts.set_includes(created_prompt.id, included_prompt_ids)
 
-        revision_dict = create_request.dict(include={"description", "prompt_text"})
-        revision_dict["prompt_id"] = created_prompt.id
-        revision_dict["is_current"] = True
+        if minhash is not None:
+            get_duplicate_index().add(created_prompt.id, signature_from_bytes(minhash))
 
-        created_revision = await db_prompts_revision.create(revision_dict)
-        created_prompt.revision = created_revision
+        background_tasks.add_task(background.update_similarity_index, created_prompt.id)
+        on_catalogue_changed()
 
         return schemas.Prompt.from_orm(created_prompt)
 
@@ -193,6 +1108,8 @@ def get_router__prompts() -> APIRouter:
     )
     async def prompts__update(
         update_request: schemas.PromptUpdate,
+        response: Response,
+        background_tasks: BackgroundTasks,
         db_prompts: AdapterPrompts = Depends(get_db_prompts),
         db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
     ):
@@ -214,22 +1131,71 @@ def get_router__prompts() -> APIRouter:
                 detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
             )
 
-        # Remove existing current revision
-        await db_prompts_revision.update(
-            existing_prompt.revision, {"is_current": False}
+        revision_body = RevisionBody(
+            description=update_request.data.description,
+            prompt_text=update_request.data.prompt_text,
         )
 
-        # Update the prompt by creating a new revision
-        revision_dict = update_request.data.dict(include={"description", "prompt_text"})
-        revision_dict["prompt_id"] = existing_prompt.id
-        revision_dict["is_current"] = True
-        new_revision = await db_prompts_revision.create(revision_dict)
+        previous_revision = existing_prompt.revision
+        if get_content_hash(revision_body) == previous_revision.content_hash:
+            log.debug("Update does not change the prompt, keeping the current revision")
+            return schemas.Prompt.from_orm(existing_prompt)
 
-        updated_prompt = await db_prompts.update(
-            existing_prompt, {"revision": new_revision}
+        flattened_text, included_prompt_ids = await resolve_includes(
+            update_request.data.prompt_text, db_prompts, prompt_id=existing_prompt.id
+        )
+        template = compile_prompt_template(flattened_text)
+        minhash = await check_near_duplicates(
+            update_request.data.prompt_text,
+            response,
+            db_prompts,
+            db_prompts_revision,
+            exclude_prompt_id=existing_prompt.id,
         )
 
-        return schemas.Prompt.from_orm(updated_prompt)
+        try:
+            # Remove existing current revision, the new revision is valid from the same instant
+            retired_at = datetime.now(timezone.utc)
+            await db_prompts_revision.retire_revision(previous_revision, retired_at)
+
+            # Update the prompt by creating a new revision
+            await db_prompts_revision.create_revision(
+                existing_prompt.id,
+                revision_body,
+                flattened_body=RevisionBody(
+                    description=revision_body.description, prompt_text=flattened_text
+                ),
+                minhash=minhash,
+                template=template,
+                previous_revision=previous_revision,
+                valid_from=retired_at,
+                autocommit=False,
+            )
+            refreshed_slugs = await refresh_dependents(
+                existing_prompt.id, retired_at, db_prompts, db_prompts_revision
+            )
+
+            # Commits the new revision, the new revisions of its dependents and the include edges
+            await db_prompts.set_includes(existing_prompt.id, included_prompt_ids)
+        except IntegrityError as e:
+            # A concurrent update of the prompt committed its new revision first
+            if not is_current_revision_conflict(e):
+                raise
+
+            raise AppHTTPError(
+                detail="PROMPT_UPDATE_CONFLICT", status_code=status.HTTP_409_CONFLICT
+            ) from e
+
+        for slug in (existing_prompt.slug, *refreshed_slugs):
+            get_template_cache().invalidate_slug(slug)
+
+        if minhash is not None:
+            get_duplicate_index().add(existing_prompt.id, signature_from_bytes(minhash))
+
+        background_tasks.add_task(background.update_similarity_index, existing_prompt.id)
+        on_catalogue_changed()
+
+        return schemas.Prompt.from_orm(existing_prompt)
 
     @router.delete(
         "/{prompt_slug}",
@@ -238,7 +1204,10 @@ def get_router__prompts() -> APIRouter:
         name="prompts:delete",
     )
     async def prompts__delete(
-        prompt_slug: str, db_prompts: AdapterPrompts = Depends(get_db_prompts)
+        prompt_slug: str,
+        background_tasks: BackgroundTasks,
+        db_prompts: AdapterPrompts = Depends(get_db_prompts),
+        db_prompts_revision: AdapterPromptRevision = Depends(get_db_prompts_revision),
     ):
         """
         Delete a prompt by slug.
@@ -251,6 +1220,21 @@ def get_router__prompts() -> APIRouter:
                 detail="PROMPT_DOES_NOT_EXIST", status_code=status.HTTP_404_NOT_FOUND
             )
 
+        # A prompt that others include would leave their flattened text pointing at nothing
+        if len(await db_prompts.get_dependent_ids(existing_prompt.id)) > 0:
+            raise AppHTTPError(
+                detail="PROMPT_IS_INCLUDED", status_code=status.HTTP_409_CONFLICT
+            )
+
+        await db_prompts_revision.retire_revision(
+            existing_prompt.revision, datetime.now(timezone.utc), is_current=True
+        )
         await db_prompts.delete(existing_prompt, hard_delete=False)
+        await db_prompts.set_includes(existing_prompt.id, [])
+
+        get_duplicate_index().remove(existing_prompt.id)
+        get_template_cache().invalidate_slug(existing_prompt.slug)
+        background_tasks.add_task(background.update_similarity_index, existing_prompt.id)
+        on_catalogue_changed()
 
     return router
@@ -0,0 +1,114 @@
+"""
+This module contains the read-only row objects of the prompt read endpoints.
+
+Read endpoints only serialize what they load, so they do not need ORM entities with their
+identity map, change tracking and relationship loaders. The adapters' read_* methods select
+plain columns with Core statements and put each result row into one of these compact objects,
+which the schemas read with from_orm like any other object.
+"""
+from datetime import datetime
+from typing import List, NamedTuple
+
+from app.modules.prompts.content import RevisionBody
+
+
+class CurrentRow(NamedTuple):
+    """
+    A row of the current prompt list, see schemas.PromptListRow.
+    """
+
+    id: int
+    revision_id: int
+    slug: str
+    description: str
+    prompt_text: str
+    is_active: bool
+    updated_at: datetime
+    created_at: datetime
+
+
+class RevisionRow:
+    """
+    A revision with its decoded body and flattened body, see schemas.PromptRevision.
+    """
+
+    __slots__ = (
+        "id",
+        "prompt_id",
+        "is_current",
+        "content_hash",
+        "flattened_hash",
+        "created_at",
+        "updated_at",
+        "body",
+        "flattened_body",
+    )
+
+    id: int
+    prompt_id: int
+    is_current: bool
+    content_hash: str
+    flattened_hash: str
+    created_at: datetime
+    updated_at: datetime
+    body: RevisionBody
+    flattened_body: RevisionBody
+
+    def __init__(
+        self,
+        id: int,
+        prompt_id: int,
+        is_current: bool,
+        content_hash: str,
+        flattened_hash: str,
+        created_at: datetime,
+        updated_at: datetime,
+        body: RevisionBody,
+        flattened_body: RevisionBody,
+    ) -> None:
+        self.id = id
+        self.prompt_id = prompt_id
+        self.is_current = is_current
+        self.content_hash = content_hash
+        self.flattened_hash = flattened_hash
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.body = body
+        self.flattened_body = flattened_body
+
+    @property
+    def description(self) -> str:
+        return self.body.description
+
+    @property
+    def prompt_text(self) -> str:
+        return self.body.prompt_text
+
+    @property
+    def flattened_text(self) -> str:
+        return self.flattened_body.prompt_text
+
+
+class PromptRow:
+    """
+    A prompt with its current revision, see schemas.Prompt.
+    """
+
+    __slots__ = ("id", "slug", "is_active", "variants_version", "revision", "history")
+
+    id: int
+    slug: str
+    is_active: bool
+    variants_version: int
+    revision: RevisionRow
+    history: List[RevisionRow]
+
+    def __init__(
+        self, id: int, slug: str, is_active: bool, variants_version: int, revision: RevisionRow
+    ) -> None:
+        self.id = id
+        self.slug = slug
+        self.is_active = is_active
+        self.variants_version = variants_version
+        self.revision = revision
+        self.history = []
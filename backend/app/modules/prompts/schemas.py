@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List
+from typing import Dict, List
 
 from app.config import get_config
 from pydantic import BaseModel, Field
@@ -15,6 +15,7 @@ class PromptRevision(BaseModel):
     id: int
     description: str
     prompt_text: str
+    content_hash: str
     is_current: bool
     # is_active: bool
     created_at: datetime
@@ -23,6 +24,43 @@ class PromptRevision(BaseModel):
     class Config:
         orm_mode = True
 
+class PromptRevisionSummary(BaseModel):
+    """
+    Describes a prompt revision without its body.
+    """
+
+    id: int
+    content_hash: str
+    is_current: bool
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class PromptRevisionPage(BaseModel):
+    """
+    Describes a page of revision summaries, newest first. Pass next_before_id as before_id to get
+    the next page; it is null on the last page.
+    """
+
+    revisions: List[PromptRevisionSummary]
+    next_before_id: int | None
+
+
+class PromptRevisionDiff(BaseModel):
+    """
+    Describes the unified diff between two revisions of a prompt.
+    """
+
+    from_id: int
+    to_id: int
+    is_identical: bool
+    description_diff: str
+    prompt_text_diff: str
+
+
 class Prompt(BaseModel):
     """
     Describes a prompt structure.
@@ -53,6 +91,9 @@ class PromptListRow(BaseModel):
     updated_at: datetime
     created_at: datetime
 
+    class Config:
+        orm_mode = True
+
 class PromptCurrentList(BaseModel):
     """
     Describes a flat list of prompts based on no filtering.
@@ -62,6 +103,74 @@ class PromptCurrentList(BaseModel):
     total: int
 
 
+class PromptRelease(BaseModel):
+    """
+    Describes a release, a frozen snapshot of the current prompt catalogue.
+    """
+
+    id: int
+    content_hash: str
+    total: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class PromptReleaseList(BaseModel):
+    """
+    Describes the most recent releases, newest first.
+    """
+
+    releases: List[PromptRelease]
+
+
+class PromptVariant(BaseModel):
+    """
+    Describes a revision that is served as an A/B variant, with its traffic weight.
+    """
+
+    revision_id: int
+    weight: int = Field(..., ge=0)
+
+
+class PromptVariantsUpdate(BaseModel):
+    """
+    Describes the complete set of active variants of a prompt, an empty set serves the current
+    revision only.
+    """
+
+    variants: List[PromptVariant]
+
+
+class PromptVariantList(BaseModel):
+    """
+    Describes the active variants of a prompt.
+    """
+
+    variants: List[PromptVariant]
+    variants_version: int
+
+
+class PromptSimilarRow(BaseModel):
+    """
+    Describes a prompt that is similar to another prompt.
+    """
+
+    id: int
+    slug: str
+    description: str
+    score: float
+
+
+class PromptSimilarList(BaseModel):
+    """
+    Describes the prompts most similar to a prompt, most similar first.
+    """
+
+    prompts: List[PromptSimilarRow]
+
+
 class PromptCommandsList(BaseModel):
     """
     Describes a flat list of available command prefixes.
@@ -104,3 +213,48 @@ class PromptUpdate(BaseModel):
 
     ids: List[int]
     data: PromptCreate
+
+
+class PromptRenderRequest(BaseModel):
+    """
+    Describes the variables used to render a prompt template.
+    """
+
+    variables: Dict[str, str] = {}
+
+
+class PromptRenderBatchItem(BaseModel):
+    """
+    Describes a single prompt to render as part of a batch.
+    """
+
+    slug: str
+    variables: Dict[str, str] = {}
+
+
+class PromptRenderBatchRequest(BaseModel):
+    """
+    Describes a batch of prompts to render.
+    """
+
+    items: List[PromptRenderBatchItem] = Field(..., max_items=100)
+
+
+class PromptRendered(BaseModel):
+    """
+    Describes a rendered prompt, or the reason it could not be rendered.
+    """
+
+    slug: str
+    revision_id: int | None = None
+    text: str | None = None
+    error: str | None = None
+    missing: List[str] = []
+
+
+class PromptRenderedBatch(BaseModel):
+    """
+    Describes the results of a batch render, in the order of the request items.
+    """
+
+    results: List[PromptRendered]
@@ -0,0 +1,436 @@
+"""
+This module contains the similar prompt index.
+
+Every current prompt is represented by a hashed n-gram vector (word unigrams, word bigrams and
+character trigrams) that is L2-normalized and stored as a row of a float32 matrix. The rows are
+packed, with an array of the prompt id of every row in front of the matrix, so the size of the
+index and the cost of a query grow with the number of indexed prompts rather than with the
+highest prompt id. The row of a removed prompt is freed and reused by the next prompt added.
+
+Both live in a file that is memory-mapped by every worker, which means that all workers share a
+single copy through the page cache and see each other's updates. Updates take a lock file, and
+a file that has to grow is rewritten and renamed into place, so readers never see a partial
+index.
+
+Next to the index, a version file holds the table versions of the prompts that the index was
+last brought in line with. The index is rebuilt from the database in the background when a
+worker starts and finds no index, or one whose versions differ from the database's. A write
+only passes the ids of the prompts it changed, and their vectors are written from the prompts
+read under the lock, so that updates applied in any order leave the index at the latest text.
+Updates that arrive while this worker builds the index are queued and applied after the build.
+"""
+import asyncio
+import fcntl
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Set, Tuple
+
+import numpy as np
+from app.config import get_config
+from app.database.meta import open_session
+from app.modules.prompts import models
+from app.modules.prompts.adapters import AdapterPrompts
+from dpn_pyutils.common import get_logger
+from starlette.concurrency import run_in_threadpool
+
+log = get_logger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+GROWTH_ROWS = 1024
+"""
+The number of rows that the index file grows by when every row is taken
+"""
+
+FREE_ROW_ID = 0
+"""
+The prompt id of a row that holds no prompt, prompt ids start at 1
+"""
+
+
+def get_ngrams(text: str) -> Iterator[str]:
+    """
+    Yields the word unigrams, word bigrams and character trigrams of the supplied text
+    """
+
+    words = WORD_PATTERN.findall(text.lower())
+    for i, word in enumerate(words):
+        yield f"w:{word}"
+
+        if i > 0:
+            yield f"b:{words[i - 1]} {word}"
+
+        padded = f" {word} "
+        for j in range(len(padded) - 2):
+            yield f"c:{padded[j:j + 3]}"
+
+
+def vectorize(text: str, dimensions: int) -> np.ndarray:
+    """
+    Turns text into an L2-normalized hashed n-gram vector with sublinear term frequencies.
+
+    A stable hash (crc32) is used rather than hash() so that every worker process produces the
+    same vector, and the sign bit reduces the bias of hash collisions.
+    """
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for ngram, count in Counter(get_ngrams(text)).items():
+        hashed = zlib.crc32(ngram.encode("utf-8"))
+        sign = 1.0 if hashed & 0x80000000 else -1.0
+        vector[hashed % dimensions] += sign * (1.0 + math.log(count))
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+
+    return vector
+
+
+def get_prompt_document(description: str, prompt_text: str) -> str:
+    """
+    Gets the text that represents a prompt in the similarity index
+    """
+
+    return f"{prompt_text}\n{description}"
+
+
+class SimilarityIndex:
+    """
+    Memory-mapped matrix of prompt vectors, with the prompt id of every row.
+    """
+
+    path: Path
+    """
+    The path of the index file, the dimensions are part of the name so that a change of
+    dimensions never reads a file with a different layout
+    """
+
+    dimensions: int
+    """
+    The width of each prompt vector
+    """
+
+    _mapping: Tuple[np.memmap, np.memmap] | None = None
+    _mapped_stat: Tuple[int, int] | None = None
+
+    def __init__(self, path: Path, dimensions: int) -> None:
+        self.dimensions = dimensions
+        self.path = path.with_name(f"{path.name}.{dimensions}.idx")
+        self.lock_path = self.path.with_name(f"{self.path.name}.lock")
+        self.version_path = self.path.with_name(f"{self.path.name}.version")
+        self.row_bytes = dimensions * np.dtype(np.float32).itemsize
+        self._build_tasks: Set[asyncio.Task] = set()
+        self._pending_lock = threading.Lock()
+        self._pending_ids: Set[int] = set()
+        self._is_building = False
+
+    @property
+    def is_built(self) -> bool:
+        """
+        Whether the index file exists
+        """
+
+        return self.path.exists()
+
+    def read_versions(self) -> Tuple[int, ...] | None:
+        """
+        Reads the table versions that the index was last brought in line with, or None when
+        they are unknown
+        """
+
+        try:
+            return tuple(int(v) for v in self.version_path.read_text().split(","))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_versions(self, versions: Tuple[int, ...]) -> None:
+        """
+        Writes the table versions that the index is in line with. Must be called with the lock
+        held.
+        """
+
+        tmp_path = self.version_path.with_name(f"{self.version_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(",".join(str(v) for v in versions))
+        os.replace(tmp_path, self.version_path)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds an exclusive lock while the index is changed, so that the changes of workers never
+        interleave and none is made to a file that another worker has just replaced
+        """
+
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a+b") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _get_mapping(self) -> Tuple[np.memmap, np.memmap] | None:
+        """
+        Gets the mapped row ids and matrix, remapping them when another worker has replaced the
+        file
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._mapping = None
+            self._mapped_stat = None
+            return None
+
+        current_stat = (stat.st_ino, stat.st_size)
+        if self._mapping is None or self._mapped_stat != current_stat:
+            rows = stat.st_size // (np.dtype(np.int64).itemsize + self.row_bytes)
+            if rows == 0:
+                return None
+
+            self._mapping = self._map_file(self.path, rows)
+            self._mapped_stat = current_stat
+
+        return self._mapping
+
+    def _map_file(self, path: Path, rows: int) -> Tuple[np.memmap, np.memmap]:
+        """
+        Maps the row ids and the matrix of an index file with the given number of rows
+        """
+
+        row_ids = np.memmap(path, dtype=np.int64, mode="r+", shape=(rows,))
+        matrix = np.memmap(
+            path, dtype=np.float32, mode="r+", offset=row_ids.nbytes, shape=(rows, self.dimensions)
+        )
+
+        return row_ids, matrix
+
+    def _write_file(
+        self, min_rows: int, fill: Callable[[np.memmap, np.memmap], None]
+    ) -> None:
+        """
+        Writes a new index file with room for at least min_rows rows, rounded up to a multiple
+        of GROWTH_ROWS, lets fill write its rows, and renames it over the current file. Must be
+        called with the lock held.
+        """
+
+        rows = max(1, math.ceil(min_rows / GROWTH_ROWS)) * GROWTH_ROWS
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(tmp_path, "wb") as f:
+            f.truncate(rows * (np.dtype(np.int64).itemsize + self.row_bytes))
+
+        row_ids, matrix = self._map_file(tmp_path, rows)
+        fill(row_ids, matrix)
+        matrix.flush()
+        row_ids.flush()
+        del row_ids, matrix
+
+        os.replace(tmp_path, self.path)
+
+    def _upsert(self, prompt_id: int, description: str, prompt_text: str) -> None:
+        """
+        Writes the vector of a prompt, replacing any previous vector. Must be called with the
+        lock held.
+        """
+
+        mapping = self._get_mapping()
+        if mapping is None:
+            return
+
+        vector = vectorize(get_prompt_document(description, prompt_text), self.dimensions)
+        row_ids, matrix = mapping
+        rows = np.flatnonzero(row_ids == prompt_id)
+        if len(rows) == 0:
+            rows = np.flatnonzero(row_ids == FREE_ROW_ID)
+
+        if len(rows) == 0:
+            # Every row is taken, so the file is rewritten with room for more
+            def copy_rows(new_row_ids: np.memmap, new_matrix: np.memmap) -> None:
+                new_row_ids[: len(row_ids)] = row_ids
+                new_matrix[: len(matrix)] = matrix
+
+            self._write_file(len(row_ids) + 1, copy_rows)
+            row_ids, matrix = self._get_mapping()  # type: ignore
+            rows = np.flatnonzero(row_ids == FREE_ROW_ID)
+
+        # The vector is written before the id, so a reader never pairs the id with a stale vector
+        row = rows[0]
+        matrix[row] = vector
+        matrix.flush()
+        row_ids[row] = prompt_id
+        row_ids.flush()
+
+    def _remove(self, prompt_id: int) -> None:
+        """
+        Frees the row of a prompt so it is never returned as similar. Must be called with the
+        lock held.
+        """
+
+        mapping = self._get_mapping()
+        if mapping is None:
+            return
+
+        row_ids, matrix = mapping
+        for row in np.flatnonzero(row_ids == prompt_id):
+            row_ids[row] = FREE_ROW_ID
+            matrix[row] = 0.0
+
+        row_ids.flush()
+        matrix.flush()
+
+    def update(self, prompt_ids: Iterable[int]) -> None:
+        """
+        Brings the vectors of the supplied prompts in line with the database, after a write to
+        them has been committed. The prompts are read with the lock held, so an update never
+        overwrites a newer one. Queued while this worker builds the index, and left alone when
+        the index has not been built, as a build reads the prompts after taking the lock.
+        """
+
+        prompt_ids = set(prompt_ids)
+        with self._pending_lock:
+            if self._is_building:
+                self._pending_ids.update(prompt_ids)
+                return
+
+        with self._locked():
+            if not self.is_built:
+                return
+
+            with open_session() as session:
+                db_prompts = AdapterPrompts(session, models.PromptRecord)
+                versions = db_prompts.get_table_versions()
+                rows = {r.id: r for r in db_prompts.read_active(list(prompt_ids))}
+
+            for prompt_id in prompt_ids:
+                row = rows.get(prompt_id)
+                if row is None:
+                    self._remove(prompt_id)
+                else:
+                    self._upsert(prompt_id, row.revision.description, row.revision.prompt_text)
+
+            self._write_versions(versions)
+
+    def rebuild(self, versions: Tuple[int, ...], documents: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Rebuilds the whole index from (prompt_id, description, prompt_text) tuples read at the
+        supplied table versions, packing the rows of the prompts in a new file that is renamed
+        over the old one. Must be called with the lock held.
+        """
+
+        documents = list(documents)
+
+        def write_rows(row_ids: np.memmap, matrix: np.memmap) -> None:
+            for row, (prompt_id, description, prompt_text) in enumerate(documents):
+                matrix[row] = vectorize(
+                    get_prompt_document(description, prompt_text), self.dimensions
+                )
+                row_ids[row] = prompt_id
+
+        self._write_file(len(documents), write_rows)
+        self._write_versions(versions)
+
+        log.info("Rebuilt similarity index with %d prompts", len(documents))
+
+    def build(self) -> None:
+        """
+        Builds the index from the active prompts, unless it is in line with the database, for
+        example because another worker has just built it. Updates queued during the build are
+        applied once it is done.
+        """
+
+        with self._pending_lock:
+            self._is_building = True
+
+        try:
+            with self._locked():
+                with open_session() as session:
+                    db_prompts = AdapterPrompts(session, models.PromptRecord)
+                    versions = db_prompts.get_table_versions()
+                    if self.is_built and self.read_versions() == versions:
+                        return
+
+                    log.info("Building similarity index at table versions %s", versions)
+                    rows = db_prompts.read_active()
+
+                self.rebuild(
+                    versions,
+                    ((r.id, r.revision.description, r.revision.prompt_text) for r in rows),
+                )
+        finally:
+            with self._pending_lock:
+                self._is_building = False
+                pending_ids, self._pending_ids = self._pending_ids, set()
+
+            if len(pending_ids) > 0:
+                self.update(pending_ids)
+
+    def start_build(self) -> None:
+        """
+        Builds the index in the thread pool when it is missing or behind the database, so that
+        a worker starts serving requests straight away. Must be called from the event loop.
+        """
+
+        async def run_build() -> None:
+            try:
+                await run_in_threadpool(self.build)
+            except Exception:
+                log.exception("Could not build the similarity index")
+
+        # The loop only keeps weak references to tasks
+        task = asyncio.get_running_loop().create_task(run_build())
+        self._build_tasks.add(task)
+        task.add_done_callback(self._build_tasks.discard)
+
+    def similar(self, prompt_id: int, k: int) -> List[Tuple[int, float]]:
+        """
+        Gets up to k (prompt_id, score) pairs most similar to the supplied prompt, best first.
+
+        The scores of every row up to the last one in use are computed in one matrix-vector
+        product; free rows score zero and are never returned.
+        """
+
+        mapping = self._get_mapping()
+        if mapping is None or k <= 0:
+            return []
+
+        row_ids, matrix = mapping
+        used_rows = np.flatnonzero(row_ids != FREE_ROW_ID)
+        query_rows = np.flatnonzero(row_ids == prompt_id)
+        if len(query_rows) == 0:
+            return []
+
+        query = np.array(matrix[query_rows[0]])
+        if not query.any():
+            return []
+
+        scores = matrix[: used_rows[-1] + 1] @ query
+        scores[query_rows[0]] = 0.0
+
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            (int(row_ids[i]), float(scores[i]))
+            for i in top
+            if scores[i] > 0 and row_ids[i] != FREE_ROW_ID
+        ]
+
+
+@lru_cache()
+def get_similarity_index() -> SimilarityIndex:
+    """
+    Gets the similarity index for this process
+    """
+
+    config = get_config()
+
+    return SimilarityIndex(Path(config.SIMILARITY_INDEX_PATH), int(config.SIMILARITY_DIMENSIONS))
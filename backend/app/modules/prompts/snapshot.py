@@ -0,0 +1,322 @@
+"""
+This module contains the catalogue snapshot that lets a worker serve reads as soon as it starts.
+
+A snapshot holds the serialized current list and command list together with the table versions
+they were read at. It is kept in memory, where the current and command lists are served from it
+without touching the database, and in a local file. A new worker loads the file on startup and
+serves from it straight away. A background task then checks the snapshot against the table
+versions in the database and reloads it when they differ. After that, it checks again every
+CATALOGUE_SNAPSHOT_CHECK_SECONDS, or right away after a write in this worker. Like the current
+catalogue view, the lists trail writes in other workers by a bounded time.
+
+The file is one line of header and one line per serialized list, written atomically whenever
+the snapshot is reloaded from the database. Workers serve the lists from a read-only memory map
+of the file rather than from a copy of their own. When the tables change, the first worker to
+notice writes a new file, and the other workers map it instead of reading the database. All
+workers then share one copy of the catalogue through the page cache.
+
+Clients that negotiate a binary wire format get the lists encoded from the JSON once per
+snapshot, and then served from memory until the snapshot changes.
+"""
+import asyncio
+import json
+import mmap
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from app.config import get_config
+from app.database.meta import open_session
+from app.modules.prompts import models, schemas
+from app.modules.prompts.adapters import AdapterPrompts
+from app.modules.prompts.export import to_json_bytes
+from app.modules.prompts.rows import CurrentRow
+from app.utils.files import write_file_atomic
+from app.utils.wire import JSON_MEDIA_TYPE, encode
+from dpn_pyutils.common import get_logger
+from starlette.concurrency import run_in_threadpool
+
+log = get_logger(__name__)
+
+SNAPSHOT_FORMAT = 1
+"""
+Version of the file layout, a file with another version is ignored
+"""
+
+
+class CatalogueSnapshot(NamedTuple):
+    """
+    The serialized current and command lists, and the table versions they were read at.
+    """
+
+    versions: Tuple[int, ...]
+    current_body: bytes | memoryview
+    commands_body: bytes | memoryview
+
+    is_mapped: bool = False
+    """
+    Whether the lists are views of the memory-mapped snapshot file
+    """
+
+
+def build_snapshot(
+    versions: Tuple[int, ...], total: int, rows: List[CurrentRow]
+) -> CatalogueSnapshot:
+    """
+    Serializes the current catalogue the way the current and command list endpoints do
+    """
+
+    return CatalogueSnapshot(
+        versions=versions,
+        current_body=to_json_bytes(schemas.PromptCurrentList(total=total, prompts=rows)),
+        commands_body=to_json_bytes(schemas.PromptCommandsList(commands=[r.slug for r in rows])),
+    )
+
+
+def snapshot_to_bytes(snapshot: CatalogueSnapshot) -> bytes:
+    """
+    Serializes a snapshot for the snapshot file. JSON never contains a raw newline, so the
+    lists are separated by newlines.
+    """
+
+    header = json.dumps({"format": SNAPSHOT_FORMAT, "versions": list(snapshot.versions)})
+
+    return b"\n".join((header.encode("utf-8"), snapshot.current_body, snapshot.commands_body))
+
+
+def snapshot_from_buffer(data: bytes | mmap.mmap) -> CatalogueSnapshot | None:
+    """
+    Deserializes a snapshot file without copying the lists, or returns None when it is malformed
+    or has another layout
+    """
+
+    header_end = data.find(b"\n")
+    current_end = data.find(b"\n", header_end + 1)
+    if header_end < 0 or current_end < 0:
+        return None
+
+    try:
+        header_data = json.loads(data[:header_end])
+    except ValueError:
+        return None
+
+    if header_data.get("format") != SNAPSHOT_FORMAT:
+        return None
+
+    view = memoryview(data)
+
+    return CatalogueSnapshot(
+        versions=tuple(header_data["versions"]),
+        current_body=view[header_end + 1 : current_end],
+        commands_body=view[current_end + 1 :],
+        is_mapped=isinstance(data, mmap.mmap),
+    )
+
+
+def map_file(path: Path) -> mmap.mmap | None:
+    """
+    Maps a file read-only, or returns None when it does not exist or is empty. The mapping stays
+    valid after the file is replaced, until it is no longer referenced.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except FileNotFoundError:
+        return None
+
+
+def read_versions() -> Tuple[int, ...]:
+    """
+    Reads the current table versions of the catalogue
+    """
+
+    with open_session() as session:
+        return AdapterPrompts(session, models.PromptRecord).get_table_versions()
+
+
+def read_snapshot() -> CatalogueSnapshot:
+    """
+    Reads a new snapshot of the catalogue from the tables
+    """
+
+    with open_session() as session:
+        return build_snapshot(*AdapterPrompts(session, models.PromptRecord).read_catalogue())
+
+
+class SnapshotStore:
+    """
+    The catalogue snapshot of this process and the task that keeps it current.
+    """
+
+    path: Path
+    check_seconds: float
+
+    snapshot: CatalogueSnapshot | None = None
+    """
+    The snapshot that the current and command lists are served from, None until one is loaded
+    """
+
+    def __init__(self, path: Path, check_seconds: float) -> None:
+        self.path = path
+        self.check_seconds = check_seconds
+
+        self._task: asyncio.Task | None = None
+        self._changed: asyncio.Event | None = None
+        self._encoded: Dict[Tuple[str, str], bytes] = {}
+        self._encoded_versions: Tuple[int, ...] | None = None
+
+    def read_file(self) -> CatalogueSnapshot | None:
+        """
+        Maps the snapshot file, or returns None when there is no usable snapshot in it
+        """
+
+        data = map_file(self.path)
+        if data is None:
+            return None
+
+        snapshot = snapshot_from_buffer(data)
+        if snapshot is None:
+            log.warning("Ignoring catalogue snapshot '%s' with an unknown layout", self.path)
+
+        return snapshot
+
+    def get_body(self, snapshot: CatalogueSnapshot, section: str, media_type: str) -> bytes:
+        """
+        Gets the "current" or "commands" list of a snapshot in a media type. Lists in a binary
+        media type are encoded once per snapshot.
+        """
+
+        body = snapshot.current_body if section == "current" else snapshot.commands_body
+        if media_type == JSON_MEDIA_TYPE:
+            return bytes(body)
+
+        if self._encoded_versions != snapshot.versions:
+            self._encoded = {}
+            self._encoded_versions = snapshot.versions
+
+        key = (section, media_type)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = encode(media_type, json.loads(bytes(body)))
+            self._encoded[key] = encoded
+
+        return encoded
+
+    def write_file(self) -> None:
+        """
+        Writes the snapshot file, unless the snapshot is already mapped from it
+        """
+
+        if self.snapshot is not None and not self.snapshot.is_mapped:
+            write_file_atomic(self.path, snapshot_to_bytes(self.snapshot))
+
+    def reload(self, versions: Tuple[int, ...]) -> CatalogueSnapshot:
+        """
+        Gets a snapshot at the supplied table versions or newer, mapping the file when another
+        worker has already written it and otherwise reading the database and writing the file
+        """
+
+        snapshot = self.read_file()
+        if snapshot is not None and snapshot.versions == versions:
+            return snapshot
+
+        snapshot = read_snapshot()
+        try:
+            write_file_atomic(self.path, snapshot_to_bytes(snapshot))
+        except OSError:
+            log.exception("Could not write the catalogue snapshot '%s'", self.path)
+            return snapshot
+
+        # Another worker may have replaced the file in the meantime
+        mapped_snapshot = self.read_file()
+        if mapped_snapshot is not None and mapped_snapshot.versions == snapshot.versions:
+            return mapped_snapshot
+
+        return snapshot
+
+    async def check(self) -> None:
+        """
+        Reloads the snapshot when the tables have changed since it was read. The database is read
+        in the thread pool, so a first check that pays for connecting to the database does not
+        hold up requests.
+        """
+
+        versions = await run_in_threadpool(read_versions)
+        if self.snapshot is not None and self.snapshot.versions == versions:
+            return
+
+        self.snapshot = await run_in_threadpool(self.reload, versions)
+        log.debug("Reloaded the catalogue snapshot at versions %s", self.snapshot.versions)
+
+    def mark_changed(self) -> None:
+        """
+        Checks the snapshot right away, after a write in this process. Must be called from the
+        event loop.
+        """
+
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _run(self) -> None:
+        assert self._changed is not None
+
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                log.exception("Could not check the catalogue snapshot")
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.check_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+            self._changed.clear()
+
+    async def start(self) -> None:
+        """
+        Loads the snapshot file and starts checking the snapshot in the background
+        """
+
+        self.snapshot = self.read_file()
+        if self.snapshot is not None:
+            log.info("Serving the catalogue from snapshot '%s' until it is checked", self.path)
+
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops checking the snapshot and writes it to the snapshot file, if it was not read from
+        there
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+        self.write_file()
+
+
+@lru_cache()
+def get_snapshot_store() -> SnapshotStore:
+    """
+    Gets the catalogue snapshot store for this process
+    """
+
+    config = get_config()
+
+    return SnapshotStore(
+        Path(config.CATALOGUE_SNAPSHOT_PATH), float(config.CATALOGUE_SNAPSHOT_CHECK_SECONDS)
+    )
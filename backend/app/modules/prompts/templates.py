@@ -0,0 +1,219 @@
+r"""
+This module contains the prompt templating.
+
+Prompt text may contain placeholders that bots fill in when the prompt is rendered:
+
+    {{name}}             replaced by the "name" variable, which must be supplied
+    {{name|fallback}}    replaced by the "name" variable, or "fallback" when it is not supplied
+    \{{                  a literal "{{"
+
+Templates are parsed and validated once, when a revision is written, and stored alongside the
+revision body as a compact list of placeholder spans. Rendering turns the spans into a compiled
+template of literal parts and fields, which is kept in an LRU keyed by revision, so rendering
+never parses text again.
+"""
+import json
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+
+from app.config import get_config
+from app.core.errors import AppException
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+PLACEHOLDER_START = "{{"
+ESCAPED_PLACEHOLDER_START = "\\{{"
+
+PLACEHOLDER_PATTERN = re.compile(
+    r"\{\{\s*(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*(?:\|(?P<default>[^{}]*))?\}\}"
+)
+
+
+class TemplateSyntaxError(AppException):
+    """
+    Raised when prompt text contains a malformed placeholder
+    """
+
+
+class TemplateRenderError(AppException):
+    """
+    Raised when a template is rendered without a required variable
+    """
+
+    missing: List[str]
+
+    def __init__(self, missing: List[str]) -> None:
+        super().__init__(f"Missing template variables: {', '.join(missing)}")
+        self.missing = missing
+
+
+class PlaceholderSpan(NamedTuple):
+    """
+    The position of a placeholder in the prompt text. Escapes have no name and render as "{{".
+    """
+
+    start: int
+    end: int
+    name: str | None
+    default: str | None
+
+
+def parse_placeholders(text: str) -> List[PlaceholderSpan]:
+    """
+    Parses and validates the placeholders in the text
+    """
+
+    spans: List[PlaceholderSpan] = []
+    position = text.find(PLACEHOLDER_START)
+    while position >= 0:
+        if position > 0 and text[position - 1] == "\\":
+            spans.append(PlaceholderSpan(position - 1, position + 2, None, None))
+            position = text.find(PLACEHOLDER_START, position + 2)
+            continue
+
+        match = PLACEHOLDER_PATTERN.match(text, position)
+        if match is None:
+            raise TemplateSyntaxError(
+                f"Malformed placeholder at character {position}, placeholders look like "
+                "{{name}} or {{name|default}} and a literal '{{' is written as '\\{{'"
+            )
+
+        spans.append(
+            PlaceholderSpan(match.start(), match.end(), match.group("name"), match.group("default"))
+        )
+        position = text.find(PLACEHOLDER_START, match.end())
+
+    return spans
+
+
+def spans_to_json(spans: List[PlaceholderSpan]) -> str:
+    """
+    Serializes placeholder spans for storage
+    """
+
+    return json.dumps([list(s) for s in spans], separators=(",", ":"))
+
+
+def spans_from_json(data: str) -> List[PlaceholderSpan]:
+    """
+    Deserializes stored placeholder spans
+    """
+
+    return [PlaceholderSpan(*s) for s in json.loads(data)]
+
+
+class CompiledTemplate:
+    """
+    A template split into literal parts and (name, default) fields, there is always one more
+    literal part than there are fields.
+    """
+
+    __slots__ = ("literals", "fields", "variables")
+
+    literals: Tuple[str, ...]
+    fields: Tuple[Tuple[str, str | None], ...]
+    variables: Tuple[str, ...]
+
+    def __init__(self, text: str, spans: List[PlaceholderSpan]) -> None:
+        literals: List[str] = []
+        fields: List[Tuple[str, str | None]] = []
+        pending = ""
+        position = 0
+        for span in spans:
+            pending += text[position : span.start]
+            if span.name is None:
+                pending += PLACEHOLDER_START
+            else:
+                literals.append(pending)
+                fields.append((span.name, span.default))
+                pending = ""
+            position = span.end
+
+        literals.append(pending + text[position:])
+
+        self.literals = tuple(literals)
+        self.fields = tuple(fields)
+        self.variables = tuple(dict.fromkeys(name for name, _ in fields))
+
+    def render(self, variables: Dict[str, str]) -> str:
+        """
+        Renders the template with the supplied variables
+        """
+
+        missing = [
+            name for name, default in self.fields if default is None and name not in variables
+        ]
+        if len(missing) > 0:
+            raise TemplateRenderError(list(dict.fromkeys(missing)))
+
+        parts = [self.literals[0]]
+        for (name, default), literal in zip(self.fields, self.literals[1:], strict=True):
+            parts.append(str(variables.get(name, default)))
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+TemplateKey = Tuple[int, str]
+"""
+A revision id and the content hash of its flattened body
+"""
+
+
+class TemplateCache:
+    """
+    Bounded LRU of compiled templates keyed by revision, plus a short-lived map of slugs to
+    their current revision so hot prompts are rendered without touching the database.
+    """
+
+    def __init__(self, max_size: int, slug_ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.slug_ttl_seconds = slug_ttl_seconds
+        self._templates: OrderedDict[TemplateKey, CompiledTemplate] = OrderedDict()
+        self._slugs: Dict[str, Tuple[TemplateKey, float]] = {}
+
+    def get_key(self, slug: str) -> TemplateKey | None:
+        entry = self._slugs.get(slug)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+
+        return entry[0]
+
+    def get(self, key: TemplateKey) -> CompiledTemplate | None:
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+
+        return template
+
+    def put(self, slug: str, key: TemplateKey, template: CompiledTemplate) -> None:
+        self._slugs[slug] = (key, time.monotonic() + self.slug_ttl_seconds)
+        self._templates[key] = template
+        self._templates.move_to_end(key)
+        while len(self._templates) > self.max_size:
+            self._templates.popitem(last=False)
+
+    def invalidate_slug(self, slug: str) -> None:
+        """
+        Forgets the current revision of a slug after it was updated or deleted in this process
+        """
+
+        self._slugs.pop(slug, None)
+
+
+@lru_cache()
+def get_template_cache() -> TemplateCache:
+    """
+    Gets the compiled template cache for this process
+    """
+
+    config = get_config()
+
+    return TemplateCache(
+        max_size=int(config.TEMPLATE_CACHE_SIZE),
+        slug_ttl_seconds=float(config.TEMPLATE_SLUG_TTL_SECONDS),
+    )
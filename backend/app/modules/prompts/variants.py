@@ -0,0 +1,115 @@
+"""
+This module contains the weighted selection of A/B prompt variants.
+
+A prompt may have several active variants, each a revision with a traffic weight. A variant is
+picked per request with Vose's alias method: the alias table is built once per set of weights
+(O(n)) and each pick is O(1). The table is cached per prompt and weights version, so it is only
+rebuilt when the weights change. A client key makes the pick sticky by deriving the uniform
+random number from a hash of the key instead of from the random number generator.
+"""
+import hashlib
+import random
+from collections import OrderedDict
+from typing import List, Tuple
+
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+VARIANT_CACHE_SIZE = 1024
+"""
+The number of prompts whose alias tables are kept in memory
+"""
+
+
+class AliasTable:
+    """
+    Alias table for O(1) weighted picks between revisions.
+    """
+
+    __slots__ = ("revision_ids", "probabilities", "aliases")
+
+    def __init__(self, weights: List[Tuple[int, int]]) -> None:
+        """
+        Builds the table from (revision_id, weight) pairs, weights must be positive
+        """
+
+        count = len(weights)
+        total = sum(w for _, w in weights)
+        scaled = [w * count / total for _, w in weights]
+
+        self.revision_ids = [r for r, _ in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+
+        # Whatever is left is 1.0 up to rounding error
+        for i in small + large:
+            self.probabilities[i] = 1.0
+
+    def pick(self, uniform: float) -> int:
+        """
+        Picks a revision id from a uniform number in [0, 1)
+        """
+
+        scaled = uniform * len(self.revision_ids)
+        column = int(scaled)
+        if scaled - column < self.probabilities[column]:
+            return self.revision_ids[column]
+
+        return self.revision_ids[self.aliases[column]]
+
+
+def get_uniform(prompt_id: int, client_key: str | None) -> float:
+    """
+    Gets a uniform number in [0, 1), derived from the client key when there is one so that the
+    same client keeps getting the same variant
+    """
+
+    if client_key is None:
+        return random.random()
+
+    digest = hashlib.blake2b(f"{prompt_id}:{client_key}".encode("utf-8"), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little") / 2**64
+
+
+class VariantCache:
+    """
+    Bounded LRU of alias tables keyed by (prompt_id, variants_version).
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._tables: OrderedDict[Tuple[int, int], AliasTable | None] = OrderedDict()
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._tables
+
+    def get(self, key: Tuple[int, int]) -> AliasTable | None:
+        table = self._tables.get(key)
+        if key in self._tables:
+            self._tables.move_to_end(key)
+
+        return table
+
+    def put(self, key: Tuple[int, int], table: AliasTable | None) -> None:
+        """
+        Stores the table of a prompt, None records that the prompt has no active variants
+        """
+
+        self._tables[key] = table
+        self._tables.move_to_end(key)
+        while len(self._tables) > self.max_size:
+            self._tables.popitem(last=False)
+
+
+variant_cache = VariantCache(VARIANT_CACHE_SIZE)
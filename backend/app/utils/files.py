@@ -0,0 +1,47 @@
+"""
+This module is for stateless methods that help with reading and writing files
+"""
+import os
+import tempfile
+from pathlib import Path
+
+from dpn_pyutils.common import get_logger
+
+log = get_logger(__name__)
+
+
+def write_file_atomic(path: Path, data: bytes, mode: int = 0o644) -> None:
+    """
+    Writes a file by writing a temporary file in the same directory and renaming it over the path,
+    so that readers see either the old or the new content and never a partial file
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+
+        raise
+
+
+def read_file_bytes_or_none(path: Path) -> bytes | None:
+    """
+    Reads the content of a file, or None when it does not exist
+    """
+
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,151 @@
+"""
+This module is for the binary wire formats that clients can ask for instead of JSON.
+
+The format is negotiated from the Accept header. MessagePack is always available and CBOR is
+offered when the cbor2 package is installed. The payloads have the same structure as the JSON
+responses, with the field names of the same response schemas, and times as ISO 8601 strings.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple, Type
+
+import msgpack
+from dpn_pyutils.common import get_logger
+from pydantic import BaseModel
+from starlette.responses import Response
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+log = get_logger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+CBOR_MEDIA_TYPE = "application/cbor"
+
+MEDIA_TYPE_ALIASES = {"application/x-msgpack": MSGPACK_MEDIA_TYPE}
+"""
+Media types that some clients send for a supported media type
+"""
+
+
+def get_available_media_types() -> Tuple[str, ...]:
+    """
+    Gets the media types that can be negotiated, JSON first so that it wins every tie
+    """
+
+    if cbor2 is None:
+        return (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)
+
+    return (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, CBOR_MEDIA_TYPE)
+
+
+@lru_cache(maxsize=256)
+def negotiate_media_type(accept: str | None) -> str:
+    """
+    Picks the media type with the highest quality in the Accept header. Wildcards only select
+    JSON, so a binary format is only sent to clients that ask for it by name. Clients send a
+    handful of distinct headers, so the result is cached by header.
+    """
+
+    if accept is None:
+        return JSON_MEDIA_TYPE
+
+    accepted: Dict[str, float] = {}
+    for part in accept.split(","):
+        media_range, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        media_range = media_range.strip().lower()
+        accepted[MEDIA_TYPE_ALIASES.get(media_range, media_range)] = quality
+
+    best_media_type, best_quality = JSON_MEDIA_TYPE, 0.0
+    for media_type in get_available_media_types():
+        quality = accepted.get(media_type, 0.0)
+        if media_type == JSON_MEDIA_TYPE:
+            quality = max(quality, accepted.get("application/*", 0.0), accepted.get("*/*", 0.0))
+
+        if quality > best_quality:
+            best_media_type, best_quality = media_type, quality
+
+    return best_media_type
+
+
+def encode_default(value: Any) -> Any:
+    """
+    Encodes the values that the binary formats have no type for, the way the JSON responses do
+    """
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError(f"Cannot encode a value of type {type(value).__name__}")
+
+
+def encode(media_type: str, data: Any) -> bytes:
+    """
+    Encodes plain data, made of dicts, lists and scalars, in a binary media type
+    """
+
+    if media_type == CBOR_MEDIA_TYPE:
+        return cbor2.dumps(
+            data, default=lambda encoder, value: encoder.encode(encode_default(value))
+        )
+
+    return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+def rows_to_plain(model: Type[BaseModel], rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Turns rows into plain dicts with the fields of a flat response schema, without validating
+    them into models first
+    """
+
+    fields = tuple(model.__fields__)
+
+    return [{field: getattr(row, field) for field in fields} for row in rows]
+
+
+ENTITY_TAG_PATTERN = re.compile(r'(?:W/)?"[^"]*"')
+"""
+An entity tag in an If-None-Match header, weak or strong
+"""
+
+
+def matches_if_none_match(header: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an entity tag. The listed entity tags are compared
+    exactly with the weak comparison that If-None-Match uses, and "*" matches any entity tag.
+    """
+
+    if header.strip() == "*":
+        return True
+
+    opaque_tag = etag.removeprefix("W/")
+
+    return any(
+        tag.removeprefix("W/") == opaque_tag for tag in ENTITY_TAG_PATTERN.findall(header)
+    )
+
+
+class WireResponse(Response):
+    """
+    A response with plain data encoded in a binary media type.
+    """
+
+    def __init__(self, content: Any, media_type: str, **kwargs: Any) -> None:
+        super().__init__(content, media_type=media_type, **kwargs)
+        self.headers["Vary"] = "Accept"
+
+    def render(self, content: Any) -> bytes:
+        return encode(self.media_type, content)  # type: ignore
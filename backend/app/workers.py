@@ -0,0 +1,13 @@
+"""
+The uvicorn worker for serving the app with gunicorn, see gunicorn.conf.py
+"""
+from uvicorn.workers import UvicornWorker
+
+
+class BotpromptsWorker(UvicornWorker):
+    """
+    Uvicorn worker with the same settings as the single process server in launch.sh, the app
+    sets its own server header
+    """
+
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "proxy_headers": True, "server_header": False}
@@ -0,0 +1,167 @@
+"""
+Measures the per-request overhead of the response header middleware.
+
+Calls a Starlette app that returns a small plain text response directly through ASGI, without a
+server or a database. The app is measured without middleware, with the two
+@app.middleware("http") layers that used to set the server and X-Process-Time headers, and with
+ResponseHeadersMiddleware. Each run reports the median time per request and the overhead over
+the bare app. Run from the backend directory:
+
+    python -m benchmarks.middleware --requests 20000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+from app.core.middleware import ResponseHeadersMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Receive, Send
+
+API_PREFIX = "/api/v1"
+EXCLUDE_PATHS = ["/auth", "/admin"]
+SERVER_NAME = "botprompts/benchmark"
+
+
+async def endpoint(request) -> PlainTextResponse:
+    return PlainTextResponse("ok")
+
+
+def build_bare() -> ASGIApp:
+    return Starlette(routes=[Route(f"{API_PREFIX}/prompts", endpoint)])
+
+
+def build_http_middleware() -> ASGIApp:
+    """
+    The app with the middleware as it was written before, with @app.middleware("http")
+    """
+
+    async def add_process_time_header(request, call_next):
+        do_add_header: bool = True
+        for exclude_path in EXCLUDE_PATHS:
+            if request.url.path.startswith(f"{API_PREFIX}{exclude_path}"):
+                do_add_header = False
+
+        start_time = time.time()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+
+        if do_add_header:
+            response.headers["X-Process-Time"] = str(f"{process_time:0.4f} sec")
+
+        return response
+
+    async def replace_server_name(request, call_next):
+        response = await call_next(request)
+        response.headers["server"] = SERVER_NAME
+        return response
+
+    return Starlette(
+        routes=[Route(f"{API_PREFIX}/prompts", endpoint)],
+        middleware=[
+            Middleware(BaseHTTPMiddleware, dispatch=replace_server_name),
+            Middleware(BaseHTTPMiddleware, dispatch=add_process_time_header),
+        ],
+    )
+
+
+def build_asgi_middleware() -> ASGIApp:
+    return Starlette(
+        routes=[Route(f"{API_PREFIX}/prompts", endpoint)],
+        middleware=[
+            Middleware(
+                ResponseHeadersMiddleware,
+                server_name=SERVER_NAME,
+                exclude_process_time_prefixes=[f"{API_PREFIX}{p}" for p in EXCLUDE_PATHS],
+            )
+        ],
+    )
+
+
+def build_channel() -> Tuple[Receive, Send]:
+    """
+    Gets the receive and send callables of one request. Like uvicorn, the request body is
+    received once and later receives wait until the response is complete, and then report a
+    disconnect
+    """
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    response_complete = asyncio.Event()
+
+    async def receive() -> Message:
+        if len(messages) > 0:
+            return messages.pop()
+
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            response_complete.set()
+
+    return receive, send
+
+
+async def measure(app: ASGIApp, requests: int) -> float:
+    """
+    Gets the median time of a request to the app in microseconds
+    """
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": f"{API_PREFIX}/prompts",
+        "raw_path": f"{API_PREFIX}/prompts".encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    timings: List[float] = []
+    for _ in range(requests):
+        receive, send = build_channel()
+
+        start = time.perf_counter()
+        await app(dict(scope), receive, send)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1_000_000
+
+
+async def run(requests: int) -> None:
+    builders: List[tuple[str, Callable[[], ASGIApp]]] = [
+        ("bare app", build_bare),
+        ('@app.middleware("http")', build_http_middleware),
+        ("ResponseHeadersMiddleware", build_asgi_middleware),
+    ]
+
+    baseline = None
+    print(f"{'middleware':<28} {'us/request':>11} {'overhead us':>12}")
+    for name, build in builders:
+        app = build()
+        await measure(app, min(requests, 1000))
+        median = await measure(app, requests)
+        baseline = baseline if baseline is not None else median
+        print(f"{name:<28} {median:>11.1f} {median - baseline:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main()
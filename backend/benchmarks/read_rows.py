@@ -0,0 +1,177 @@
+"""
+Measures the prompt read endpoints' queries with ORM entities against the read-only row layer.
+
+Seeds a catalogue into the configured database inside a transaction that is rolled back at the
+end, so nothing is left behind, then reports the median latency and the peak memory allocated
+per request for each query, including the conversion to response models. Run from the backend
+directory:
+
+    python -m benchmarks.read_rows --prompts 10000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from typing import Awaitable, Callable, List, Tuple
+
+from app.config import get_config
+from app.database.meta import open_session
+from app.modules.prompts import models, schemas
+from app.modules.prompts.adapters import AdapterPromptRevision, AdapterPrompts
+from app.modules.prompts.content import RevisionBody, encode_blob
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+HISTORY_REVISIONS = 100
+"""
+Extra revisions given to the first prompt so that the history queries have a page to read
+"""
+
+
+def seed(session: Session, prompt_count: int) -> Tuple[int, str]:
+    """
+    Inserts the catalogue without committing, returning the id and slug of the first prompt
+    """
+
+    bodies = [
+        RevisionBody(f"Benchmark prompt {i}", f"Benchmark prompt text {i} " * 20)
+        for i in range(prompt_count + HISTORY_REVISIONS)
+    ]
+    blobs = [encode_blob(b) for b in bodies]
+    session.execute(
+        insert(models.PromptBlobRecord),
+        [
+            {
+                "content_hash": b.content_hash,
+                "base_hash": None,
+                "delta_depth": 0,
+                "payload": b.payload,
+            }
+            for b in blobs
+        ],
+    )
+
+    prompt_ids = list(
+        session.scalars(
+            insert(models.PromptRecord).returning(models.PromptRecord.id),
+            [{"slug": f"bench-{i}", "is_active": True} for i in range(prompt_count)],
+        )
+    )
+
+    revisions = [
+        {
+            "prompt_id": prompt_id,
+            "is_current": True,
+            "is_active": True,
+            "content_hash": blobs[i].content_hash,
+            "flattened_hash": blobs[i].content_hash,
+        }
+        for i, prompt_id in enumerate(prompt_ids)
+    ]
+    revisions += [
+        {
+            "prompt_id": prompt_ids[0],
+            "is_current": False,
+            "is_active": True,
+            "content_hash": blobs[prompt_count + i].content_hash,
+            "flattened_hash": blobs[prompt_count + i].content_hash,
+        }
+        for i in range(HISTORY_REVISIONS)
+    ]
+    session.execute(insert(models.PromptRevisionRecord), revisions)
+    session.flush()
+
+    return prompt_ids[0], "bench-0"
+
+
+async def measure(
+    session: Session, request: Callable[[], Awaitable[object]], repeat: int
+) -> Tuple[float, float]:
+    """
+    Gets the median latency in milliseconds and the median peak allocation in KiB of a request.
+    The identity map is emptied before each run so that ORM entities are never reused.
+    """
+
+    session.expunge_all()
+    await request()
+
+    latencies: List[float] = []
+    for _ in range(repeat):
+        session.expunge_all()
+        start = time.perf_counter()
+        await request()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    peaks: List[float] = []
+    for _ in range(repeat):
+        session.expunge_all()
+        tracemalloc.start()
+        await request()
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+
+    return statistics.median(latencies), statistics.median(peaks)
+
+
+async def main(prompt_count: int, repeat: int) -> None:
+    get_config()
+
+    with open_session() as session:
+        prompt_id, slug = seed(session, prompt_count)
+        db_prompts = AdapterPrompts(session, models.PromptRecord)
+        db_revisions = AdapterPromptRevision(session, models.PromptRevisionRecord)
+
+        async def list_orm():
+            records = await db_prompts.get_many({}, "id", "ASC", 0, -1)
+            return [schemas.Prompt.from_orm(r) for r in records]
+
+        async def list_rows():
+            records = await db_prompts.read_many({}, "id", "ASC", 0, -1)
+            return [schemas.Prompt.from_orm(r) for r in records]
+
+        async def current_rows():
+            records = await db_prompts.get_current_list()
+            return schemas.PromptCurrentList(total=len(records), prompts=records)
+
+        async def detail_orm():
+            return schemas.Prompt.from_orm(await db_prompts.get_by_slug(slug))
+
+        async def detail_rows():
+            return schemas.Prompt.from_orm(await db_prompts.read_by_slug(slug))
+
+        async def history_orm():
+            records = await db_revisions.get_by_prompt_id(prompt_id, limit=HISTORY_REVISIONS)
+            return [schemas.PromptRevision.from_orm(r) for r in records]
+
+        async def history_rows():
+            records = await db_revisions.read_by_prompt_id(prompt_id, limit=HISTORY_REVISIONS)
+            return [schemas.PromptRevision.from_orm(r) for r in records]
+
+        scenarios = [
+            ("get_many (ORM)", list_orm),
+            ("read_many (rows)", list_rows),
+            ("get_current_list (rows)", current_rows),
+            ("get_by_slug (ORM)", detail_orm),
+            ("read_by_slug (rows)", detail_rows),
+            ("get_by_prompt_id (ORM)", history_orm),
+            ("read_by_prompt_id (rows)", history_rows),
+        ]
+
+        print(f"{prompt_count} prompts, median of {repeat} runs")
+        print(f"{'query':<28} {'latency ms':>12} {'peak KiB':>12}")
+        try:
+            for name, request in scenarios:
+                latency, peak = await measure(session, request, repeat)
+                print(f"{name:<28} {latency:>12.2f} {peak:>12.1f}")
+        finally:
+            session.rollback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--prompts", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.prompts, args.repeat))
@@ -0,0 +1,170 @@
+"""
+Measures how the throughput of a read endpoint scales with the number of pre-forked workers.
+
+For each worker count, starts the API with gunicorn.conf.py on a local port, waits until it
+answers, and then drives it with concurrent keep-alive clients for a fixed time. It reports
+requests per second, median and 99th percentile latency, and the speedup over the first worker
+count. The clients run in their own processes so that the load generator is not the bottleneck.
+On a machine with N cores, give the server the cores it is measured on and the clients the rest,
+for example:
+
+    taskset -c 0-3 python -m benchmarks.scaling --workers 1 2 4 --client-cpus 4-7
+
+Run from the backend directory, against a database that holds a representative catalogue.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+import httpx
+
+DEFAULT_PATH = "/api/v1/prompts/current"
+
+
+def run_client(url: str, connections: int, seconds: float, results: multiprocessing.Queue) -> None:
+    """
+    Sends requests over the supplied number of connections until the time is up, putting the
+    number of errors and the latency of every successful request on the results queue
+    """
+
+    async def run() -> Tuple[int, List[float]]:
+        latencies: List[float] = []
+        errors = 0
+        deadline = time.perf_counter() + seconds
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+
+            async def loop() -> None:
+                nonlocal errors
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                        response.raise_for_status()
+                    except httpx.HTTPError:
+                        errors += 1
+                        continue
+
+                    latencies.append(time.perf_counter() - start)
+
+            await asyncio.gather(*(loop() for _ in range(connections)))
+
+        return errors, latencies
+
+    results.put(asyncio.run(run()))
+
+
+def wait_until_ready(url: str, timeout_seconds: float) -> None:
+    """
+    Polls the url until the server answers it
+    """
+
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+
+        time.sleep(0.2)
+
+    raise TimeoutError(f"Server did not answer {url} within {timeout_seconds} seconds")
+
+
+def measure(workers: int, args: argparse.Namespace) -> Tuple[float, float, float, int]:
+    """
+    Starts the server with the supplied number of workers and measures it, returning requests
+    per second, the median and 99th percentile latency in milliseconds, and the error count
+    """
+
+    bind = f"127.0.0.1:{args.port}"
+    url = f"http://{bind}{args.path}"
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "BIND": bind}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"], env=env
+    )
+
+    try:
+        wait_until_ready(url, args.startup_seconds)
+
+        # Warm every worker up before measuring
+        run_client(url, workers * 2, 1.0, multiprocessing.Queue())
+
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=run_client,
+                args=(url, args.connections // args.clients, args.seconds, results),
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+            if args.client_cpus:
+                os.sched_setaffinity(client.pid, parse_cpus(args.client_cpus))
+
+        outcomes = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+
+    finally:
+        server.terminate()
+        server.wait()
+
+    errors = sum(e for e, _ in outcomes)
+    latencies = sorted(latency for _, ls in outcomes for latency in ls)
+    if len(latencies) == 0:
+        return 0.0, 0.0, 0.0, errors
+
+    return (
+        len(latencies) / args.seconds,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        errors,
+    )
+
+
+def parse_cpus(cpus: str) -> List[int]:
+    """
+    Parses a taskset style list of cpus, such as "4-7" or "4,6"
+    """
+
+    parsed: List[int] = []
+    for part in cpus.split(","):
+        first, _, last = part.partition("-")
+        parsed.extend(range(int(first), int(last or first) + 1))
+
+    return parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--connections", type=int, default=128)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--client-cpus", default=None)
+    parser.add_argument("--startup-seconds", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        rps, p50, p99, errors = measure(workers, args)
+        baseline = baseline or rps
+        speedup = rps / baseline if baseline else 0.0
+        print(f"{workers:>8} {rps:>10.0f} {p50:>8.2f} {p99:>8.2f} {errors:>7} {speedup:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for serving the API with pre-forked uvicorn workers.
+
+The app is imported once in the master process and the workers are forked from it, so they
+start without importing it again and share the memory of the imported modules until they write
+to it. Each worker runs its own event loop, database engine and caches; the current catalogue is
+shared between them through the memory-mapped catalogue snapshot file.
+
+Run from the backend directory:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The number of workers is taken from WEB_CONCURRENCY and defaults to one per core. Each worker
+opens its own database connection pool, so DB_POOL_SIZE + DB_MAX_OVERFLOW times the number of
+workers must stay within the connection limit of the database.
+
+Every worker gets the lowest index that no live worker has in WORKER_INDEX, which labels its
+metrics. A worker that replaces one that exited takes over its index, so the metric series stay
+the same across worker restarts. During a graceful reload the new workers overlap the old ones
+and take the next indexes.
+"""
+import itertools
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "app.workers.BotpromptsWorker"
+preload_app = True
+
+# Requests arrive through nginx, which keeps its upstream connections open
+keepalive = 5
+graceful_timeout = 30
+timeout = 60
+
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def pre_fork(server, worker):
+    taken = {getattr(w, "worker_index", None) for w in server.WORKERS.values()}
+    worker.worker_index = next(i for i in itertools.count() if i not in taken)
+
+
+def post_fork(server, worker):
+    os.environ["WORKER_INDEX"] = str(worker.worker_index)
@@ -0,0 +1,84 @@
+"""
+Fixtures shared by the tests that run against the app and its database.
+
+The app is created from the app config, with the database migrated to head, for example the
+Postgres of docker-compose.dev.yml. Tests that use these fixtures are skipped when the app is
+not configured or its database cannot be reached. Prompts are created with random slugs and are
+deleted again when a test ends.
+"""
+import uuid
+from typing import Any, Callable, Dict, Iterator, List
+
+import pytest
+
+PromptFactory = Callable[..., Dict[str, Any]]
+
+
+@pytest.fixture(scope="session")
+def client() -> Iterator[Any]:
+    try:
+        from app.config import get_config
+
+        config = get_config()
+    except RuntimeError as e:
+        pytest.skip(f"The app is not configured: {e}")
+
+    from app.database.meta import DatabaseManager
+    from sqlalchemy.exc import OperationalError
+
+    try:
+        DatabaseManager(config)
+    except OperationalError as e:
+        pytest.skip(f"The database is not available: {e}")
+
+    from app.app import create_webapp
+    from attrs import evolve
+    from fastapi.testclient import TestClient
+
+    # Every request comes from the same client, which must not be rate limited. Not entered as
+    # a context manager, so the startup tasks of the workers do not run
+    yield TestClient(create_webapp(evolve(config, ADMISSION_ENABLE=False)))
+
+
+@pytest.fixture(scope="session")
+def prompts_url() -> str:
+    from app.config import get_config
+
+    return f"{get_config().API_URL_PREFIX_V1}/prompts"
+
+
+def random_slug() -> str:
+    """
+    Gets a slug that is short enough for any SLUG_MAX_LENGTH and unique to the test run
+    """
+
+    return f"t{uuid.uuid4().hex[:10]}"
+
+
+@pytest.fixture
+def create_prompt(client: Any, prompts_url: str) -> Iterator[PromptFactory]:
+    """
+    Creates prompts through the API, deleting them in reverse order when the test ends
+    """
+
+    created_slugs: List[str] = []
+
+    def create(prompt_text: str, slug: str | None = None, description: str = "") -> Dict:
+        slug = slug or random_slug()
+        response = client.post(
+            prompts_url,
+            json={
+                "slug": slug,
+                "description": description or f"Test prompt {slug}",
+                "prompt_text": prompt_text,
+            },
+        )
+        assert response.status_code == 200, response.text
+        created_slugs.append(slug)
+
+        return response.json()
+
+    yield create
+
+    for slug in reversed(created_slugs):
+        client.delete(f"{prompts_url}/{slug}")
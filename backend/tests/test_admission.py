@@ -0,0 +1,123 @@
+"""
+Tests that clients past their token bucket get a 429, and that requests past the concurrency
+limit of a route wait in a bounded queue and are shed with a 503 when it is full or they time
+out.
+"""
+import asyncio
+from typing import List
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.core.admission import (  # noqa: E402
+    AdmissionController,
+    AdmissionMiddleware,
+    ConcurrencyLimit,
+    TokenBuckets,
+)
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import PlainTextResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+
+def test_token_bucket_refills_at_the_rate() -> None:
+    buckets = TokenBuckets(rate=1.0, burst=2, max_clients=10)
+
+    assert buckets.take("a", 0.0) == 0.0
+    assert buckets.take("a", 0.0) == 0.0
+    assert buckets.take("a", 0.0) == pytest.approx(1.0)
+    assert buckets.take("a", 0.5) == pytest.approx(0.5)
+    assert buckets.take("a", 1.0) == 0.0
+    assert buckets.take("b", 1.0) == 0.0
+
+
+def test_least_recent_clients_are_forgotten() -> None:
+    buckets = TokenBuckets(rate=1.0, burst=1, max_clients=1)
+
+    assert buckets.take("a", 0.0) == 0.0
+    assert buckets.take("b", 0.0) == 0.0
+    assert len(buckets) == 1
+    assert buckets.take("a", 0.0) == 0.0
+
+
+def test_requests_queue_in_arrival_order() -> None:
+    async def run() -> None:
+        limit = ConcurrencyLimit(limit=1, max_queue=2)
+        order: List[str] = []
+
+        async def request(name: str) -> None:
+            if await limit.acquire(1.0):
+                order.append(name)
+                await asyncio.sleep(0.01)
+                limit.release()
+
+        assert await limit.acquire(1.0)
+        tasks = [asyncio.create_task(request(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        assert limit.waiting == 2
+
+        # The queue is full, so a third request is shed straight away
+        assert not await limit.acquire(1.0)
+
+        limit.release()
+        await asyncio.gather(*tasks)
+
+        assert order == ["first", "second"]
+        assert limit.in_flight == 0
+        assert limit.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_queued_request_times_out() -> None:
+    async def run() -> None:
+        limit = ConcurrencyLimit(limit=1, max_queue=1)
+
+        assert await limit.acquire(1.0)
+        assert not await limit.acquire(0.01)
+        assert limit.waiting == 0
+
+        limit.release()
+        assert limit.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_client_past_its_bucket_gets_429() -> None:
+    async def hello(request):
+        return PlainTextResponse("hello")
+
+    app = Starlette(routes=[Route("/hello", hello, name="hello")])
+    controller = AdmissionController(
+        buckets=TokenBuckets(rate=0.001, burst=2, max_clients=10),
+        default_limit=1,
+        route_limits={},
+        max_queue=1,
+        queue_timeout_seconds=1.0,
+        retry_after_seconds=1,
+        client_key_header="X-Api-Key",
+    )
+    app.add_middleware(AdmissionMiddleware, controller=controller, router=app.router)
+    client = TestClient(app)
+
+    assert client.get("/hello").status_code == 200
+    assert client.get("/hello").status_code == 200
+
+    response = client.get("/hello")
+    assert response.status_code == 429
+    assert response.json() == {"error": True, "detail": "RATE_LIMITED"}
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # Every API key has a bucket of its own
+    assert client.get("/hello", headers={"X-Api-Key": "other"}).status_code == 200
+
+    metrics = controller.get_metrics()
+    assert metrics["rate_limited"] == 1
+    assert metrics["admitted"] == 3
+    assert metrics["routes"]["hello"]["in_flight"] == 0
@@ -0,0 +1,72 @@
+"""
+Tests that the current and command lists are served from the current catalogue view once it
+is refreshed, and that the refresh runs once a burst of writes has settled.
+"""
+import asyncio
+import uuid
+from typing import Any, List
+
+from app.core.debounce import Debouncer
+from conftest import PromptFactory
+
+
+def test_debouncer_runs_once_writes_settle() -> None:
+    runs: List[float] = []
+
+    async def callback() -> None:
+        runs.append(asyncio.get_running_loop().time())
+
+    async def run() -> None:
+        debouncer = Debouncer("test", callback, settle_seconds=0.05, max_wait_seconds=1.0)
+        for _ in range(5):
+            debouncer.trigger()
+            await asyncio.sleep(0.01)
+
+        assert debouncer.is_pending
+        assert runs == []
+
+        await asyncio.sleep(0.1)
+        assert not debouncer.is_pending
+        assert len(runs) == 1
+
+    asyncio.run(run())
+
+
+def test_debouncer_runs_within_max_wait() -> None:
+    runs: List[float] = []
+
+    async def callback() -> None:
+        runs.append(asyncio.get_running_loop().time())
+
+    async def run() -> None:
+        debouncer = Debouncer("test", callback, settle_seconds=0.05, max_wait_seconds=0.1)
+        for _ in range(20):
+            debouncer.trigger()
+            await asyncio.sleep(0.01)
+
+        assert len(runs) >= 1
+
+    asyncio.run(run())
+
+
+def test_lists_are_served_from_the_view(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.modules.prompts.catalogue import refresh_catalogue_view
+
+    marker = uuid.uuid4().hex
+    included = create_prompt(f"Hello {marker}.")
+    prompt = create_prompt(f"Pre: {{{{> {included['slug']}}}}}")
+    refresh_catalogue_view()
+
+    current = client.get(f"{prompts_url}/current").json()
+    rows = {r["slug"]: r for r in current["prompts"]}
+    assert rows[prompt["slug"]]["prompt_text"] == f"Pre: Hello {marker}."
+    assert rows[prompt["slug"]]["revision_id"] == prompt["revision"]["id"]
+
+    assert prompt["slug"] in client.get(f"{prompts_url}/commands").json()["commands"]
+
+    client.delete(f"{prompts_url}/{prompt['slug']}")
+    refresh_catalogue_view()
+
+    assert prompt["slug"] not in client.get(f"{prompts_url}/commands").json()["commands"]
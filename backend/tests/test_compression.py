@@ -0,0 +1,136 @@
+"""
+Tests that the response encoding is negotiated from Accept-Encoding, and that a body is
+compressed once per encoding and then served from the cache.
+"""
+from typing import List, Tuple
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.core import compression  # noqa: E402
+from app.core.compression import CompressionMiddleware, negotiate  # noqa: E402
+from app.database.cache import ResultCache  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import PlainTextResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+ENCODINGS = ("br", "zstd", "gzip")
+BODY = "prompt " * 1000
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "encoding"),
+    [
+        ("gzip, deflate, br", "br"),
+        ("gzip, zstd", "zstd"),
+        ("gzip", "gzip"),
+        ("br;q=0.5, gzip;q=0.8", "gzip"),
+        ("br;q=0, gzip;q=0", None),
+        ("*", "br"),
+        ("*;q=0.5, gzip", "gzip"),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_encoding_is_negotiated(accept_encoding: str, encoding: str | None) -> None:
+    assert negotiate(accept_encoding, ENCODINGS) == encoding
+
+
+@pytest.fixture
+def compressed_calls(monkeypatch: pytest.MonkeyPatch) -> List[Tuple[str, int]]:
+    calls: List[Tuple[str, int]] = []
+    compress = compression.compress
+
+    def counting_compress(encoding: str, data: bytes, level: int) -> bytes:
+        calls.append((encoding, len(data)))
+        return compress(encoding, data, level)
+
+    monkeypatch.setattr(compression, "compress", counting_compress)
+
+    return calls
+
+
+@pytest.fixture
+def client() -> TestClient:
+    async def text(request):
+        return PlainTextResponse(BODY)
+
+    async def tagged(request):
+        return PlainTextResponse(BODY, headers={"ETag": '"abc"'})
+
+    async def small(request):
+        return PlainTextResponse("small")
+
+    async def stream(request):
+        async def chunks():
+            for _ in range(10):
+                yield BODY
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(
+        routes=[
+            Route("/text", text),
+            Route("/tagged", tagged),
+            Route("/small", small),
+            Route("/stream", stream),
+        ]
+    )
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=500,
+        levels={"gzip": 9},
+        cache=ResultCache(1 << 20),
+        encodings=("gzip",),
+    )
+
+    return TestClient(app)
+
+
+def test_bodies_are_compressed_once(client: TestClient, compressed_calls: List) -> None:
+    for _ in range(3):
+        response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert response.text == BODY
+
+    assert compressed_calls == [("gzip", len(BODY))]
+
+
+def test_compressed_bodies_have_weak_etags(client: TestClient) -> None:
+    compressed = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] == 'W/"abc"'
+
+    plain = client.get("/tagged", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] == '"abc"'
+
+
+def test_small_and_unaccepted_bodies_are_sent_as_they_are(
+    client: TestClient, compressed_calls: List
+) -> None:
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+    assert small.text == "small"
+
+    plain = client.get("/text", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.text == BODY
+
+    assert compressed_calls == []
+
+
+def test_streamed_bodies_are_gzipped(client: TestClient) -> None:
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert response.text == BODY * 10
@@ -0,0 +1,74 @@
+"""
+Tests that revision bodies are stored content-addressed, as deltas against the previous body
+when that is smaller, and that an update that does not change the body keeps the current
+revision.
+"""
+import uuid
+from typing import Any
+
+from app.modules.prompts.content import (
+    MAX_DELTA_DEPTH,
+    RevisionBody,
+    compress,
+    decode_body,
+    decompress,
+    encode_blob,
+    encode_body,
+    get_content_hash,
+)
+from conftest import PromptFactory
+
+BODY = RevisionBody(description="Greeting", prompt_text="Say hello to the user. " * 20)
+
+
+def test_content_hash_is_stable() -> None:
+    assert get_content_hash(BODY) == get_content_hash(RevisionBody(*BODY))
+    assert get_content_hash(BODY) != get_content_hash(BODY._replace(description="Other"))
+    assert decode_body(encode_body(BODY)) == BODY
+
+
+def test_body_is_stored_as_delta_when_smaller() -> None:
+    base = encode_blob(BODY)
+    assert base.base_hash is None and base.delta_depth == 0
+
+    edited = BODY._replace(prompt_text=BODY.prompt_text + "Then say goodbye.")
+    delta = encode_blob(edited, (base.content_hash, BODY, base.delta_depth))
+
+    assert delta.base_hash == base.content_hash
+    assert delta.delta_depth == 1
+    assert len(delta.payload) < len(encode_blob(edited).payload)
+    assert decode_body(decompress(delta.payload, zdict=encode_body(BODY))) == edited
+
+
+def test_delta_chain_is_bounded() -> None:
+    edited = BODY._replace(description="Greeting, edited")
+    blob = encode_blob(edited, (get_content_hash(BODY), BODY, MAX_DELTA_DEPTH))
+
+    assert blob.base_hash is None
+    assert blob.delta_depth == 0
+    assert decode_body(decompress(blob.payload)) == edited
+    assert decompress(compress(b"")) == b""
+
+
+def test_unchanged_update_keeps_the_current_revision(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    prompt = create_prompt(f"Unchanged {uuid.uuid4().hex}.")
+
+    response = client.put(
+        prompts_url,
+        json={
+            "ids": [prompt["id"]],
+            "data": {
+                "slug": prompt["slug"],
+                "description": prompt["revision"]["description"],
+                "prompt_text": prompt["revision"]["prompt_text"],
+            },
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["revision"]["id"] == prompt["revision"]["id"]
+
+    revisions = client.get(f"{prompts_url}/detail/{prompt['slug']}/revisions").json()
+    assert [r["id"] for r in revisions["revisions"]] == [prompt["revision"]["id"]]
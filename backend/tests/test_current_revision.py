@@ -0,0 +1,65 @@
+"""
+Tests that a prompt has a single current revision, which its current_revision_id points at, and
+that a second current revision is reported as a conflict of concurrent updates.
+"""
+import uuid
+from typing import Any
+
+import pytest
+from conftest import PromptFactory
+
+
+def test_prompt_points_at_its_current_revision(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.database.meta import open_session
+    from app.modules.prompts.models import PromptRecord, PromptRevisionRecord
+    from sqlalchemy import select
+
+    prompt = create_prompt(f"First {uuid.uuid4().hex}.")
+    response = client.put(
+        prompts_url,
+        json={
+            "ids": [prompt["id"]],
+            "data": {
+                "slug": prompt["slug"],
+                "description": prompt["revision"]["description"],
+                "prompt_text": f"Second {uuid.uuid4().hex}.",
+            },
+        },
+    )
+    assert response.status_code == 200
+
+    with open_session() as session:
+        current_ids = session.execute(
+            select(PromptRevisionRecord.id)
+            .where(PromptRevisionRecord.prompt_id == prompt["id"])
+            .where(PromptRevisionRecord.is_current == True)  # trunk-ignore(ruff/E712)
+        ).scalars().all()
+
+        assert len(current_ids) == 1
+        assert session.get(PromptRecord, prompt["id"]).current_revision_id == current_ids[0]
+
+
+def test_second_current_revision_is_a_conflict(create_prompt: PromptFactory) -> None:
+    from app.database.meta import open_session
+    from app.modules.prompts.adapters import is_current_revision_conflict
+    from app.modules.prompts.models import PromptRevisionRecord
+    from sqlalchemy import insert
+    from sqlalchemy.exc import IntegrityError
+
+    prompt = create_prompt(f"Only {uuid.uuid4().hex}.")
+
+    with open_session() as session:
+        with pytest.raises(IntegrityError) as e:
+            session.execute(
+                insert(PromptRevisionRecord.__table__).values(
+                    prompt_id=prompt["id"],
+                    is_current=True,
+                    content_hash=prompt["revision"]["content_hash"],
+                    flattened_hash=prompt["revision"]["content_hash"],
+                )
+            )
+
+        assert is_current_revision_conflict(e.value)
+        session.rollback()
@@ -0,0 +1,140 @@
+"""
+Tests that requests that have not started their response by their deadline get a 504, and that
+the database circuit breaker opens after consecutive failures and closes after a trial succeeds.
+"""
+import asyncio
+import time
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.core.deadlines import DeadlineMiddleware, get_remaining_seconds  # noqa: E402
+from app.database.breaker import (  # noqa: E402
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    DatabaseUnavailableError,
+    is_deadline_error,
+)
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def client() -> TestClient:
+    async def fast(request):
+        return JSONResponse({"remaining": get_remaining_seconds()})
+
+    async def slow(request):
+        await asyncio.sleep(1.0)
+        return JSONResponse({})
+
+    async def stream(request):
+        async def chunks():
+            yield b"started"
+            await asyncio.sleep(0.2)
+            yield b" and finished"
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(
+        routes=[
+            Route("/fast", fast, name="fast"),
+            Route("/slow", slow, name="slow"),
+            Route("/stream", stream, name="stream"),
+        ]
+    )
+    app.add_middleware(
+        DeadlineMiddleware,
+        default_seconds=0.1,
+        route_seconds={"fast": 5.0},
+        router=app.router,
+    )
+
+    return TestClient(app)
+
+
+def test_request_within_its_budget(client: TestClient) -> None:
+    response = client.get("/fast")
+
+    assert response.status_code == 200
+    assert 0.0 < response.json()["remaining"] <= 5.0
+
+
+def test_request_past_its_deadline_gets_504(client: TestClient) -> None:
+    start = time.monotonic()
+    response = client.get("/slow")
+
+    assert response.status_code == 504
+    assert response.json() == {"error": True, "detail": "DEADLINE_EXCEEDED"}
+    assert time.monotonic() - start < 0.9
+
+
+def test_started_response_is_not_cut_off(client: TestClient) -> None:
+    response = client.get("/stream")
+
+    assert response.status_code == 200
+    assert response.text == "started and finished"
+
+
+class Orig:
+    def __init__(self, pgcode: str) -> None:
+        self.pgcode = pgcode
+
+
+class Error(Exception):
+    def __init__(self, pgcode: str) -> None:
+        self.orig = Orig(pgcode)
+
+
+def test_statement_and_lock_timeouts_are_deadline_errors() -> None:
+    assert is_deadline_error(Error("57014"))
+    assert is_deadline_error(Error("55P03"))
+    assert not is_deadline_error(Error("08006"))
+    assert not is_deadline_error(Exception())
+
+
+def test_breaker_opens_and_closes() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+
+    breaker.record_failure()
+    breaker.check()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(DatabaseUnavailableError) as e:
+        breaker.check()
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "1"}
+
+    # A single trial is let through once reset_seconds have passed, and reopens on failure
+    time.sleep(0.06)
+    breaker.check()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(DatabaseUnavailableError):
+        breaker.check()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    breaker.check()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.check()
+
+    assert breaker.get_metrics() == {
+        "state": CLOSED,
+        "failures": 0,
+        "opened": 2,
+        "rejected": 2,
+    }
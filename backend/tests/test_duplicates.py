@@ -0,0 +1,113 @@
+"""
+Tests that the MinHash signatures and the LSH banding index find near-duplicate prompts among
+their candidates without reporting unrelated prompts, and that a write of a near-duplicate
+through the API is reported.
+"""
+import random
+import uuid
+from typing import Any, List
+
+import pytest
+from app.modules.prompts.duplicates import DuplicateIndex, compute_signature, signature_to_bytes
+from conftest import PromptFactory, random_slug
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike november "
+    "oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee zulu"
+).split()
+
+PERMUTATIONS = 128
+BANDS = 16
+
+
+def get_texts(count: int, length: int = 60) -> List[str]:
+    rng = random.Random(42)
+
+    return [" ".join(rng.choice(WORDS) for _ in range(length)) for _ in range(count)]
+
+
+def edit_one_word(text: str) -> str:
+    words = text.split()
+    words[len(words) // 2] = "changed"
+
+    return " ".join(words)
+
+
+@pytest.fixture
+def index() -> DuplicateIndex:
+    return DuplicateIndex(PERMUTATIONS, BANDS, threshold=0.8)
+
+
+def test_near_duplicates_are_candidates(index: DuplicateIndex) -> None:
+    texts = get_texts(50)
+    for prompt_id, text in enumerate(texts, start=1):
+        index.add(prompt_id, compute_signature(text, PERMUTATIONS))
+
+    found = 0
+    for prompt_id, text in enumerate(texts, start=1):
+        matches = index.query(compute_signature(edit_one_word(text), PERMUTATIONS))
+        if prompt_id in dict(matches):
+            found += 1
+
+        assert all(match_id == prompt_id for match_id, _ in matches)
+
+    assert found == len(texts)
+
+
+def test_signature_estimates_jaccard_similarity() -> None:
+    text = get_texts(1)[0]
+
+    same = compute_signature(text, PERMUTATIONS)
+    assert (same == compute_signature(text.upper(), PERMUTATIONS)).all()
+
+    other = compute_signature(get_texts(2)[1], PERMUTATIONS)
+    assert float((same == other).mean()) < 0.5
+
+
+def test_removed_prompts_are_not_reported(index: DuplicateIndex) -> None:
+    text = get_texts(1)[0]
+    index.add(1, compute_signature(text, PERMUTATIONS))
+
+    signature = compute_signature(text, PERMUTATIONS)
+    assert index.query(signature, exclude_prompt_id=1) == []
+
+    index.remove(1)
+    assert index.query(signature) == []
+
+
+def test_load_replaces_signatures_and_keeps_the_horizon(index: DuplicateIndex) -> None:
+    first, second = get_texts(2)
+    index.load((1,), 100, [(1, signature_to_bytes(compute_signature(first, PERMUTATIONS)), "")])
+    index.load((2,), 105, [(1, None, second)])
+
+    assert index.versions == (2,)
+    assert index.horizon == 105
+    assert index.query(compute_signature(first, PERMUTATIONS)) == []
+    assert [m[0] for m in index.query(compute_signature(second, PERMUTATIONS))] == [1]
+
+
+def test_near_duplicate_is_reported(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.config import get_config
+    from app.modules.prompts.routing import NEAR_DUPLICATE_HEADER
+
+    if str(get_config().DUPLICATE_CHECK_MODE).lower() != "warn":
+        pytest.skip("Near-duplicates are only reported in the warn mode")
+
+    text = f"{uuid.uuid4().hex} {get_texts(1)[0]}"
+    original = create_prompt(text)
+    duplicate_slug = random_slug()
+
+    response = client.post(
+        prompts_url,
+        json={
+            "slug": duplicate_slug,
+            "description": "Near-duplicate",
+            "prompt_text": edit_one_word(text),
+        },
+    )
+    client.delete(f"{prompts_url}/{duplicate_slug}")
+
+    assert response.status_code == 200
+    assert original["slug"] in response.headers[NEAR_DUPLICATE_HEADER].split(",")
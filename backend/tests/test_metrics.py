@@ -0,0 +1,111 @@
+"""
+Tests that metrics are rendered in the Prometheus text format, and that the metrics endpoint
+requires the METRICS_TOKEN as a bearer token when one is configured.
+"""
+import threading
+from typing import Iterator
+
+import pytest
+from app.core.metrics import MetricFamily, MetricsMiddleware, MetricsRegistry
+from starlette.routing import Router
+
+
+def test_counters_and_histograms_are_rendered() -> None:
+    registry = MetricsRegistry(worker_label=None)
+    requests = registry.counter("requests_total", "Requests", ("route",))
+    duration = registry.histogram("duration_seconds", "Duration", ("route",), (0.1, 1.0))
+
+    requests.inc(("a",))
+    requests.inc(("a",))
+    duration.observe(("a",), 0.0625)
+    duration.observe(("a",), 0.5)
+    duration.observe(("a",), 4.0)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="a"} 2' in lines
+    assert "# TYPE duration_seconds histogram" in lines
+    assert 'duration_seconds_bucket{route="a",le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{route="a",le="1"} 2' in lines
+    assert 'duration_seconds_bucket{route="a",le="+Inf"} 3' in lines
+    assert 'duration_seconds_sum{route="a"} 4.5625' in lines
+    assert 'duration_seconds_count{route="a"} 3' in lines
+
+
+def test_shards_of_all_threads_are_summed() -> None:
+    registry = MetricsRegistry(worker_label=None)
+    requests = registry.counter("requests_total", "Requests")
+
+    threads = [threading.Thread(target=requests.inc) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests.inc()
+
+    assert "requests_total 5" in registry.render().splitlines()
+
+
+def test_collectors_and_label_escaping() -> None:
+    registry = MetricsRegistry(worker_label="worker")
+    registry.register_collector(
+        "queue",
+        lambda: [MetricFamily("queue_depth", "gauge", "Depth", ("name",), [(('a"b\\',), 3.0)])],
+    )
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE queue_depth gauge" in lines
+    assert any(
+        line.startswith('queue_depth{worker="') and line.endswith(',name="a\\"b\\\\"} 3')
+        for line in lines
+    )
+
+
+def test_families_are_rendered_once_when_the_app_is_built_again() -> None:
+    registry = MetricsRegistry(worker_label=None)
+    for _ in range(2):
+        MetricsMiddleware(Router(), registry, Router())
+
+    lines = registry.render().splitlines()
+
+    assert lines.count("# TYPE http_requests_total counter") == 1
+    assert lines.count("# TYPE http_background_tasks_pending gauge") == 1
+
+
+@pytest.fixture
+def metrics_client(monkeypatch: pytest.MonkeyPatch) -> Iterator:
+    from app.config import get_config
+
+    try:
+        config = get_config()
+    except RuntimeError as e:
+        pytest.skip(f"The app is not configured: {e}")
+
+    from app.core.error_handling import ERROR_HANDLERS
+    from app.modules.metrics.routing import get_router__metrics
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(config, "METRICS_TOKEN", "secret")
+
+    app = FastAPI()
+    for error_class, handler in ERROR_HANDLERS.items():
+        app.add_exception_handler(error_class, handler)
+    app.include_router(get_router__metrics())
+
+    yield TestClient(app)
+
+
+def test_metrics_require_the_token(metrics_client) -> None:
+    assert metrics_client.get("/metrics").status_code == 401
+    assert (
+        metrics_client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code
+        == 401
+    )
+
+    response = metrics_client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert "single_flight_calls_total" in response.text
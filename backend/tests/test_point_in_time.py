@@ -0,0 +1,63 @@
+"""
+Tests that point-in-time reads return exactly what was served at that time, including the
+expansion of prompts that include a prompt which has changed since.
+"""
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any
+
+from conftest import PromptFactory
+
+
+def test_as_of_reads_dependents_as_they_were(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    marker = uuid.uuid4().hex
+    alpha = create_prompt(f"Hello {marker}.")
+    zeta = create_prompt(f"Pre: {{{{> {alpha['slug']}}}}}")
+
+    time.sleep(0.01)
+    before_edit = datetime.now(timezone.utc).isoformat()
+    time.sleep(0.01)
+
+    response = client.put(
+        prompts_url,
+        json={
+            "ids": [alpha["id"]],
+            "data": {
+                "slug": alpha["slug"],
+                "description": alpha["revision"]["description"],
+                "prompt_text": f"Greetings {marker}.",
+            },
+        },
+    )
+    assert response.status_code == 200
+
+    current = client.get(f"{prompts_url}/detail/{zeta['slug']}").json()
+    assert current["revision"]["prompt_text"] == f"Pre: Greetings {marker}."
+
+    as_of = client.get(
+        f"{prompts_url}/detail/{zeta['slug']}", params={"as_of": before_edit}
+    ).json()
+    assert as_of["revision"]["id"] == zeta["revision"]["id"]
+    assert as_of["revision"]["prompt_text"] == f"Pre: Hello {marker}."
+
+    current_list = client.get(f"{prompts_url}/current", params={"as_of": before_edit}).json()
+    rows = {r["slug"]: r for r in current_list["prompts"]}
+    assert rows[zeta["slug"]]["prompt_text"] == f"Pre: Hello {marker}."
+    assert rows[alpha["slug"]]["prompt_text"] == f"Hello {marker}."
+
+
+def test_as_of_before_creation_is_not_found(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    before_create = datetime.now(timezone.utc).isoformat()
+    time.sleep(0.01)
+    prompt = create_prompt(f"Created {uuid.uuid4().hex}.")
+
+    response = client.get(
+        f"{prompts_url}/detail/{prompt['slug']}", params={"as_of": before_create}
+    )
+
+    assert response.status_code == 404
@@ -0,0 +1,94 @@
+"""
+Tests that include directives are expanded into the flattened text of a prompt, that includes
+which would create a cycle are rejected, and that a prompt which includes a changed prompt gets
+a new revision instead of a rewritten one.
+"""
+import uuid
+from typing import Any
+
+from conftest import PromptFactory
+
+
+def update_prompt(client: Any, prompts_url: str, prompt: dict, prompt_text: str) -> Any:
+    return client.put(
+        prompts_url,
+        json={
+            "ids": [prompt["id"]],
+            "data": {
+                "slug": prompt["slug"],
+                "description": prompt["revision"]["description"],
+                "prompt_text": prompt_text,
+            },
+        },
+    )
+
+
+def test_includes_are_expanded(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    marker = uuid.uuid4().hex
+    included = create_prompt(f"Shared preamble {marker}.")
+    including = create_prompt(f"{{{{> {included['slug']}}}}} Then answer {marker}.")
+
+    response = client.get(f"{prompts_url}/detail/{including['slug']}")
+    assert response.status_code == 200
+    assert response.json()["revision"]["prompt_text"] == (
+        f"Shared preamble {marker}. Then answer {marker}."
+    )
+
+
+def test_include_of_missing_prompt_is_rejected(client: Any, prompts_url: str) -> None:
+    response = client.post(
+        prompts_url,
+        json={
+            "slug": f"t{uuid.uuid4().hex[:10]}",
+            "description": "Includes a prompt that does not exist",
+            "prompt_text": f"{{{{> t{uuid.uuid4().hex[:10]}}}}}",
+        },
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["code"] == "PROMPT_INCLUDE_DOES_NOT_EXIST"
+
+
+def test_include_cycle_is_rejected(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    marker = uuid.uuid4().hex
+    alpha = create_prompt(f"Alpha {marker}.")
+    beta = create_prompt(f"Beta {marker} {{{{> {alpha['slug']}}}}}")
+
+    response = update_prompt(
+        client, prompts_url, alpha, f"Alpha {marker} {{{{> {beta['slug']}}}}}"
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["code"] == "PROMPT_INCLUDE_CYCLE"
+
+
+def test_change_of_included_prompt_creates_dependent_revisions(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    marker = uuid.uuid4().hex
+    alpha = create_prompt(f"Hello {marker}.")
+    beta = create_prompt(f"Pre: {{{{> {alpha['slug']}}}}}")
+    gamma = create_prompt(f"Outer: {{{{> {beta['slug']}}}}}")
+
+    response = update_prompt(client, prompts_url, alpha, f"Greetings {marker}.")
+    assert response.status_code == 200
+
+    for dependent, expected_text in (
+        (beta, f"Pre: Greetings {marker}."),
+        (gamma, f"Outer: Pre: Greetings {marker}."),
+    ):
+        current = client.get(f"{prompts_url}/detail/{dependent['slug']}").json()
+        assert current["revision"]["prompt_text"] == expected_text
+        # The revision that was served before the change is kept as it was
+        assert current["revision"]["id"] != dependent["revision"]["id"]
+        assert current["revision"]["content_hash"] == dependent["revision"]["content_hash"]
+
+        revisions = client.get(f"{prompts_url}/detail/{dependent['slug']}/revisions").json()
+        assert [r["id"] for r in revisions["revisions"]] == [
+            current["revision"]["id"],
+            dependent["revision"]["id"],
+        ]
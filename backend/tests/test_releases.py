@@ -0,0 +1,87 @@
+"""
+Tests that releases are served with a strong ETag of their content hash, answer conditional
+requests with a 304, and are not deleted while clients may still have them cached.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import pytest
+from app.utils.wire import matches_if_none_match
+from conftest import PromptFactory
+
+
+@pytest.mark.parametrize(
+    ("header", "matches"),
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"ab"', False),
+        ('"abcd"', False),
+        ("abc", False),
+        ('"xyz"', False),
+    ],
+)
+def test_if_none_match(header: str, matches: bool) -> None:
+    assert matches_if_none_match(header, '"abc"') is matches
+
+
+def test_release_is_served_with_etag(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    create_prompt(f"Released {uuid.uuid4().hex}.")
+    release = client.post(f"{prompts_url}/releases").json()
+
+    # A compressed body is sent with a weak ETag, so the strong one is read uncompressed
+    identity = {"Accept-Encoding": "identity"}
+    response = client.get(f"{prompts_url}/releases/{release['id']}", headers=identity)
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{release["content_hash"]}"'
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.json()["total"] == release["total"]
+
+    not_modified = client.get(
+        f"{prompts_url}/releases/{release['id']}",
+        headers={**identity, "If-None-Match": response.headers["ETag"]},
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == response.headers["ETag"]
+    assert not_modified.content == b""
+
+    modified = client.get(
+        f"{prompts_url}/releases/{release['id']}", headers={"If-None-Match": '"stale"'}
+    )
+    assert modified.status_code == 200
+
+
+def test_unchanged_catalogue_returns_latest_release(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    create_prompt(f"Released {uuid.uuid4().hex}.")
+    release = client.post(f"{prompts_url}/releases").json()
+
+    assert client.post(f"{prompts_url}/releases").json()["id"] == release["id"]
+
+
+def test_recent_releases_are_not_pruned(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.database.meta import open_session
+    from app.modules.prompts.adapters import AdapterPromptReleases
+    from app.modules.prompts.models import PromptReleaseRecord
+    from app.modules.prompts.releases import RELEASE_MAX_AGE_SECONDS
+
+    create_prompt(f"Released {uuid.uuid4().hex}.")
+    release = client.post(f"{prompts_url}/releases").json()
+
+    with open_session() as session:
+        db_prompts_releases = AdapterPromptReleases(session, PromptReleaseRecord)
+        db_prompts_releases.prune(
+            0,
+            created_before=datetime.now(timezone.utc) - timedelta(seconds=RELEASE_MAX_AGE_SECONDS),
+        )
+
+        assert session.get(PromptReleaseRecord, release["id"]) is not None
+        session.rollback()
@@ -0,0 +1,76 @@
+"""
+Tests that cached adapter reads are keyed by the write versions of their tables, so that a result
+is loaded again as soon as a write to one of its tables has committed, in any worker.
+
+The table versions are read from a counter instead of the database.
+"""
+import asyncio
+from contextlib import nullcontext
+from typing import Dict, Tuple
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.database import adapters  # noqa: E402
+from app.database.adapters import AdapterCRUD  # noqa: E402
+from app.database.cache import ResultCache  # noqa: E402
+
+
+class Record:
+    __tablename__ = "cached_records"
+
+
+class CountingAdapter(AdapterCRUD):
+    """
+    A versioned adapter whose table versions are read from a shared counter
+    """
+
+    versioned = True
+    versions: Dict[str, int] = {}
+
+    def get_table_versions(self) -> Tuple[int, ...]:
+        return (self.versions.get(self.table.__tablename__, 0),)
+
+
+@pytest.fixture
+def adapter(monkeypatch: pytest.MonkeyPatch) -> CountingAdapter:
+    monkeypatch.setattr(adapters, "open_session", lambda: nullcontext(None))
+    monkeypatch.setattr(get_config(), "RESULT_CACHE_ENABLE", True)
+    result_cache = ResultCache(1 << 20)
+    monkeypatch.setattr(adapters, "get_result_cache", lambda: result_cache)
+    CountingAdapter.versions = {}
+
+    return CountingAdapter(None, Record)  # type: ignore
+
+
+def test_cached_read_is_reused_until_a_write(adapter: CountingAdapter) -> None:
+    loads = []
+
+    def load(_: AdapterCRUD) -> int:
+        loads.append(1)
+        return len(loads)
+
+    async def read() -> int:
+        return await adapter.cached("count", (), load)
+
+    assert asyncio.run(read()) == 1
+    assert asyncio.run(read()) == 1
+
+    # A write committed by another worker bumps the version, and the next read sees it at once
+    CountingAdapter.versions[Record.__tablename__] = 1
+    assert asyncio.run(read()) == 2
+    assert asyncio.run(read()) == 2
+    assert len(loads) == 2
+
+
+def test_cached_reads_are_keyed_by_arguments(adapter: CountingAdapter) -> None:
+    async def read(arg: str) -> str:
+        return await adapter.cached("echo", arg, lambda _: arg)
+
+    assert asyncio.run(read("a")) == "a"
+    assert asyncio.run(read("b")) == "b"
@@ -0,0 +1,125 @@
+"""
+Tests that the similarity index ranks prompts by their shared n-grams, is rebuilt when it is
+behind the database, and queues the updates that arrive while it is being built.
+
+The prompts and table versions are read from a fake adapter instead of the database.
+"""
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.modules.prompts import similarity  # noqa: E402
+from app.modules.prompts.similarity import SimilarityIndex  # noqa: E402
+
+DOCUMENTS = [
+    (1, "Weather", "Summarise the weather forecast for tomorrow in one sentence."),
+    (2, "Forecast", "Summarise tomorrow's weather forecast in a single sentence."),
+    (3, "Recipe", "List the ingredients of a chocolate cake recipe."),
+]
+
+
+class Revision:
+    def __init__(self, description: str, prompt_text: str) -> None:
+        self.description = description
+        self.prompt_text = prompt_text
+
+
+class Row:
+    def __init__(self, id: int, description: str, prompt_text: str) -> None:
+        self.id = id
+        self.revision = Revision(description, prompt_text)
+
+
+class FakeAdapterPrompts:
+    """
+    Reads the active prompts and the table versions from class attributes
+    """
+
+    versions: Tuple[int, ...] = (1, 1)
+    prompts: Dict[int, Tuple[str, str]] = {}
+    reads: List[List[int] | None] = []
+
+    def __init__(self, session, table) -> None:
+        pass
+
+    def get_table_versions(self) -> Tuple[int, ...]:
+        return self.versions
+
+    def read_active(self, ids: List[int] | None = None) -> List[Row]:
+        self.reads.append(ids)
+
+        return [
+            Row(prompt_id, *body)
+            for prompt_id, body in self.prompts.items()
+            if ids is None or prompt_id in ids
+        ]
+
+
+@pytest.fixture
+def index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> SimilarityIndex:
+    FakeAdapterPrompts.versions = (1, 1)
+    FakeAdapterPrompts.prompts = {d[0]: d[1:] for d in DOCUMENTS}
+    FakeAdapterPrompts.reads = []
+    monkeypatch.setattr(similarity, "AdapterPrompts", FakeAdapterPrompts)
+    monkeypatch.setattr(similarity, "open_session", nullcontext)
+
+    return SimilarityIndex(tmp_path / "similarity.index", 256)
+
+
+def test_similar_prompts_are_ranked_first(index: SimilarityIndex) -> None:
+    index.build()
+
+    assert index.read_versions() == (1, 1)
+    assert index.similar(1, 1)[0][0] == 2
+
+
+def test_index_behind_the_database_is_rebuilt(index: SimilarityIndex) -> None:
+    index.build()
+    index.build()
+    assert FakeAdapterPrompts.reads == [None]
+
+    FakeAdapterPrompts.versions = (2, 2)
+    FakeAdapterPrompts.prompts[4] = ("Cake", "List the ingredients of a lemon cake recipe.")
+    index.build()
+
+    assert FakeAdapterPrompts.reads == [None, None]
+    assert index.read_versions() == (2, 2)
+    assert index.similar(4, 1)[0][0] == 3
+
+
+def test_updates_are_read_from_the_database(index: SimilarityIndex) -> None:
+    index.build()
+
+    FakeAdapterPrompts.versions = (2, 2)
+    FakeAdapterPrompts.prompts[1] = ("Cake", "List the ingredients of a sponge cake recipe.")
+    del FakeAdapterPrompts.prompts[2]
+    index.update([1, 2])
+
+    assert index.read_versions() == (2, 2)
+    assert index.similar(2, 1) == []
+    assert index.similar(1, 1)[0][0] == 3
+
+
+def test_updates_during_a_build_are_queued(index: SimilarityIndex) -> None:
+    index.build()
+    index._is_building = True
+
+    FakeAdapterPrompts.versions = (2, 2)
+    del FakeAdapterPrompts.prompts[2]
+    index.update([2])
+    assert index.similar(1, 1)[0][0] == 2
+
+    index._is_building = False
+    index.build()
+
+    assert FakeAdapterPrompts.reads[-1] == [2]
+    assert index._pending_ids == set()
+    assert 2 not in dict(index.similar(1, 3))
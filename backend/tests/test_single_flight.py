@@ -0,0 +1,88 @@
+"""
+Tests that identical concurrent reads are run once and share their result or their error, and
+that callers give up on a read after the timeout without cancelling it for the others.
+"""
+import asyncio
+from typing import List
+
+import pytest
+from app.core.singleflight import SingleFlight, SingleFlightTimeoutError
+
+
+def test_concurrent_reads_share_one_flight() -> None:
+    single_flight = SingleFlight("test", timeout_seconds=1.0)
+    loads: List[int] = []
+
+    async def load() -> int:
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def read_all() -> List[int]:
+        return await asyncio.gather(*(single_flight.run("key", load) for _ in range(5)))
+
+    assert asyncio.run(read_all()) == [42] * 5
+    assert len(loads) == 1
+    assert single_flight.get_metrics()["coalesced"] == 4
+    assert single_flight.in_flight == 0
+
+
+def test_reads_of_different_keys_are_not_shared() -> None:
+    single_flight = SingleFlight("test", timeout_seconds=1.0)
+
+    async def read_all() -> List[str]:
+        return await asyncio.gather(
+            *(single_flight.run(key, lambda key=key: asyncio.sleep(0, key)) for key in "abc")
+        )
+
+    assert asyncio.run(read_all()) == ["a", "b", "c"]
+    assert single_flight.get_metrics()["flights"] == 3
+
+
+def test_error_is_shared_and_not_kept() -> None:
+    single_flight = SingleFlight("test", timeout_seconds=1.0)
+    loads: List[int] = []
+
+    async def failing_load() -> int:
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("read failed")
+
+    async def read_all() -> List:
+        return await asyncio.gather(
+            *(single_flight.run("key", failing_load) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(read_all())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(loads) == 1
+    assert single_flight.get_metrics()["errors"] == 1
+
+    # The failed flight is forgotten, so the next read runs again
+    async def load() -> int:
+        return 7
+
+    assert asyncio.run(single_flight.run("key", load)) == 7
+
+
+def test_timeout_does_not_cancel_the_read() -> None:
+    single_flight = SingleFlight("test", timeout_seconds=0.01)
+    finished: List[int] = []
+
+    async def slow_load() -> int:
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return 1
+
+    async def read_and_wait() -> None:
+        with pytest.raises(SingleFlightTimeoutError) as e:
+            await single_flight.run("key", slow_load)
+
+        assert e.value.status_code == 504
+        assert isinstance(e.value.__cause__, asyncio.TimeoutError)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(read_and_wait())
+    assert finished == [1]
+    assert single_flight.get_metrics()["timeouts"] == 1
+    assert single_flight.in_flight == 0
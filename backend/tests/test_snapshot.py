@@ -0,0 +1,104 @@
+"""
+Tests that a worker serves the catalogue from the snapshot file as soon as it starts, reloads
+it when the table versions move, and encodes binary media types once per snapshot.
+
+The table versions and the catalogue are read from fakes instead of the database.
+"""
+import asyncio
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Tuple
+
+import msgpack
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.modules.prompts import snapshot  # noqa: E402
+from app.modules.prompts.rows import CurrentRow  # noqa: E402
+from app.modules.prompts.snapshot import (  # noqa: E402
+    SnapshotStore,
+    build_snapshot,
+    snapshot_from_buffer,
+    snapshot_to_bytes,
+)
+from app.utils.wire import JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE  # noqa: E402
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def get_rows(*slugs: str) -> List[CurrentRow]:
+    return [
+        CurrentRow(i, i, slug, f"About {slug}", f"Text of {slug}", True, NOW, NOW)
+        for i, slug in enumerate(slugs, start=1)
+    ]
+
+
+def test_snapshot_round_trip() -> None:
+    built = build_snapshot((1, 2), 2, get_rows("alpha", "bravo"))
+
+    loaded = snapshot_from_buffer(snapshot_to_bytes(built))
+
+    assert loaded is not None
+    assert loaded.versions == (1, 2)
+    assert bytes(loaded.current_body) == built.current_body
+    assert json.loads(bytes(loaded.commands_body)) == {"commands": ["alpha", "bravo"]}
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"not json\n{}\n{}", b'{"format": 0, "versions": []}\n{}\n{}', b"{}"]
+)
+def test_unusable_snapshots_are_ignored(data: bytes) -> None:
+    assert snapshot_from_buffer(data) is None
+
+
+@pytest.fixture
+def store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> SnapshotStore:
+    versions: List[Tuple[int, ...]] = [(2, 2)]
+    monkeypatch.setattr(snapshot, "read_versions", lambda: versions[0])
+    monkeypatch.setattr(
+        snapshot, "read_snapshot", lambda: build_snapshot(versions[0], 1, get_rows("bravo"))
+    )
+
+    path = tmp_path / "catalogue.snapshot"
+    path.write_bytes(snapshot_to_bytes(build_snapshot((1, 1), 1, get_rows("alpha"))))
+
+    return SnapshotStore(path, check_seconds=60.0)
+
+
+def test_worker_serves_the_file_until_it_is_checked(store: SnapshotStore) -> None:
+    async def run() -> None:
+        await store.start()
+        try:
+            assert store.snapshot is not None
+            assert store.snapshot.is_mapped
+            assert store.snapshot.versions == (1, 1)
+            commands = store.get_body(store.snapshot, "commands", JSON_MEDIA_TYPE)
+            assert json.loads(commands) == {"commands": ["alpha"]}
+
+            await store.check()
+            assert store.snapshot.versions == (2, 2)
+            commands = store.get_body(store.snapshot, "commands", JSON_MEDIA_TYPE)
+            assert json.loads(commands) == {"commands": ["bravo"]}
+        finally:
+            await store.stop()
+
+    asyncio.run(run())
+
+    reloaded = snapshot_from_buffer(store.path.read_bytes())
+    assert reloaded is not None and reloaded.versions == (2, 2)
+
+
+def test_binary_lists_are_encoded_once(store: SnapshotStore) -> None:
+    loaded = store.read_file()
+    assert loaded is not None
+
+    body = store.get_body(loaded, "current", MSGPACK_MEDIA_TYPE)
+
+    assert store.get_body(loaded, "current", MSGPACK_MEDIA_TYPE) is body
+    assert msgpack.unpackb(body)["prompts"][0]["slug"] == "alpha"
@@ -0,0 +1,50 @@
+"""
+Tests that the prompt list is streamed as newline delimited JSON, with the same prompts as the
+JSON list and the total in a header.
+"""
+import json
+import uuid
+from typing import Any
+
+from conftest import PromptFactory
+
+
+def test_list_is_streamed_as_ndjson(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.modules.prompts.routing import NDJSON_MEDIA_TYPE, TOTAL_COUNT_HEADER
+
+    prompt = create_prompt(f"Streamed {uuid.uuid4().hex}.")
+    params = {"filter_input": json.dumps({"slug": prompt["slug"]})}
+
+    response = client.get(prompts_url, params={**params, "stream": "true"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith(NDJSON_MEDIA_TYPE)
+    assert int(response.headers[TOTAL_COUNT_HEADER]) >= 1
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["id"], r["slug"]) for r in rows] == [(prompt["id"], prompt["slug"])]
+
+    listed = client.get(prompts_url, params=params).json()["prompts"]
+    assert rows[0]["revision"] == listed[0]["revision"]
+
+
+def test_list_is_streamed_for_accept_header(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    from app.modules.prompts.routing import NDJSON_MEDIA_TYPE
+
+    first = create_prompt(f"Streamed {uuid.uuid4().hex}.")
+    second = create_prompt(f"Streamed {uuid.uuid4().hex}.")
+
+    response = client.get(
+        prompts_url,
+        params={"ids": json.dumps([first["id"], second["id"]]), "history": "true"},
+        headers={"Accept": NDJSON_MEDIA_TYPE},
+    )
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["id"] for r in rows) == sorted([first["id"], second["id"]])
+    assert all(len(r["history"]) == 1 for r in rows)
@@ -0,0 +1,68 @@
+"""
+Tests that prompt templates are parsed, compiled and rendered, and that prompt text with a
+malformed placeholder is rejected when it is written.
+"""
+import uuid
+from typing import Any
+
+import pytest
+from app.modules.prompts.templates import (
+    CompiledTemplate,
+    TemplateRenderError,
+    TemplateSyntaxError,
+    parse_placeholders,
+    spans_from_json,
+    spans_to_json,
+)
+
+
+def compile_template(text: str) -> CompiledTemplate:
+    return CompiledTemplate(text, spans_from_json(spans_to_json(parse_placeholders(text))))
+
+
+@pytest.mark.parametrize(
+    ("text", "variables", "rendered"),
+    [
+        ("No placeholders", {}, "No placeholders"),
+        ("Hello {{name}}!", {"name": "Ada"}, "Hello Ada!"),
+        ("Hello {{ name }}, {{name}}", {"name": "Ada"}, "Hello Ada, Ada"),
+        ("Hello {{name|there}}", {}, "Hello there"),
+        ("Hello {{name|there}}", {"name": "Ada"}, "Hello Ada"),
+        ("Hello {{name|}}.", {}, "Hello ."),
+        ("Literal \\{{name}} and {{name}}", {"name": "Ada"}, "Literal {{name}} and Ada"),
+        ("{{a}}{{b}}", {"a": "1", "b": "2"}, "12"),
+    ],
+)
+def test_render(text: str, variables: dict, rendered: str) -> None:
+    assert compile_template(text).render(variables) == rendered
+
+
+def test_variables_are_listed_once_in_order() -> None:
+    assert compile_template("{{b}} {{a|x}} {{b}}").variables == ("b", "a")
+
+
+def test_missing_variables_are_reported() -> None:
+    with pytest.raises(TemplateRenderError) as e:
+        compile_template("{{greeting}} {{name}} {{name}} {{title|}}").render({})
+
+    assert e.value.missing == ["greeting", "name"]
+
+
+@pytest.mark.parametrize("text", ["Hello {{", "Hello {{name", "{{1name}}", "{{na me}}", "{{}}"])
+def test_malformed_placeholders_are_rejected(text: str) -> None:
+    with pytest.raises(TemplateSyntaxError):
+        parse_placeholders(text)
+
+
+def test_prompt_with_malformed_placeholder_is_not_written(client: Any, prompts_url: str) -> None:
+    response = client.post(
+        prompts_url,
+        json={
+            "slug": f"t{uuid.uuid4().hex[:10]}",
+            "description": "A malformed template",
+            "prompt_text": f"Hello {{{{name {uuid.uuid4().hex}",
+        },
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["code"] == "PROMPT_TEMPLATE_INVALID"
@@ -0,0 +1,117 @@
+"""
+Tests that the text filters of get_many are planned onto the indexes of the prompts table, and
+that they match the same rows as a plain ILIKE.
+
+These run against the database of the app config migrated to head, for example the Postgres of
+docker-compose.dev.yml, and are skipped when it cannot be reached. Sequential scans are disabled
+in the test transaction, so that the plans show which index serves a filter on a small table.
+"""
+from typing import Iterator
+
+import pytest
+from app.config import get_config
+
+try:
+    get_config()
+except RuntimeError as e:
+    pytest.skip(f"The app is not configured: {e}", allow_module_level=True)
+
+from app.database.adapters import (  # noqa: E402
+    TextFilterMatch,
+    classify_text_filter,
+    plan_text_filter,
+)
+from app.database.meta import DatabaseManager  # noqa: E402
+from app.modules.prompts.models import PromptRecord  # noqa: E402
+from sqlalchemy import ColumnElement, String, column, select, text, values  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+from sqlalchemy.engine import Connection  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+SAMPLE_SLUGS = [
+    "a_b",
+    "a\\_b",
+    "axb",
+    "Some-Prompt",
+    "some-prompt-2",
+    "Straße",
+    "STRASSE",
+    "Ärger",
+]
+"""
+Slugs that the filters are matched against, with wildcards, escapes and non-ASCII case
+"""
+
+slugs = values(column("slug", String), name="slugs").data([(s,) for s in SAMPLE_SLUGS])
+
+
+@pytest.fixture(scope="module")
+def connection() -> Iterator[Connection]:
+    try:
+        db_connection = DatabaseManager(get_config()).db.connect()
+    except OperationalError as e:
+        pytest.skip(f"The database is not available: {e}")
+
+    with db_connection:
+        transaction = db_connection.begin()
+        db_connection.execute(text("SET LOCAL enable_seqscan = off"))
+        yield db_connection
+        transaction.rollback()
+
+
+def explain(connection: Connection, value: str) -> str:
+    stmt = select(PromptRecord.id).where(
+        plan_text_filter(PromptRecord.__table__.columns["slug"], value)
+    )
+    compiled = stmt.compile(dialect=postgresql.dialect())
+
+    return "\n".join(
+        r[0] for r in connection.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+    )
+
+
+def matching_slugs(connection: Connection, filter_clause: ColumnElement) -> set:
+    return {r[0] for r in connection.execute(select(slugs.c.slug).where(filter_clause))}
+
+
+@pytest.mark.parametrize(
+    ("value", "match"),
+    [
+        ("some-prompt", TextFilterMatch.EXACT),
+        ("some%", TextFilterMatch.PREFIX),
+        ("%prompt%", TextFilterMatch.CONTAINS),
+        ("some_prompt", TextFilterMatch.CONTAINS),
+        ("%", TextFilterMatch.CONTAINS),
+        ("a\\b", TextFilterMatch.CONTAINS),
+        ("a\\%%", TextFilterMatch.CONTAINS),
+        ("a\\b%", TextFilterMatch.CONTAINS),
+    ],
+)
+def test_classify_text_filter(value: str, match: TextFilterMatch) -> None:
+    assert classify_text_filter(value) == match
+
+
+@pytest.mark.parametrize(
+    ("value", "index_name"),
+    [
+        ("some-prompt", "ix_prompts_slug_lower_pattern"),
+        ("Some-Prompt", "ix_prompts_slug_lower_pattern"),
+        ("some%", "ix_prompts_slug_lower_pattern"),
+        ("%prompt%", "ix_prompts_slug_trgm"),
+        ("%some_prompt%", "ix_prompts_slug_trgm"),
+    ],
+)
+def test_text_filter_uses_index(connection: Connection, value: str, index_name: str) -> None:
+    assert index_name in explain(connection, value)
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["a_b", "a\\_b", "A\\_B", "some-prompt", "SOME%", "%prompt%", "straße", "strasse", "ärger"],
+)
+def test_text_filter_matches_ilike(connection: Connection, value: str) -> None:
+    slug = slugs.c.slug
+
+    assert matching_slugs(connection, plan_text_filter(slug, value)) == matching_slugs(
+        connection, slug.ilike(value)
+    )
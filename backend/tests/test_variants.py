@@ -0,0 +1,95 @@
+"""
+Tests that A/B variants are picked in proportion to their weights, stick to a client key, and
+are served by the prompt detail endpoint until they are cleared.
+"""
+import uuid
+from collections import Counter
+from typing import Any
+
+from app.modules.prompts.variants import AliasTable, VariantCache, get_uniform
+from conftest import PromptFactory
+
+
+def test_picks_follow_the_weights() -> None:
+    table = AliasTable([(10, 1), (20, 3), (30, 6)])
+    steps = 10000
+
+    picks = Counter(table.pick(i / steps) for i in range(steps))
+
+    assert picks == {10: 1000, 20: 3000, 30: 6000}
+
+
+def test_single_variant_is_always_picked() -> None:
+    table = AliasTable([(10, 5)])
+
+    assert {table.pick(u) for u in (0.0, 0.5, 0.999999)} == {10}
+
+
+def test_client_key_is_sticky() -> None:
+    assert get_uniform(1, "client") == get_uniform(1, "client")
+    assert get_uniform(1, "client") != get_uniform(2, "client")
+    assert 0.0 <= get_uniform(1, "client") < 1.0
+
+
+def test_variant_cache_evicts_least_recently_used() -> None:
+    cache = VariantCache(2)
+    cache.put((1, 0), AliasTable([(10, 1)]))
+    cache.put((2, 0), None)
+    cache.get((1, 0))
+    cache.put((3, 0), None)
+
+    assert (1, 0) in cache
+    assert (2, 0) not in cache
+    assert (3, 0) in cache
+    assert cache.get((3, 0)) is None
+
+
+def test_variants_are_served(client: Any, prompts_url: str, create_prompt: PromptFactory) -> None:
+    marker = uuid.uuid4().hex
+    prompt = create_prompt(f"Variant A {marker}.")
+    first_revision_id = prompt["revision"]["id"]
+
+    updated = client.put(
+        prompts_url,
+        json={
+            "ids": [prompt["id"]],
+            "data": {
+                "slug": prompt["slug"],
+                "description": prompt["revision"]["description"],
+                "prompt_text": f"Variant B {marker}.",
+            },
+        },
+    ).json()
+    assert updated["revision"]["id"] != first_revision_id
+
+    variants_url = f"{prompts_url}/variants/{prompt['slug']}"
+    response = client.put(
+        variants_url, json={"variants": [{"revision_id": first_revision_id, "weight": 1}]}
+    )
+    assert response.status_code == 200
+    assert response.json()["variants"] == [{"revision_id": first_revision_id, "weight": 1}]
+
+    served = client.get(
+        f"{prompts_url}/detail/{prompt['slug']}", headers={"X-Client-Key": "client"}
+    ).json()
+    assert served["revision"]["id"] == first_revision_id
+    assert served["revision"]["prompt_text"] == f"Variant A {marker}."
+
+    assert client.put(variants_url, json={"variants": []}).status_code == 200
+    served = client.get(f"{prompts_url}/detail/{prompt['slug']}").json()
+    assert served["revision"]["id"] == updated["revision"]["id"]
+
+
+def test_variants_of_another_prompt_are_rejected(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    prompt = create_prompt(f"Variant {uuid.uuid4().hex}.")
+    other = create_prompt(f"Other {uuid.uuid4().hex}.")
+
+    response = client.put(
+        f"{prompts_url}/variants/{prompt['slug']}",
+        json={"variants": [{"revision_id": other["revision"]["id"], "weight": 1}]},
+    )
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "PROMPT_REVISION_DOES_NOT_EXIST"
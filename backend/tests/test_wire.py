@@ -0,0 +1,81 @@
+"""
+Tests that the response media type is negotiated from the Accept header, and that MessagePack
+responses carry the same data as the JSON responses.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Any, NamedTuple
+
+import msgpack
+import pytest
+from app.utils.wire import (
+    JSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    encode,
+    negotiate_media_type,
+    rows_to_plain,
+)
+from conftest import PromptFactory
+from pydantic import BaseModel
+
+
+@pytest.mark.parametrize(
+    ("accept", "media_type"),
+    [
+        (None, JSON_MEDIA_TYPE),
+        ("*/*", JSON_MEDIA_TYPE),
+        ("application/json", JSON_MEDIA_TYPE),
+        ("application/msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/x-msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/json;q=0.5, application/msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/msgpack;q=0.5, application/json", JSON_MEDIA_TYPE),
+        ("application/msgpack, application/json", JSON_MEDIA_TYPE),
+        ("application/*", JSON_MEDIA_TYPE),
+        ("application/msgpack;q=0", JSON_MEDIA_TYPE),
+        ("text/html", JSON_MEDIA_TYPE),
+    ],
+)
+def test_media_type_is_negotiated(accept: str | None, media_type: str) -> None:
+    assert negotiate_media_type(accept) == media_type
+
+
+class Row(NamedTuple):
+    id: int
+    slug: str
+    created_at: datetime
+    extra: str
+
+
+class RowSchema(BaseModel):
+    id: int
+    slug: str
+    created_at: datetime
+
+
+def test_rows_are_encoded_with_the_schema_fields() -> None:
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = [Row(1, "alpha", created_at, "not sent")]
+
+    data = msgpack.unpackb(encode(MSGPACK_MEDIA_TYPE, rows_to_plain(RowSchema, rows)))
+
+    assert data == [{"id": 1, "slug": "alpha", "created_at": created_at.isoformat()}]
+
+
+def test_prompt_is_sent_as_msgpack(
+    client: Any, prompts_url: str, create_prompt: PromptFactory
+) -> None:
+    prompt = create_prompt(f"Packed {uuid.uuid4().hex}.")
+    detail_url = f"{prompts_url}/detail/{prompt['slug']}"
+
+    packed = client.get(detail_url, headers={"Accept": MSGPACK_MEDIA_TYPE})
+    assert packed.status_code == 200
+    assert packed.headers["Content-Type"].startswith(MSGPACK_MEDIA_TYPE)
+    assert "Accept" in packed.headers["Vary"]
+
+    data = msgpack.unpackb(packed.content)
+    assert data["slug"] == prompt["slug"]
+    assert data["revision"]["prompt_text"] == prompt["revision"]["prompt_text"]
+
+    as_json = client.get(detail_url, headers={"Accept": JSON_MEDIA_TYPE})
+    assert as_json.headers["Content-Type"].startswith(JSON_MEDIA_TYPE)
+    assert as_json.json()["revision"]["id"] == data["revision"]["id"]
@@ -3,5 +3,10 @@
 echo "Applying alembic migrations"
 alembic upgrade head || exit 1
 
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    echo "Starting API with ${WEB_CONCURRENCY} pre-forked workers"
+    exec gunicorn -c gunicorn.conf.py app.main:app
+fi
+
 echo "Starting API"
-uvicorn app.main:app --host "0.0.0.0" --port 8000 --proxy-headers --no-server-header
+exec uvicorn app.main:app --host "0.0.0.0" --port 8000 --proxy-headers --no-server-header